@@ -5,24 +5,40 @@
 
 # Maybe python will do better.
 
-import json
+# Each JSON file in this directory is checked against the furnishing
+# schema in lib/furnishing_schema.py, and the files are checked against
+# each other.  Problems are reported by line and column.  See also
+# check_furnishings.py at the top of the repository.
+
 import os
 import os.path
+import sys
+
+# What's the right way to load these?
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                    "..", "..", "..", "lib"))
+
+from furnishing_schema import IntegrityIndex, check_furnishings
 
 
 def main():
-    for f in os.listdir("."):
+    index = IntegrityIndex()
+    for f in sorted(os.listdir(".")):
         if not os.path.isfile(os.path.abspath(f)):
             continue
         if f.split(".")[-1] != "json":
             continue
-        with open(f, "r") as input:
-            try:
-                json.load(input)
-            except json.decoder.JSONDecodeError as e:
-                print("%s: %s\n" %(f, e))
-                pass
+        with open(f, "r", encoding="utf-8") as input:
+            result = check_furnishings(input.read())
             pass
+        for line, column, problem in result["problems"]:
+            print("%s:%d:%d: %s" % (f, line, column, problem))
+            pass
+        index.add(f, result)
+        pass
+    for problem in index.problems():
+        print("%s:%d:%d: %s" % problem)
         pass
     pass
 
@@ -0,0 +1,513 @@
+#!/usr/bin/python3
+
+# Rebuild the generated files of every facility under Facilities.
+#
+# The floor plan pages of a facility are its HTML files that call
+# load_and_draw_things with a list of JSON files.  The data of the
+# page's floor_plan_svg object is the page's SVG floor plan.
+#
+# If the facility has a cleanup_script, the cleanup_inkscape_svg.py
+# command in it is run first to produce the cleaned up SVG file.
+# Then, for each floor plan page, place_things.py prerenders the things
+# into placed_<page>.svg and the item list into placed_<page>.html, and
+# merge_static.py writes merged_<page>.html.
+# If the page names a furnishings bundle as the second argument of
+# load_and_draw_things, the bundle is written too.  Each facility gets
+# a search_index.json of its things, and Facilities/search_index.json
+# combines them.
+#
+# Facilities are built in parallel, one per worker process.  A step
+# is skipped if the files it reads, its arguments and the tools it uses
+# are the same as when it last wrote its output, according to the
+# hashes recorded in the facility's .build_cache.json file.
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import os.path
+import re
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# What's the right way to load these?
+sys.path.insert(
+    0, os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        "lib"))
+
+from atomic_file import *
+from bundle import write_bundle
+from search_index import SearchIndex, SearchIndexBuilder, description_file
+
+from merge_static import merge
+from place_things import prerender
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+FACILITIES_DIRECTORY = os.path.join(ROOT, "Facilities")
+
+CLEANUP = os.path.join(ROOT, "floor_plan_cleanup", "cleanup_inkscape_svg.py")
+
+JAVASCRIPT = os.path.join(ROOT, "placement.js")
+
+CLEANUP_SCRIPT = "cleanup_script"
+
+CACHE_FILE = ".build_cache.json"
+
+SEARCH_INDEX = "search_index.json"
+
+
+parser = argparse.ArgumentParser(
+    prog='build',
+    add_help=True,
+    description='Rebuild the generated files of each facility')
+
+parser.add_argument(
+    "-j",
+    action="store",
+    dest="jobs",
+    type=int,
+    default=None,
+    help="The number of facilities to build at once.  Defaults to the number of processors.")
+
+parser.add_argument(
+    "-force",
+    action="store_true",
+    help="Rebuild everything, even files that are up to date.")
+
+parser.add_argument(
+    "-verbose",
+    action="store_true",
+    help="Show the output of each build step.")
+
+parser.add_argument(
+    "facilities",
+    action="store",
+    nargs="*",
+    help="Names of the facilities to build.  Defaults to all of them.")
+
+
+# Just the cleanup_inkscape_svg.py arguments that name files.
+cleanup_file_arguments = argparse.ArgumentParser(
+    add_help=False, allow_abbrev=False)
+cleanup_file_arguments.add_argument("-input_file", default=None)
+cleanup_file_arguments.add_argument("-output_file", default="cleaned_up.svg")
+cleanup_file_arguments.add_argument("-tiles_directory", default=None)
+
+
+def cleanup_arguments(script):
+    '''Returns the arguments of the cleanup_inkscape_svg.py command in
+    the shell script file script, or None if there isn't one.'''
+    with open(script, "r") as f:
+        text = f.read().replace("\\\n", " ")
+    for line in text.splitlines():
+        words = shlex.split(line, comments=True)
+        for i, word in enumerate(words):
+            if os.path.basename(word) == os.path.basename(CLEANUP):
+                return words[i + 1:]
+    return None
+
+
+LOAD_AND_DRAW_REGEXP = re.compile(
+    r'load_and_draw_things\(\s*(\[[^\]]*\])\s*(?:,\s*"([^"]*)"\s*)?\)',
+    re.DOTALL)
+
+OBJECT_REGEXP = re.compile(r'<object\b[^>]*>', re.DOTALL)
+
+DATA_REGEXP = re.compile(r'\bdata="([^"]*)"')
+
+
+class Page (object):
+    '''A floor plan page: an HTML file, the SVG floor plan it shows and
+    the JSON files of things that it places on it, and the furnishings
+    bundle, if any, that it loads them from.  File names are relative to
+    the facility directory.'''
+    def __init__(self, html, svg, things, bundle=None):
+        self.html = html
+        self.svg = svg
+        self.things = things
+        self.bundle = bundle
+
+    @classmethod
+    def read(cls, directory, html):
+        '''Returns the Page for the HTML file html, or None if it isn't a
+        floor plan page with a literal list of JSON files.'''
+        with open(os.path.join(directory, html), "r") as f:
+            text = f.read()
+        m = LOAD_AND_DRAW_REGEXP.search(text)
+        if not m:
+            return None
+        try:
+            things = json.loads(m.group(1))
+        except ValueError:
+            return None
+        svg = None
+        for o in OBJECT_REGEXP.findall(text):
+            if 'id="floor_plan_svg"' in o:
+                d = DATA_REGEXP.search(o)
+                if d:
+                    svg = d.group(1)
+                    break
+        if svg is None:
+            return None
+        return cls(html, svg, things, m.group(2))
+
+    def stem(self):
+        return os.path.splitext(self.html)[0]
+
+    def placed(self):
+        return "placed_" + self.stem() + ".svg"
+
+    def placed_html(self):
+        return "placed_" + self.html
+
+    def merged(self):
+        return "merged_" + self.html
+
+
+class Facility (object):
+    '''Facility describes what is to be built in a facility directory.'''
+    def __init__(self, directory):
+        self.directory = directory
+        self.name = os.path.basename(directory)
+        self.cleanup = None
+        script = os.path.join(directory, CLEANUP_SCRIPT)
+        if os.path.exists(script):
+            self.cleanup = cleanup_arguments(script)
+        self.pages = []
+        for f in sorted(os.listdir(directory)):
+            if (f.endswith(".html") and not f.startswith("merged_") and
+                not f.startswith("placed_")):
+                page = Page.read(directory, f)
+                if page:
+                    self.pages.append(page)
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def outputs(self):
+        '''Returns the set of the files that building the facility can
+        write.'''
+        outputs = set([self.path(CACHE_FILE)])
+        if self.cleanup is not None:
+            files, arguments = cleanup_file_arguments.parse_known_args(
+                self.cleanup)
+            outputs.add(self.path(files.output_file))
+            if files.tiles_directory:
+                tiles = self.path(files.tiles_directory)
+                for directory, subdirectories, filenames in os.walk(tiles):
+                    outputs.update([os.path.join(directory, f)
+                                    for f in filenames])
+        for page in self.pages:
+            outputs.add(self.path(page.placed()))
+            outputs.add(self.path(page.placed_html()))
+            outputs.add(self.path(page.merged()))
+            if page.bundle:
+                outputs.add(self.path(page.bundle))
+        if self.pages:
+            outputs.add(self.path(SEARCH_INDEX))
+        return outputs
+
+    def things_files(self):
+        '''Returns the list of the JSON files of all of the pages, and
+        the page that shows each.'''
+        files = []
+        for page in self.pages:
+            for t in page.things:
+                if t not in [f for f, p in files]:
+                    files.append((t, page))
+        return files
+
+    def page_groups(self, files):
+        '''Returns the lists of the files, furnishing files of the
+        facility, that are shown together: the ones that each page loads,
+        and then each of the others on its own.  A file that several
+        pages load is in each of their lists.'''
+        paths = dict([(os.path.abspath(f), f) for f in files])
+        groups = []
+        loaded = set()
+        for page in self.pages:
+            group = [paths[p] for p in
+                     [os.path.abspath(self.path(t)) for t in page.things]
+                     if p in paths]
+            if group:
+                groups.append(group)
+                loaded.update(group)
+        return groups + [[f] for f in files if f not in loaded]
+
+    def search_inputs(self):
+        '''Returns the list of files that the search index is made from.'''
+        inputs = []
+        for t, page in self.things_files():
+            things_file = self.path(t)
+            inputs.append(things_file)
+            with open(things_file, "r") as f:
+                things = json.load(f)
+            for thing in things:
+                if isinstance(thing, dict):
+                    d = description_file(thing, things_file)
+                    if d and d not in inputs:
+                        inputs.append(d)
+        return inputs
+
+    def __repr__(self):
+        return "Facility(%r)" % self.name
+
+
+def discover_facilities(directory=FACILITIES_DIRECTORY):
+    return [Facility(os.path.join(directory, d))
+            for d in sorted(os.listdir(directory))
+            if os.path.isdir(os.path.join(directory, d))]
+
+
+class BuildResult (object):
+    '''The outcome of building one facility.'''
+    def __init__(self, name):
+        self.name = name
+        # A list of (step, seconds) pairs.
+        self.timings = []
+        self.log = []
+        self.error = None
+
+    def total(self):
+        return sum([t for step, t in self.timings])
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# The files of each tool, including the lib modules that they all use.
+# Any change to them invalidates what the tool has built.
+LIB_FILES = sorted([f for f in glob.glob(os.path.join(ROOT, "lib", "*.py"))
+                    if os.path.basename(f) != "test.py"])
+
+TOOL_FILES = {
+    "cleanup": [CLEANUP] + LIB_FILES,
+    "place": [os.path.join(ROOT, "place_things.py")] + LIB_FILES,
+    "merge": [os.path.join(ROOT, "merge_static.py")] + LIB_FILES,
+    "bundle": LIB_FILES,
+    "search": LIB_FILES
+}
+
+
+class BuildCache (object):
+    '''BuildCache remembers, for each file that was built in a facility
+    directory, a key that hashes everything that it was built from, and
+    a hash of the file as it was written.  A build step can be skipped if
+    its key is unchanged and its output hasn't been changed since.'''
+
+    # Increment this to invalidate every cache.
+    VERSION = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, CACHE_FILE)
+        self.entries = {}
+        self.tool_hashes = {}
+        try:
+            with open(self.path, "r") as f:
+                cache = json.load(f)
+            if cache.get("version") == self.VERSION:
+                self.entries = cache["entries"]
+        except (OSError, ValueError):
+            pass
+
+    def tool_hash(self, tool):
+        h = self.tool_hashes.get(tool)
+        if h is None:
+            h = hashlib.sha256()
+            for f in TOOL_FILES[tool]:
+                h.update(file_hash(f).encode())
+            h = self.tool_hashes[tool] = h.hexdigest()
+        return h
+
+    def key(self, tool, inputs, arguments=[]):
+        '''Returns the key of a build step that uses tool to read the
+        files inputs, given arguments.'''
+        h = hashlib.sha256()
+        h.update(json.dumps([
+            self.VERSION, tool, self.tool_hash(tool),
+            [(os.path.relpath(i, self.directory), file_hash(i))
+             for i in inputs],
+            arguments]).encode())
+        return h.hexdigest()
+
+    def up_to_date(self, output, key):
+        entry = self.entries.get(os.path.relpath(output, self.directory))
+        return (entry is not None and entry["key"] == key and
+                os.path.exists(output) and entry["hash"] == file_hash(output))
+
+    def record(self, output, key):
+        self.entries[os.path.relpath(output, self.directory)] = {
+            "key": key,
+            "hash": file_hash(output)
+        }
+
+    def save(self):
+        with atomic_open(self.path, "w") as f:
+            json.dump({ "version": self.VERSION, "entries": self.entries },
+                      f, indent=2, sort_keys=True)
+
+
+def run_cleanup(facility, result, arguments, output):
+    '''Run the cleanup to write output.  The cleanup replaces output only
+    once it has written all of it, and records its command line in it,
+    so it's given output itself, and only if it isn't the default, so
+    that the command line reads as the facility's cleanup script has
+    it.'''
+    output = os.path.relpath(output, facility.directory)
+    if output != cleanup_file_arguments.get_default("output_file"):
+        arguments = ["-output_file", output] + arguments
+    command = ([sys.executable, os.path.relpath(CLEANUP, facility.directory)]
+               + arguments)
+    p = subprocess.run(command, cwd=facility.directory,
+                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                       universal_newlines=True)
+    result.log.append(p.stdout)
+    if p.returncode != 0:
+        raise Exception("%s failed with status %d" % (
+            CLEANUP_SCRIPT, p.returncode))
+
+
+def build_facility(facility, force=False):
+    '''Build the generated files of facility.  This is run in a worker
+    process.  Steps whose inputs haven't changed since they were last run
+    are skipped unless force is true.  Returns a BuildResult.'''
+    result = BuildResult(facility.name)
+    cache = BuildCache(facility.directory)
+    def step(name, tool, inputs, arguments, outputs, fun, *args):
+        start = time.perf_counter()
+        try:
+            key = cache.key(tool, inputs, arguments)
+            if not force and all([cache.up_to_date(output, key)
+                                  for output in outputs]):
+                name += " (up to date)"
+                return
+            fun(*args)
+            for output in outputs:
+                cache.record(output, key)
+        finally:
+            result.timings.append((name, time.perf_counter() - start))
+    try:
+        if facility.cleanup is not None:
+            files, arguments = cleanup_file_arguments.parse_known_args(
+                facility.cleanup)
+            input_file = files.input_file and facility.path(files.input_file)
+            if input_file and os.path.exists(input_file):
+                arguments = ["-input_file", files.input_file] + arguments
+                if files.tiles_directory:
+                    arguments += ["-tiles_directory", files.tiles_directory]
+                output = facility.path(files.output_file)
+                step("cleanup", "cleanup", [input_file], arguments, [output],
+                     run_cleanup, facility, result, arguments, output)
+            else:
+                result.log.append("cleanup: skipped, no input file %s" %
+                                  files.input_file)
+        for page in facility.pages:
+            svg = facility.path(page.svg)
+            things = [facility.path(t) for t in page.things]
+            html = facility.path(page.html)
+            placed = facility.path(page.placed())
+            placed_html = facility.path(page.placed_html())
+            step("place " + page.stem(), "place", [html, svg] + things, [],
+                 [placed, placed_html],
+                 prerender, html, svg, things, placed, placed_html)
+            if page.bundle:
+                bundle = facility.path(page.bundle)
+                step("bundle " + page.stem(), "bundle", things, [], [bundle],
+                     write_bundle, things, bundle)
+            merged = facility.path(page.merged())
+            step("merge " + page.stem(), "merge",
+                 [html, JAVASCRIPT, svg] + things, [], [merged],
+                 merge, html, JAVASCRIPT, svg, things, merged)
+        if facility.pages:
+            step("search index", "search", facility.search_inputs(), [],
+                 [facility.path(SEARCH_INDEX)], write_search_index, facility)
+    except Exception as e:
+        result.error = "%s: %s" % (e.__class__.__name__, e)
+    finally:
+        cache.save()
+    return result
+
+
+def write_search_index(facility):
+    builder = SearchIndexBuilder()
+    seen = set()
+    for t, page in facility.things_files():
+        builder.add_things_file(facility.path(t), facility.name, page.html,
+                                seen)
+    builder.index(facility.directory).write(facility.path(SEARCH_INDEX))
+
+
+def write_combined_search_index(directory=FACILITIES_DIRECTORY):
+    '''Write the search index of all of the facilities in directory from
+    their own search indices, unless it is up to date.  Returns True if
+    it was written.'''
+    facilities = [f for f in discover_facilities(directory)
+                  if os.path.exists(f.path(SEARCH_INDEX))]
+    inputs = [f.path(SEARCH_INDEX) for f in facilities]
+    output = os.path.join(directory, SEARCH_INDEX)
+    cache = BuildCache(directory)
+    key = cache.key("search", inputs)
+    if cache.up_to_date(output, key):
+        return False
+    builder = SearchIndexBuilder()
+    for f in facilities:
+        builder.add_index(SearchIndex.read(f.path(SEARCH_INDEX)),
+                          f.name + "/")
+        builder.add_source(f.path(SEARCH_INDEX))
+    builder.index(directory).write(output)
+    cache.record(output, key)
+    cache.save()
+    return True
+
+
+def report(result, verbose=False):
+    print("%s: %.2fs%s" % (result.name, result.total(),
+                           " FAILED" if result.error else ""))
+    for name, t in result.timings:
+        print("    %-40s %6.2fs" % (name, t))
+    if verbose or result.error:
+        for log in result.log:
+            print(log)
+    if result.error:
+        print("    " + result.error)
+
+
+def main():
+    args = parser.parse_args()
+    facilities = discover_facilities()
+    if args.facilities:
+        unknown = set(args.facilities) - set([f.name for f in facilities])
+        if unknown:
+            parser.error("Unknown facilities: %s" % ", ".join(sorted(unknown)))
+        facilities = [f for f in facilities if f.name in args.facilities]
+    start = time.perf_counter()
+    failed = False
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(build_facility, f, args.force) for f in facilities]
+        for future in as_completed(futures):
+            result = future.result()
+            report(result, args.verbose)
+            failed = failed or result.error is not None
+    if write_combined_search_index():
+        print("Wrote %s" % os.path.join(FACILITIES_DIRECTORY, SEARCH_INDEX))
+    print("Built %d facilities in %.2fs" % (
+        len(facilities), time.perf_counter() - start))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,18 @@
 #!/usr/bin/python3
 
 import argparse
+import csv
 import json
+import os
+import os.path
+import sys
+
+# What's the right way to load these?
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib"))
+
+from atomic_file import atomic_open
+from furnishings import furnishing_files
 
 parser = argparse.ArgumentParser(
     prog='bump',
@@ -40,54 +51,176 @@ parser.add_argument(
     "-file",
     action="append",
     dest="files",
+    default=[],
     help="Specifies a JSON file to modify.  Can be specified multiple times.")
 
+parser.add_argument(
+    "-directory",
+    action="append",
+    dest="directories",
+    default=[],
+    help="""Modify the items in any of the JSON files in or under this directory,
+for instance a facility directory.  Can be specified multiple times.""")
+
+parser.add_argument(
+    "-moves",
+    action="store",
+    dest="moves",
+    help="""A CSV or JSON file of moves to make.  Each move has a unique_id and
+any of x, y, dx, dy and rotation.  A CSV file has a header line naming
+its columns.  A JSON file is a list of objects.""")
+
 parser.add_argument(
     "items",
     action="store",
-    nargs="+",
+    nargs="*",
     help="unique_id of the items to modify")
 
 
-def move_item(item, args):
-    if args.x != None:
-        item["x"] = args.x
-    elif args.dx != None:
-        item["x"] += args.dx
+# The properties of a move, besides unique_id.
+MOVE_PROPERTIES = ("x", "y", "dx", "dy", "rotation")
+
+
+def move_item(item, move):
+    '''Apply move, a dict with any of the MOVE_PROPERTIES, to item.'''
+    if move.get("x") != None:
+        item["x"] = move["x"]
+    elif move.get("dx") != None:
+        item["x"] += move["dx"]
+        pass
+    if move.get("y") != None:
+        item["y"] = move["y"]
+    elif move.get("dy") != None:
+        item["y"] += move["dy"]
         pass
-    if args.y != None:
-        item["y"] = args.y
-    elif args.dy != None:
-        item["y"] += args.dy
+    if move.get("rotation") != None:
+        item["rotation"] = move["rotation"]
         pass
     pass
 
 
-def process_file(f, args):
-    print("Processing %s" % f)
-    with open(f, "r") as io:
-        data = json.load(io)
+def number(s):
+    '''Parse a number from a move script.'''
+    try:
+        return int(s)
+    except ValueError:
+        return float(s)
+
+
+def read_moves(f):
+    '''Returns the list of the moves in the move script f.  Each move is
+    a dict with a unique_id and any of the MOVE_PROPERTIES.'''
+    with open(f, "r", newline="") as io:
+        if os.path.splitext(f)[1].lower() == ".json":
+            rows = json.load(io)
+        else:
+            rows = list(csv.DictReader(io))
+            pass
+        pass
+    moves = []
+    for row in rows:
+        unique_id = row.get("unique_id") if isinstance(row, dict) else None
+        if unique_id in (None, ""):
+            raise ValueError("%s: move without a unique_id: %r" % (f, row))
+        move = { "unique_id": unique_id }
+        for p in MOVE_PROPERTIES:
+            value = row.get(p)
+            if isinstance(value, str):
+                value = number(value) if value.strip() else None
+                pass
+            if value != None:
+                move[p] = value
+                pass
+            pass
+        moves.append(move)
         pass
-    for item in data:
-        if item["unique_id"] in args.items:
-            move_item(item, args)
+    return moves
+
+
+class ItemIndex (object):
+    '''ItemIndex reads a set of JSON files once and maps each unique_id
+    to the items that have it.'''
+    def __init__(self, files):
+        # Maps each file to the data read from it.
+        self.data = {}
+        # Maps each unique_id to a list of (file, item) pairs.
+        self.items = {}
+        for f in files:
+            if f in self.data:
+                continue
+            with open(f, "r") as io:
+                data = json.load(io)
+                pass
+            self.data[f] = data
+            if not isinstance(data, list):
+                continue
+            for item in data:
+                if isinstance(item, dict) and "unique_id" in item:
+                    self.items.setdefault(item["unique_id"], []).append(
+                        (f, item))
+                    pass
+                pass
             pass
         pass
-    with open(f, "w") as io:
-        json.dump(data, io, indent=4)
+
+    def apply(self, moves):
+        '''Apply each of moves to the items with its unique_id.  Returns
+        the set of the files that were changed and the list of the
+        unique_ids that weren't found.'''
+        changed = set()
+        missing = []
+        for move in moves:
+            found = self.items.get(move["unique_id"])
+            if not found:
+                if move["unique_id"] not in missing:
+                    missing.append(move["unique_id"])
+                    pass
+                continue
+            for f, item in found:
+                move_item(item, move)
+                changed.add(f)
+                pass
+            pass
+        return changed, missing
+
+    def write(self, f):
+        with atomic_open(f, "w") as io:
+            json.dump(self.data[f], io, indent=4)
+            pass
         pass
-    pass    
 
 
 def main():
     args = parser.parse_args()
-    print(args)
-    for f in args.files:
-        process_file(f, args)
+    files = list(args.files)
+    for d in args.directories:
+        files += furnishing_files(d)
+        pass
+    if not files:
+        parser.error("Specify the files to modify with -file or -directory")
+    if args.moves:
+        if args.items:
+            parser.error("Items can't be specified with -moves")
+        moves = read_moves(args.moves)
+    elif args.items:
+        move = vars(args)
+        moves = [dict(move, unique_id=item) for item in args.items]
+    else:
+        parser.error("Specify the items to move, or -moves")
+    index = ItemIndex(files)
+    changed, missing = index.apply(moves)
+    # Each file is only written once, however many of its items moved.
+    for f in index.data:
+        if f in changed:
+            print("Updating %s" % f)
+            index.write(f)
+            pass
         pass
+    if missing:
+        print("Not found: %s" % " ".join(missing), file=sys.stderr)
+        sys.exit(1)
     pass
 
-    
+
 if __name__ == '__main__':
     main()
-
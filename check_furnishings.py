@@ -0,0 +1,78 @@
+# Check the furnishing files of the facilities against the schema in
+# lib/furnishing_schema.py, and check the files of each facility
+# against each other: that no unique_id is used twice among the files
+# that a page of the facility loads together, see build.py, and that
+# every description_uri refers to a file that's there.
+#
+# Problems are reported as file:line:column: problem.
+
+import argparse
+import os.path
+import sys
+
+# What's the right way to load these?
+sys.path.insert(
+  0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib"))
+
+from build import Facility
+from furnishings import facility_directory, furnishing_files
+from furnishing_schema import IntegrityIndex, check_furnishings
+
+FACILITIES_DIRECTORY = os.path.join(
+  os.path.dirname(os.path.abspath(__file__)), "Facilities")
+
+
+parser = argparse.ArgumentParser(
+  description='''Check furnishing files for problems.''')
+
+parser.add_argument(
+  "files", nargs="*",
+  help='''The furnishing files or directories to check.  Defaults to every
+facility.  The other files of the facility a file is in are read too, to
+check it against them, but only the problems in the named files are
+reported.''')
+
+
+def main():
+  args = parser.parse_args()
+  files = []
+  for f in args.files or [FACILITIES_DIRECTORY]:
+    if os.path.isdir(f):
+      files += furnishing_files(f)
+    else:
+      files.append(f)
+  files = [os.path.relpath(f) for f in files]
+  named = set(files)
+  # Every file of each facility, grouped by facility.
+  facilities = {}
+  for f in files:
+    facility = facility_directory(os.path.abspath(f))
+    if facility not in facilities:
+      facilities[facility] = ([os.path.relpath(g)
+                               for g in furnishing_files(facility)]
+                              if facility else [])
+    if f not in facilities[facility]:
+      facilities[facility].append(f)
+  problems = []
+  for facility, facility_files in sorted(facilities.items(),
+                                         key=lambda x: x[0] or ""):
+    groups = None
+    if facility:
+      groups = Facility(facility).page_groups(facility_files)
+    index = IntegrityIndex(groups=groups)
+    for f in facility_files:
+      with open(f, "r", encoding="utf-8") as io:
+        result = check_furnishings(io.read())
+      index.add(f, result)
+      if f in named:
+        for line, column, problem in result["problems"]:
+          problems.append((f, line, column, problem))
+    problems += index.problems(named)
+  for problem in sorted(problems):
+    print("%s:%d:%d: %s" % problem)
+  if problems:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
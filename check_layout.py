@@ -0,0 +1,131 @@
+# Find the items on each floor plan page that overlap each other or
+# that are outside the floor plan.
+#
+# Each item's footprint is worked out as placement.js would draw it,
+# see lib/footprint.py, and the bounds of the floor plan are the
+# viewBox of its SVG file, which the cleanup clips to the floor plan.
+#
+# Problems are reported as file:line:column: problem.
+
+import argparse
+import os.path
+import sys
+
+# What's the right way to load these?
+sys.path.insert(
+  0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib"))
+
+from build import discover_facilities, FACILITIES_DIRECTORY
+from floor_plan import FloorPlan
+from footprint import OVERLAP_TOLERANCE, Footprint, overlapping_pairs
+from json_text import LineIndex, array_elements
+
+
+parser = argparse.ArgumentParser(
+  description='''Find the items that overlap each other or are outside
+the floor plan.''')
+
+parser.add_argument(
+  "-tolerance", type=float, default=OVERLAP_TOLERANCE,
+  help='''Items only overlap if they overlap by more than this, in the
+units of the floor plan.  Defaults to %(default)s.''')
+
+parser.add_argument(
+  "-ignore_class", action="append", dest="ignore_classes", default=[],
+  help='''Leave out the items with this cssClass, for instance ones that
+are meant to be on top of others.  Can be specified multiple times.''')
+
+parser.add_argument(
+  "facilities", nargs="*",
+  help='''The names or directories of the facilities to check.  Defaults to
+all of them.''')
+
+
+def read_footprints(directory, things_files, ignore_classes):
+  '''Returns the Footprints of the items in things_files.  The key of
+  each is (file, line, column, name).'''
+  footprints = []
+  for f in things_files:
+    path = os.path.relpath(os.path.join(directory, f))
+    with open(path, "r", encoding="utf-8") as io:
+      text = io.read()
+    lines = LineIndex(text)
+    for item, start, end in array_elements(text):
+      if not isinstance(item, dict):
+        continue
+      if item.get("cssClass") in ignore_classes:
+        continue
+      key = ((path,) + lines.location(start) +
+             (str(item.get("name", item.get("unique_id", ""))),))
+      try:
+        footprint = Footprint.of_item(key, item)
+      except Exception as e:
+        print("%s:%d:%d: %s: %s" % (key + (e,)))
+        continue
+      if footprint:
+        footprints.append(footprint)
+  return footprints
+
+
+def check_page(facility, page, tolerance, ignore_classes):
+  '''Returns a list of (file, line, column, problem) for the problems
+  with the layout of the page.'''
+  problems = []
+  footprints = read_footprints(facility.directory, page.things,
+                               ignore_classes)
+  for a, b in overlapping_pairs(footprints, tolerance):
+    a, b = sorted([a.key, b.key])
+    problems.append(a[:3] + ("%s overlaps %s at %s:%d:%d" % (
+      a[3], b[3], b[0], b[1], b[2]),))
+  svg_file = facility.path(page.svg)
+  if not os.path.exists(svg_file):
+    return problems
+  plan = FloorPlan.read(svg_file)
+  if plan.box is None:
+    return problems
+  for footprint in footprints:
+    where = footprint.transformed(plan.real_world).within(
+      plan.box, tolerance * plan.real_world.max_stretch())
+    if where != "inside":
+      problems.append(footprint.key[:3] + ("%s is %s the floor plan" % (
+        footprint.key[3], where),))
+  return problems
+
+
+def chosen_facilities(names):
+  '''Returns the facilities named by names, each the name or the
+  directory of a facility, or all of them if names is empty.'''
+  facilities = discover_facilities(FACILITIES_DIRECTORY)
+  if not names:
+    return facilities
+  chosen = []
+  unknown = []
+  for name in names:
+    for facility in facilities:
+      if (name == facility.name or
+          os.path.realpath(name) == os.path.realpath(facility.directory)):
+        if facility not in chosen:
+          chosen.append(facility)
+        break
+    else:
+      unknown.append(name)
+  if unknown:
+    parser.error("Unknown facilities: %s" % ", ".join(unknown))
+  return chosen
+
+
+def main():
+  args = parser.parse_args()
+  problems = set()
+  for facility in chosen_facilities(args.facilities):
+    for page in facility.pages:
+      problems.update(check_page(facility, page, args.tolerance,
+                                 args.ignore_classes))
+  for problem in sorted(problems):
+    print("%s:%d:%d: %s" % problem)
+  if problems:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
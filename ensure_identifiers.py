@@ -1,97 +1,68 @@
-
 # Assign unique identifiers to any items that don't have one.
+#
+# New ids are allocated from a registry of every unique_id in every
+# furnishing file under Facilities, so that no two items in any
+# facility get the same one.  See lib/id_registry.py.
+
+import argparse
+import os.path
+import sys
 
-import glob
-import json
-import parse    # pip install parse
+# What's the right way to load these?
+sys.path.insert(
+  0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib"))
 
-NEXT_ID = 1
+from atomic_file import atomic_open
+from id_registry import *
 
-UID_FORMAT = "_x_{uid:04d}"
+FACILITIES_DIRECTORY = os.path.join(
+  os.path.dirname(os.path.abspath(__file__)), "Facilities")
 
-UNIQUE_ID_FIELD_NAME = "unique_id"
 
-FIELD_PRECEEDING_UNIQUE_ID = "name"
+parser = argparse.ArgumentParser(
+  description='''Assign a unique_id to each item that doesn't have one.''')
 
-REQUIRED_ITEM_FIELDS = [
-  # We exclude width and depth because some items are described by a
-  # path, rather than a rectrangle.
-  "name", "cssClass", "x", "y"
-  ]
+parser.add_argument(
+  "files", nargs="*",
+  help='''The furnishing files or directories to assign ids in.  Defaults to
+every facility.''')
 
 
-def is_item(item):
-  for field in REQUIRED_ITEM_FIELDS:
-    if not field in item:
-      return False
-  return True
+def in_any(path, places):
+  '''Returns True iff path is one of, or is under one of, places.'''
+  path = os.path.abspath(path)
+  for place in places:
+    place = os.path.abspath(place)
+    if path == place or path.startswith(place.rstrip(os.sep) + os.sep):
+      return True
+  return False
 
 
 def main():
-  global NEXT_ID
-  # Process all json files in the working directory:
-  json_files = []
-  # Load and scan all JSON files for missing unique_id fields to
-  # determine next unused unique id number.
-  for filename in glob.glob("*.json"):
-    print(filename)
-    items = None
-    any = False
+  args = parser.parse_args()
+  registry = IdRegistry(FACILITIES_DIRECTORY)
+  for filename in registry.scan():
+    print("Scanned %s" % filename)
+  for uid, names in sorted(registry.collisions().items()):
+    print("unique_id %s is used more than once, in %s" % (
+      uid, ", ".join(names)))
+  print("Next id: %d" % registry.next_id)
+  places = args.files or [FACILITIES_DIRECTORY]
+  # Only the files the registry says have items without ids are read
+  # and rewritten.
+  for filename in registry.files_missing_ids():
+    if not in_any(filename, places):
+      continue
     with open(filename, "r") as f:
-      items = json.load(f)
-      for item in items:
-        if not is_item(item):
-          print("Not an item: %r" % item)
-          continue
-        uid = item.get(UNIQUE_ID_FIELD_NAME, "")
-        if uid == "":
-          any = True
-        else:
-          # After we've read all the JSON files, NEXT_ID should be
-          # greater than any unique id previously assigned by this
-          # program.
-          try:
-            parsed = parse.parse(UID_FORMAT, uid)
-          except Exception as e:
-            print("alternate unique_id: %s: %s:\n%s\n" % (e, uid, item))
-            continue
-          if parsed:
-            this_id = parsed["uid"]
-            if this_id >= NEXT_ID:
-              NEXT_ID = this_id + 1
-    if any:
-      json_files.append((filename, items))
-    else:
-      print("  No empty unique ids")
-  print("Next id: %d" % NEXT_ID)
-  # Set missing unique ids and rewrite updated JSON files.
-  for (filename, items) in json_files:
-    count = 0
-    for i in range(len(items)):
-      item = items[i]
-      if not is_item(item):
-        continue
-      if item.get(UNIQUE_ID_FIELD_NAME, "") == "":
-        # unique_id canonically appears right after name.  By
-        # inserting it there rather than at the end, as would happen
-        # if we just added the field, we avoid creating a diff for the
-        # line that would have preceeded it due to the addition of a
-        # comma.
-        updated_item = {}
-        for k, v in item.items():
-          if k == FIELD_PRECEEDING_UNIQUE_ID:
-            updated_item[k] = v
-            updated_item[UNIQUE_ID_FIELD_NAME] = UID_FORMAT.format(uid=NEXT_ID)
-            NEXT_ID += 1
-            count += 1
-          else:
-            updated_item[k] = v
-        items[i] = updated_item
-    with open(filename, "w") as f:
-      json.dump(items, f, indent=4)
+      text = f.read()
+    text, count = add_unique_ids(text, registry.allocate)
+    if count:
+      with atomic_open(filename, "w") as f:
+        f.write(text)
     print("%d ids assigned in %s" % (count, filename))
-          
+  registry.scan()
+  registry.save()
+
 
 if __name__ == "__main__":
   main()
-
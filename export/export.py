@@ -1,72 +1,352 @@
-# Export the JSON data to a CSV file so they can plan the layout of
-# the new shop.
+# Export the JSON data to CSV, TSV, JSON Lines or SQLite files so they
+# can plan the layout of the new shop.
+#
+# Every item of every furnishing file is written to every output in one
+# pass.  Each file's items are decoded one at a time, see
+# lib/json_text.py, and each row is written as soon as it's made, so
+# however many items there are only one file and a batch of rows are
+# held in memory.
 
+import argparse
+import contextlib
 import csv
 import json
 import os
 import os.path
+import sqlite3
+import sys
+
+# What's the right way to load these?
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), "lib"))
+
+from atomic_file import atomic_output
+from footprint import Footprint, is_number
+from furnishings import facility_directory, furnishing_files
+from json_text import array_elements
 
 
 INPUT_DIRECTORY = "furnashings"
 
-OUTPUT_FILE = "everything.csv"
+FACILITIES_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "Facilities")
+
+# The tab separated file that the spreadsheet has always been made from.
+OUTPUT_FILE = "tsv:everything.csv"
+
+# The columns that the spreadsheet has always had.
+DEFAULT_FIELDS = "name,id,width,depth"
+
+# The -fields that exports every one of HEADINGS.
+ALL_FIELDS = "all"
 
 CSV_WRITER_PARAMS = {
     "delimiter": "\t",
     "lineterminator": "\n"
 }
 
+# The number of rows that are inserted into an SQLite table at a time.
+SQLITE_BATCH_SIZE = 1000
+
+class Record:
+    '''An item to export, the furnishing file it's from and the facility
+    that file belongs to.  The bounding box of the item's footprint is
+    only worked out if a heading asks for it.'''
+    def __init__(self, item, filename, facility):
+        self.item = item
+        self.filename = filename
+        self.facility = facility
+        self.footprint = False
+
+    def get(self, field):
+        return self.item.get(field)
+
+    def box(self):
+        if self.footprint is False:
+            try:
+                self.footprint = Footprint.of_item(None, self.item)
+            except Exception:
+                self.footprint = None
+        if self.footprint is None:
+            return None
+        return self.footprint.box
+
 class Heading:
-    def __init__(self, heading, json=None, convert=lambda x: x):
+    '''A column of the export.  Its value is the json property of each
+    item, or what compute returns for the Record, passed through convert.
+    length is True for values that are lengths, which can be converted
+    to other units.'''
+    def __init__(self, heading, json=None, convert=lambda x: x,
+                 compute=None, length=False, sql_type="TEXT"):
         self.heading = heading
         self.json = json
         self.convert = convert
+        self.compute = compute
+        self.length = length
+        self.sql_type = sql_type
 
-    def value(self, json_record):
+    def value(self, record):
+        if self.compute != None:
+            return self.convert(self.compute(record))
         if self.json == None:
             return None
-        return self.convert(json_record.get(self.json))
+        return self.convert(record.get(self.json))
+
+    def in_units(self, units):
+        '''Returns this Heading with its values in units.'''
+        if not self.length or units == "feet":
+            return self
+        return Heading(self.heading, self.json,
+                       lambda x: feet_to_inches(self.convert(x)),
+                       self.compute, self.length, self.sql_type)
 
 def feet_to_inches(feet):
-    if feet == None:
-        return ""
+    if not is_number(feet):
+        return feet
     return feet * 12
 
-SPREADSHET_HEADINGS = [
+def box_field(field):
+    def compute(record):
+        box = record.box()
+        if box is None:
+            return None
+        return getattr(box, field)
+    return compute
+
+# Every column that can be exported, in the order they're exported in.
+# minX, minY, maxX and maxY are the bounding box of each item's
+# footprint, rotated and placed as on the floor plan.
+HEADINGS = [
+    Heading("facility", compute=lambda r: r.facility),
+    Heading("file", compute=lambda r: r.filename),
     Heading("name", "name"),
     Heading("id", "unique_id"),
-    Heading("width", "width", feet_to_inches),
-    Heading("depth", "depth", feet_to_inches)
+    Heading("cssClass", "cssClass"),
+    Heading("clustermarket_id", "clustermarket_id"),
+    Heading("width", "width", length=True, sql_type="REAL"),
+    Heading("depth", "depth", length=True, sql_type="REAL"),
+    Heading("x", "x", length=True, sql_type="REAL"),
+    Heading("y", "y", length=True, sql_type="REAL"),
+    Heading("rotation", "rotation", sql_type="REAL"),
+    Heading("minX", compute=box_field("minX"), length=True,
+            sql_type="REAL"),
+    Heading("minY", compute=box_field("minY"), length=True,
+            sql_type="REAL"),
+    Heading("maxX", compute=box_field("maxX"), length=True,
+            sql_type="REAL"),
+    Heading("maxY", compute=box_field("maxY"), length=True,
+            sql_type="REAL"),
+    Heading("path_d", "path_d"),
+    Heading("description", "description"),
+    Heading("description_uri", "description_uri"),
+    Heading("booking_note", "booking_note"),
+    Heading("measured", "measured"),
+    Heading("contents", "contents")
 ]
 
-def export_thing(thing, csvwriter):
-    row = []
-    for cell in SPREADSHET_HEADINGS:
-        row.append(cell.value(thing))
-    csvwriter.writerow(row)
+def heading_named(name):
+    '''Returns the Heading called name.  A name that isn't one of
+    HEADINGS is taken to be the name of a property of the items.'''
+    for heading in HEADINGS:
+        if heading.heading == name:
+            return heading
+    return Heading(name, name)
+
+def headings_for(fields):
+    '''Returns the Headings of the -fields argument fields, the comma
+    separated names of the columns, or ALL_FIELDS for all of HEADINGS.'''
+    if fields.strip() == ALL_FIELDS:
+        return HEADINGS
+    return [heading_named(name.strip())
+            for name in fields.split(",") if name.strip()]
+
+def cell_text(value):
+    '''Lists and objects, like contents, are written as JSON.'''
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+class DelimitedWriter:
+    def __init__(self, filename, headings, delimiter):
+        self.out = open(filename, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.out, **dict(
+            CSV_WRITER_PARAMS, delimiter=delimiter))
+        self.writer.writerow([heading.heading for heading in headings])
+
+    def write(self, row):
+        self.writer.writerow([cell_text(value) for value in row])
+
+    def close(self):
+        self.out.close()
+
+class JsonLinesWriter:
+    def __init__(self, filename, headings):
+        self.out = open(filename, "w", encoding="utf-8")
+        self.headings = [heading.heading for heading in headings]
+
+    def write(self, row):
+        self.out.write(json.dumps(dict(zip(self.headings, row)),
+                                  ensure_ascii=False))
+        self.out.write("\n")
+
+    def close(self):
+        self.out.close()
+
+class SqliteWriter:
+    '''Writes the rows to a table called items.'''
+    def __init__(self, filename, headings):
+        self.connection = sqlite3.connect(filename)
+        # The file is new, and is only kept if the export finishes.
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("CREATE TABLE items (%s)" % ", ".join(
+            ['"%s" %s' % (heading.heading.replace('"', '""'),
+                          heading.sql_type)
+             for heading in headings]))
+        self.insert = "INSERT INTO items VALUES (%s)" % ", ".join(
+            ["?"] * len(headings))
+        self.batch = []
+
+    def write(self, row):
+        self.batch.append([cell_text(value) for value in row])
+        if len(self.batch) >= SQLITE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.connection.executemany(self.insert, self.batch)
+        self.batch = []
+
+    def close(self):
+        self.flush()
+        self.connection.commit()
+        self.connection.close()
+
+# How to write the files of each format.
+FORMATS = {
+    "csv": lambda f, headings: DelimitedWriter(f, headings, ","),
+    "tsv": lambda f, headings: DelimitedWriter(f, headings, "\t"),
+    "jsonl": JsonLinesWriter,
+    "sqlite": SqliteWriter
+}
+
+EXTENSIONS = {
+    ".csv": "csv",
+    ".tsv": "tsv",
+    ".txt": "tsv",
+    ".jsonl": "jsonl",
+    ".sqlite": "sqlite",
+    ".sqlite3": "sqlite",
+    ".db": "sqlite"
+}
+
+def output_format(output):
+    '''Returns the format and file name of the -output argument output,
+    which is FORMAT:FILE or just FILE.'''
+    format, colon, filename = output.partition(":")
+    if colon and format in FORMATS:
+        return format, filename
+    extension = os.path.splitext(output)[-1].lower()
+    if extension not in EXTENSIONS:
+        raise argparse.ArgumentTypeError(
+            "can't tell the format of %s, try one of %s" % (
+                output, ", ".join(["%s:%s" % (f, output)
+                                   for f in sorted(FORMATS)])))
+    return EXTENSIONS[extension], output
+
+def input_files(sources):
+    '''Returns the furnishing files of sources, which are files,
+    directories or the names of facilities.'''
+    files = []
+    for source in sources:
+        if (not os.path.exists(source) and
+            os.path.isdir(os.path.join(FACILITIES_DIRECTORY, source))):
+            source = os.path.join(FACILITIES_DIRECTORY, source)
+        if os.path.isdir(source):
+            files += furnishing_files(source)
+        else:
+            files.append(source)
+        pass
+    return files
+
+def records(filename):
+    '''Yields a Record for each item in the furnishing file filename.  The
+    file is named relative to its facility's directory.'''
+    facility = facility_directory(os.path.abspath(filename))
+    name = os.path.relpath(filename)
+    if facility != None:
+        name = os.path.relpath(os.path.abspath(filename), facility)
+        facility = os.path.basename(facility)
+    with open(filename, "r", encoding="utf-8") as f:
+        text = f.read()
+    for item, start, end in array_elements(text):
+        if isinstance(item, dict):
+            yield Record(item, name, facility)
+        pass
     pass
 
+parser = argparse.ArgumentParser(
+    description='''Export the items of the furnishing files to
+spreadsheets and databases.''')
+
+parser.add_argument(
+    "-output", action="append", dest="outputs", type=output_format,
+    help='''A file to write, as FORMAT:FILE or just FILE if its extension
+says what its format is.  The formats are %s.  Can be specified multiple
+times to write several files in one pass.  Defaults to %s.''' % (
+        ", ".join(sorted(FORMATS)), OUTPUT_FILE))
+
+parser.add_argument(
+    "-fields", default=DEFAULT_FIELDS,
+    help='''The comma separated columns to export, in order, or %s for
+every column: %s.  Any property of the items can be named.  Defaults
+to %%(default)s.''' % (ALL_FIELDS, ",".join(
+        [heading.heading for heading in HEADINGS])))
+
+parser.add_argument(
+    "-units", choices=("feet", "inches"), default="inches",
+    help='''The units to give the lengths in.  The furnishing files are
+in feet.  A path_d is left as it is.  Defaults to %(default)s.''')
+
+parser.add_argument(
+    "sources", nargs="*",
+    help='''The furnishing files, directories or facility names to export.
+Defaults to the %s directory if there is one, or else every facility.''' % (
+        INPUT_DIRECTORY))
+
 def main():
-    with open(OUTPUT_FILE, "w") as out:
-        writer = csv.writer(out, **CSV_WRITER_PARAMS)
-        writer.writerow(
-            [heading.heading
-             for heading in SPREADSHET_HEADINGS])
-        for f in os.listdir(INPUT_DIRECTORY):
-            f = os.path.join(INPUT_DIRECTORY, f)
-            if not os.path.isfile(f):
-                continue
-            if os.path.splitext(f)[-1] != ".json":
-                continue
+    args = parser.parse_args()
+    outputs = args.outputs or [output_format(OUTPUT_FILE)]
+    headings = [heading.in_units(args.units)
+                for heading in headings_for(args.fields)]
+    sources = args.sources
+    if not sources:
+        if os.path.isdir(INPUT_DIRECTORY):
+            sources = [INPUT_DIRECTORY]
+        else:
+            sources = [FACILITIES_DIRECTORY]
+    with contextlib.ExitStack() as stack:
+        writers = []
+        for format, filename in outputs:
+            temp = stack.enter_context(atomic_output(filename))
+            writer = FORMATS[format](temp, headings)
+            # Closed before its file replaces filename.
+            stack.callback(writer.close)
+            writers.append(writer)
+        for f in input_files(sources):
             print("exporting %s" % f)
-            with open(f, "r") as f:
-                for thing in json.load(f):
-                    export_thing(thing, writer)
+            try:
+                for record in records(f):
+                    row = [heading.value(record) for heading in headings]
+                    for writer in writers:
+                        writer.write(row)
                     pass
+            except (OSError, ValueError) as e:
+                sys.exit("%s: %s" % (f, e))
             pass
         pass
     pass
 
 if __name__ == '__main__':
     main()
-
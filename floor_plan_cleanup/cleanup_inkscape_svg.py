@@ -3,10 +3,16 @@ Clean up an SVG file that was written by Inkscape.
 '''
 
 import argparse
+import copy
+import json
+import math
 import numpy
 import os.path
 import sys
 import xml.dom
+import xml.dom.minidom
+import xml.sax
+import xml.sax.handler
 from collections import Counter, defaultdict
 from xml.dom.minidom import parse
 
@@ -21,8 +27,11 @@ sys.path.insert(
             os.path.dirname(os.path.abspath(__file__))),
         "lib"))
 
+from atomic_file import *
 from box import *
+from grid_index import *
 from points import *
+from simplify import *
 from stylesheet import *
 from transform import *
 from xml_utils import *
@@ -65,6 +74,13 @@ class AttributeMatcher (object):
         return (attrNode.prefix == self.prefix
                 and attrNode.localName == self.localName)
 
+    def match_name(self, qname):
+        '''Like match but takes a qualified attribute name as a string.'''
+        split = qname.split(":")
+        if len(split) == 1:
+            return self.prefix in ("", None) and self.localName == split[0]
+        return self.prefix == split[0] and self.localName == split[1]
+
 
 ATTRIBUTES_TO_REMOVE = [
     AttributeMatcher("inkscape:connector-curvature")
@@ -85,42 +101,49 @@ def remove_attributes(element):
 # Stylesheet manipulation
 
 
-def extract_styles(doc, stylemap={}):
+def style_class(style, stylemap):
+    '''Returns the name of the CSS class that stands for the style
+    attribute value style, adding a new class to the StyleMap stylemap
+    if needed.'''
+    return stylemap.class_for(style)
+
+
+def style_extractor(stylemap):
+    '''Returns a do_elements visitor that replaces the style attribute of
+    each element with a CSS class recorded in stylemap.'''
     def es(elt):
         style = elt.getAttribute("style")
         if style == "":
             return
-        parsed = cssutils.parseStyle(style)
-        key = ';'.join(["%s:%s" % (p.name, p.value)
-                        for p in sorted(parsed.getProperties(),
-                                        key=lambda x: x.name)])
-        if not key in stylemap:
-            stylename = "style%d" % len(stylemap)
-            stylemap[key] = stylename
-            stylemap[stylename] = parsed
-        elt.setAttribute("class", stylemap[key])
+        elt.setAttribute("class", style_class(style, stylemap))
         elt.removeAttribute("style")
-    do_elements(doc, es)
+    return es
+
+
+def extract_styles(doc, stylemap=None):
+    '''Replace the style attribute of each element of doc with a CSS
+    class.  Returns the StyleMap describing those classes.'''
+    if stylemap is None:
+        stylemap = StyleMap()
+    do_elements(doc, style_extractor(stylemap))
     return stylemap
 
 
 def modify_styles(styles_map):
-    for v in styles_map.values():
-        if isinstance(v, cssutils.css.CSSStyleDeclaration):
-            v.setProperty("vector-effect", "non-scaling-stroke")
+    for properties in styles_map.properties.values():
+        properties["vector-effect"] = "non-scaling-stroke"
 
 
 def add_stylesheet(doc, stylemap):
     '''Updates the stylesheet inkscape_styles (creating it if not present)
     with styles from stylemap.'''
     style = ensure_stylesheet(doc, "inkscape_styles")
-    classnames = []
-    for v in stylemap.values():
-        if isinstance(v, str):
-            classnames.append(v)
+    classnames = stylemap.class_names()
     classnames.sort()
     for c in classnames:
-        s = stylemap[c]
+        s = cssutils.css.CSSStyleDeclaration()
+        for name, value in stylemap[c].items():
+            s.setProperty(name, value)
         add_stylesheet_rule(doc, style,
                             "." + c,
                             s.getCssText(" "))
@@ -143,7 +166,7 @@ def scope_styles(doc, node, styles_map, modified_properties=""):
     for c in classes:
         add_stylesheet_rule(doc, stylesheet,
                             "#%s .%s" % (id, c),
-                            modified_properties + styles_map[c].cssText)
+                            modified_properties + style_text(styles_map[c]))
 
 
 def hide_classes(styles_map, class_names):
@@ -151,10 +174,9 @@ def hide_classes(styles_map, class_names):
         p = styles_map.get(c, None)
         if p == None:
             continue
-        assert isinstance(p, cssutils.css.CSSStyleDeclaration)
-        p.setProperty("stroke", "none")
-        p.setProperty("fill", "none")
-        p.setProperty("stroke-opacity", 0)
+        p["stroke"] = "none"
+        p["fill"] = "none"
+        p["stroke-opacity"] = "0"
 
 
 def thing_styles(doc, url):
@@ -206,7 +228,7 @@ def add_real_world_group(doc, scale_factor, box):
     Y pointing down, and scaled by scale_factor.'''
      real_world = doc.createElement("g")
      doc.documentElement.appendChild(real_world)
-     real_world.setAttribute("id", "real-world")
+     set_element_id(real_world, "real-world")
      real_world.setAttribute(
          "transform",
          Transform.translate(box.maxX, box.minY).toSVG() + " " +
@@ -219,7 +241,8 @@ def add_real_world_group(doc, scale_factor, box):
         
 
 def show_boxes(doc, boxes):
-    if not boxes:
+    '''Draw each box of the BoxArray boxes.'''
+    if not len(boxes):
         return
     g = doc.createElement("g")
     g.setAttribute("class", "showBox")
@@ -254,7 +277,8 @@ def update_svg_viewbox(doc, box, increased_height = 0):
         " ".join([str(x) for x in [box.minX, box.minY, box.width,
                                    box.height + increased_height]]))
     svg.setAttribute("width", "100%")
-    svg.removeAttribute("height")
+    if svg.hasAttribute("height"):
+        svg.removeAttribute("height")
 
 
 ################################################################################
@@ -262,15 +286,39 @@ def update_svg_viewbox(doc, box, increased_height = 0):
 
 
 def clip_text(doc, box):
-    remove = []
-    for text in doc.getElementsByTagName("text"):
-        if not text_in_box(text, box):
-            remove.append(text)
-    remove_elements(remove)
+    texts = doc.getElementsByTagName("text")
+    if not texts:
+        return
+    within = box.points_within(text_positions(texts))
+    remove_elements([text for text, w in zip(texts, within) if not w])
 
 
 def text_in_box(text, box):
     '''Returns True iff text is within box.'''
+    return bool(box.points_within(text_positions([text]))[0])
+
+
+def text_positions(texts):
+    '''Returns an (N,2) array of the locations of the N text elements
+    in texts, in global coordinates.'''
+    anchors = [text_anchor_point(text) for text in texts]
+    if not anchors:
+        return numpy.zeros((0, 2))
+    # Apply each text's transform to its anchor point all at once.
+    return numpy.einsum("nij,nj->ni",
+                        numpy.array([t.matrix for t, _ in anchors]),
+                        numpy.array([p for _, p in anchors]))[:, :2]
+
+
+def text_position(text):
+    '''Returns the X and Y location of text in global coordinates.'''
+    transform, p = text_anchor_point(text)
+    return transform.apply(p)[:2]
+
+
+def text_anchor_point(text):
+    '''Returns the cumulative transform of text and the point, in its
+    own coordinates, at which it is anchored.'''
     # We assume there will only be one.
     # Element counts shows the same number of text and tspan elements.
     # That was true of Inkscape's output, the output from Acrobat has
@@ -281,49 +329,272 @@ def text_in_box(text, box):
     else:
         txt = text
     transform, _ = svg_context(txt)
+    return transform, anchor_point(txt.getAttribute("x"),
+                                   txt.getAttribute("y"))
+
+
+def anchor_point(x, y):
+    '''Returns the point given by the x and y attribute values of a text
+    or tspan element.'''
     # *** I have no idea why but some x and y attributes of tspan
     # elements have multiple values.
     def just_one(s):
-        if s:
-            return s[0]
+        values = s.replace(",", " ").split()
+        if values:
+            return float(values[0])
         else:
             return 0
-    p = transform.apply(point(float(just_one(txt.getAttribute("x"))),
-                              float(just_one(txt.getAttribute("y")))))
-    return box.point_within(p)
+    return point(just_one(x), just_one(y))
 
 
-def clip_paths(doc, box):
-    '''Clip all SVG paths to be within the specified bounding box.'''
+def clip_paths(doc, box, index=None):
+    '''Clip all SVG paths to be within the specified bounding box.
+    If a PathIndex is provided it is kept up to date with the clipped
+    paths.'''
+    if index is None:
+        index = PathIndex(doc)
+    candidates = index.query(box)
     remove_paths = []
-    for path in doc.getElementsByTagName("path"):
-        transform, display = svg_context(path)
-        if display:
-            parsed_path = svg.path.parse_path(path.getAttribute("d"))
-            new_path = svg.path.Path()
-            for step in parsed_path:
-                # For now just exclude Lines that are wholly outside the Box.
-                if isinstance(step, svg.path.Line):
-                    if box.line_intersects(transform, step):
-                        new_path.append(step)
-                elif isinstance(step, svg.path.CubicBezier):
-                    if box.cubicBezier_intersects(transform, step):
-                        new_path.append(step)
-                else:
-                    new_path.append(step)
-                    print("Unsupported path step %r" % step)
-            if len(new_path) <= 0:
-                remove_paths.append(path)
-            else:
-                path.setAttribute("d", new_path.d())
+    for path, entry in list(index.entries.items()):
+        if not entry.display:
+            continue
+        if entry.exact and path not in candidates:
+            # No drawing segment of the path can be within the box.
+            remove_paths.append(path)
+            continue
+        new_path = clip_entry(entry, box)
+        if new_path is None:
+            # Every segment is within the box.  Leave the path as it is.
+            continue
+        if len(new_path) <= 0:
+            remove_paths.append(path)
+        else:
+            path.setAttribute("d", new_path.d())
+            index.update(path, new_path)
+    for path in remove_paths:
+        index.remove(path)
     remove_elements(remove_paths)
 
 
+def clip_entry(entry, box):
+    '''Returns the svg.path.Path that remains of the path described by
+    the PathEntry entry after clipping it to box.  The result is empty if
+    nothing remains.  Returns None if the path is unchanged.'''
+    if entry.exact:
+        if entry.bounds is None or not box.intersects(entry.bounds):
+            return svg.path.Path()
+        if box.contains(entry.bounds):
+            return None
+    # For now just exclude Lines that are wholly outside the Box.
+    keep = numpy.ones(len(entry.steps), dtype=bool)
+    if len(entry.line_steps):
+        keep[entry.line_steps] = box.lines_intersect(
+            entry.lines[:, 0], entry.lines[:, 1])
+    if len(entry.cubic_steps):
+        keep[entry.cubic_steps] = box.cubicBeziers_intersect(
+            entry.cubics[:, 0], entry.cubics[:, 1],
+            entry.cubics[:, 2], entry.cubics[:, 3])
+    for i in entry.other_steps:
+        print("Unsupported path step %r" % entry.steps[i])
+    return select_path_segments(entry.steps, keep)
+
+
+def select_path_segments(steps, keep):
+    '''Returns a new svg.path.Path containing only those of the drawing
+    segments steps for which the corresponding element of keep is True.
+    Move segments are added wherever a kept segment does not start where
+    the previous one ended.  The result is empty if no segments are kept.'''
+    new_path = svg.path.Path()
+    subpath_start = None
+    for step, k in zip(steps, keep):
+        if not k:
+            continue
+        if len(new_path) == 0 or new_path[-1].end != step.start:
+            new_path.append(svg.path.Move(step.start))
+            subpath_start = step.start
+        if (isinstance(step, svg.path.Close) and
+            step.end != subpath_start):
+            # The start of this subpath was clipped away.
+            step = svg.path.Line(step.start, step.end)
+        new_path.append(step)
+    return new_path
+
+
+# Elements whose content is not displayed.
+UNDISPLAYED_ELEMENTS = ("clipPath",)
+
+
+################################################################################
+# Simplifying paths
+#
+# Inkscape's PDF import writes coordinates with six decimal places and
+# draws many outlines with runs of tiny, nearly collinear lines.
+# simplified_d rewrites a path with each run of lines simplified by
+# douglas_peucker, numbers rounded to -precision decimal places and
+# lines that round to nothing left out.  The -simplify tolerance is in
+# real world units, like -realworld_grid_spacing.
+
+
+def simplified_d(path, tolerance=0, precision=None):
+    '''Returns a d attribute that draws the svg.path.Path path, with
+    no point of a run of lines moved by more than tolerance.  Each
+    command is written in whichever of its absolute, relative,
+    horizontal or vertical forms is shortest.  Returns None if path has
+    arcs, which are left alone.'''
+    parts = []
+    # The last command letter written, the current point and the start
+    # of the current subpath as written, and a pending moveto.
+    state = { "command": None, "at": None, "start": None, "move": None }
+    def rounded(p):
+        if precision is None:
+            return p
+        return complex(round(p.real, precision), round(p.imag, precision))
+    def number(x):
+        return format_number(x, precision)
+    def coordinates(*points):
+        return " ".join([number(p.real) + "," + number(p.imag)
+                         for p in points])
+    def write(forms, end):
+        '''forms is a list of (command, text) pairs that each move the
+        current point to the already rounded end.'''
+        command, text = min(forms, key=lambda f: (
+            len(f[1]), f[0] != state["command"]))
+        if command == state["command"] and text:
+            parts.append(" " + text)
+        else:
+            parts.append(command + text)
+        # Coordinates following a moveto are linetos.
+        state["command"] = { "M": "L", "m": "l" }.get(command, command)
+        state["at"] = end
+    def move():
+        '''Write the pending moveto, if there is one.'''
+        if state["move"] is None:
+            return
+        p = rounded(state["move"])
+        state["move"] = None
+        forms = [("M", coordinates(p))]
+        if state["at"] is not None:
+            forms.append(("m", coordinates(p - state["at"])))
+        write(forms, p)
+        state["start"] = p
+    def line_to(p):
+        move()
+        p = rounded(p)
+        at = state["at"]
+        if p == at:
+            return
+        forms = [("L", coordinates(p)), ("l", coordinates(p - at))]
+        if p.imag == at.imag:
+            forms += [("H", number(p.real)), ("h", number(p.real - at.real))]
+        if p.real == at.real:
+            forms += [("V", number(p.imag)), ("v", number(p.imag - at.imag))]
+        write(forms, p)
+    def curve_to(command, *points):
+        move()
+        points = [rounded(p) for p in points]
+        write([(command, coordinates(*points)),
+               (command.lower(),
+                coordinates(*[p - state["at"] for p in points]))],
+              points[-1])
+    run = []
+    def flush():
+        if len(run) == 2:
+            line_to(run[1])
+        elif len(run) > 2:
+            keep = douglas_peucker(xy_array(run), tolerance)
+            for p, k in zip(run[1:], keep[1:]):
+                if k:
+                    line_to(p)
+        run.clear()
+    end = None
+    for step in path:
+        if isinstance(step, svg.path.Arc):
+            return None
+        if isinstance(step, svg.path.Move) or step.start != end:
+            flush()
+            state["move"] = step.start
+        if isinstance(step, svg.path.Move):
+            pass
+        elif isinstance(step, svg.path.Close):
+            flush()
+            move()
+            write([("Z", "")], state["start"])
+        elif isinstance(step, svg.path.Line):
+            if not run:
+                run.append(step.start)
+            run.append(step.end)
+        else:
+            flush()
+            if isinstance(step, svg.path.CubicBezier):
+                curve_to("C", step.control1, step.control2, step.end)
+            else:
+                curve_to("Q", step.control, step.end)
+        end = step.end
+    flush()
+    return "".join(parts)
+
+
+def simplify_path(parsed, d, transform, tolerance, precision, rounding=0):
+    '''Returns the simplified d attribute of the path whose d attribute
+    is d and which parses to the svg.path.Path parsed, or None if it
+    can't be made shorter.  tolerance is in the global coordinates that
+    transform maps the path to.  If rounding is given, the coordinates
+    are rounded to as few decimal places as move no point by more than
+    rounding, in global coordinates, unless precision asks for fewer.'''
+    stretch = transform.max_stretch()
+    if tolerance:
+        tolerance = tolerance / stretch if stretch else 0
+    if rounding and stretch:
+        places = max(0, math.ceil(-math.log10(2 * rounding / stretch)))
+        precision = places if precision is None else min(precision, places)
+    new_d = simplified_d(parsed, tolerance, precision)
+    if not new_d or len(new_d) >= len(d):
+        return None
+    return new_d
+
+
+def simplifying(args):
+    return bool(args.simplify) or args.precision is not None
+
+
+def simplification_tolerance(args):
+    '''The -simplify tolerance in top level SVG drawing coordinates.'''
+    if not args.simplify:
+        return 0
+    return args.simplify * args.scale_factor[0]
+
+
+def simplify_paths(index, tolerance, precision, rounding=0):
+    '''Simplify the paths of the PathIndex index, see simplify_path.
+    Returns the number of bytes by which their d attributes were
+    shortened.'''
+    saved = 0
+    for path, entry in list(index.entries.items()):
+        d = path.getAttribute("d")
+        new_d = simplify_path(entry.parsed, d, entry.transform,
+                              tolerance, precision, rounding)
+        if new_d is None:
+            continue
+        saved += len(d) - len(new_d)
+        path.setAttribute("d", new_d)
+        index.update(path, svg.path.parse_path(new_d))
+    return saved
+
+
 def svg_context(path, trace_transforms=False):
-    '''Go up the parent chain of path, collecting any transformations 
-    and determining if the path is in a context that is displayed.'''
+    '''Returns the cumulative transformation of path and whether the path
+    is in a context that is displayed.  Results are cached in SVG_CONTEXTS.'''
     if trace_transforms:
-        print("svg_context")
+        return traced_svg_context(path)
+    return SVG_CONTEXTS.context(path)
+
+
+def traced_svg_context(path):
+    '''Go up the parent chain of path, collecting any transformations 
+    and determining if the path is in a context that is displayed.
+    Each transformation is printed as it is encountered.  This does not
+    use or update SVG_CONTEXTS.'''
+    print("svg_context")
     transform = Transform.identity()
     display = True
     def up(elt):
@@ -331,14 +602,13 @@ def svg_context(path, trace_transforms=False):
         nonlocal transform, display
         if elt.nodeType == xml.dom.Node.DOCUMENT_NODE:
             return
-        if elt.tagName in ("clipPaths"):
+        if elt.tagName in UNDISPLAYED_ELEMENTS:
             display = False
         t = elt.getAttribute("transform")
         if t:
             t = Transform.parseSVG(t)
             if t:
-                if trace_transforms:
-                    print(t)
+                print(t)
                 # See https://www.w3.org/TR/2010/WD-SVG11-20100622/coords.html, 7.5 Nested Transformations
                 # It says that as you descend the SVG tree, an inner
                 # transformation is post-multiplied to the outer
@@ -352,6 +622,210 @@ def svg_context(path, trace_transforms=False):
     return transform, display
 
 
+class SVGContextCache (object):
+    '''SVGContextCache remembers the cumulative transformation and display
+    flag of each element it has been asked about, so that siblings share
+    the work of parsing and composing the transforms of their ancestors.
+
+    Changing the transform attribute of an element, or moving it to a
+    new parent, makes the cached contexts of that element and its
+    descendants stale.  Call invalidate on the element when doing so.'''
+    def __init__(self):
+        # Maps element to (parentNode, transform, display).
+        self.contexts = {}
+
+    def _derive(self, elt, parent_transform, parent_display):
+        display = parent_display and elt.tagName not in UNDISPLAYED_ELEMENTS
+        transform = parent_transform
+        t = elt.getAttribute("transform")
+        if t:
+            t = Transform.parseSVG(t)
+            if t:
+                # See https://www.w3.org/TR/2010/WD-SVG11-20100622/coords.html, 7.5 Nested Transformations
+                # As we descend the SVG tree, an inner transformation
+                # is post-multiplied to the outer transformation.
+                transform = parent_transform.compose(t)
+        self.contexts[elt] = (elt.parentNode, transform, display)
+        return transform, display
+
+    def _parent_context(self, elt):
+        parent = elt.parentNode
+        if parent is None or parent.nodeType != xml.dom.Node.ELEMENT_NODE:
+            return Transform.identity(), True
+        return self.context(parent)
+
+    def context(self, elt):
+        '''Returns the cumulative transform and display flag of elt.'''
+        cached = self.contexts.get(elt)
+        if cached and cached[0] is elt.parentNode:
+            return cached[1], cached[2]
+        # Find the nearest ancestor whose context is known, then work
+        # back down from there.
+        chain = []
+        node = elt
+        while node is not None and node.nodeType == xml.dom.Node.ELEMENT_NODE:
+            cached = self.contexts.get(node)
+            if cached and cached[0] is node.parentNode:
+                break
+            chain.append(node)
+            node = node.parentNode
+        if node is not None and node.nodeType == xml.dom.Node.ELEMENT_NODE:
+            _, transform, display = self.contexts[node]
+        else:
+            transform, display = Transform.identity(), True
+        for node in reversed(chain):
+            transform, display = self._derive(node, transform, display)
+        return transform, display
+
+    def prime(self, node):
+        '''Compute the contexts of node and all of its descendant elements
+        in a single top down pass.'''
+        if node.nodeType == xml.dom.Node.DOCUMENT_NODE:
+            node = node.documentElement
+        stack = [(node, *self._parent_context(node))]
+        while stack:
+            elt, parent_transform, parent_display = stack.pop()
+            transform, display = self._derive(elt, parent_transform,
+                                              parent_display)
+            for child in elt.childNodes:
+                if child.nodeType == xml.dom.Node.ELEMENT_NODE:
+                    stack.append((child, transform, display))
+
+    def invalidate(self, node=None):
+        '''Forget the contexts of node and its descendants.  If node is
+        not specified, forget everything.'''
+        if node is None:
+            self.contexts.clear()
+            return
+        stack = [node]
+        while stack:
+            elt = stack.pop()
+            self.contexts.pop(elt, None)
+            stack.extend(elt.childNodes)
+
+
+SVG_CONTEXTS = SVGContextCache()
+
+
+################################################################################
+# Spatial index of paths
+
+
+def segment_points(step):
+    '''Returns the end points and control points of the svg.path
+    segment step as complex numbers.'''
+    if isinstance(step, svg.path.CubicBezier):
+        return [step.start, step.control1, step.control2, step.end]
+    if isinstance(step, svg.path.QuadraticBezier):
+        return [step.start, step.control, step.end]
+    return [step.start, step.end]
+
+
+class PathEntry (object):
+    '''PathEntry caches what PathIndex knows about a single path element.'''
+    def __init__(self, parsed, transform, display):
+        self.transform = transform
+        self.display = display
+        self.set_parsed(parsed)
+
+    def set_parsed(self, parsed):
+        self.parsed = parsed
+        # The drawing segments of the path, ignoring Moves.
+        self.steps = [step for step in parsed
+                      if not isinstance(step, svg.path.Move)]
+        # Indices into steps of each kind of segment.
+        self.line_steps = []
+        self.cubic_steps = []
+        self.other_steps = []
+        line_points = []
+        cubic_points = []
+        other_points = []
+        for i, step in enumerate(self.steps):
+            if isinstance(step, (svg.path.Line, svg.path.Close)):
+                self.line_steps.append(i)
+                line_points.extend(segment_points(step))
+            elif isinstance(step, svg.path.CubicBezier):
+                self.cubic_steps.append(i)
+                cubic_points.extend(segment_points(step))
+            else:
+                self.other_steps.append(i)
+                other_points.extend(segment_points(step))
+        # The end points and control points of the segments in global
+        # coordinates, as (N,2,2) and (N,4,2) arrays.
+        self.lines = self.transform.apply_many(
+            xy_array(line_points)).reshape(-1, 2, 2)
+        self.cubics = self.transform.apply_many(
+            xy_array(cubic_points)).reshape(-1, 4, 2)
+        # exact is True iff the end points and control points of every
+        # segment bound the segment, so that bounds can stand in for
+        # the segments themselves.
+        self.exact = not self.other_steps
+        points = numpy.concatenate([
+            self.lines.reshape(-1, 2),
+            self.cubics.reshape(-1, 2),
+            self.transform.apply_many(xy_array(other_points))])
+        if len(points):
+            self.bounds = Box.bounding(points[:, 0], points[:, 1])
+        else:
+            self.bounds = None
+
+    def any_segment_within(self, box):
+        '''Returns True iff all of the points of any Line or CubicBezier
+        segment are within box.'''
+        return bool(box.points_within(self.lines).all(axis=1).any() or
+                    box.points_within(self.cubics).all(axis=1).any())
+
+
+class PathIndex (object):
+    '''PathIndex parses each path element of a document once and
+    records the bounding Box of its segments in global coordinates.
+    A GridIndex over those Boxes lets clip_paths and tag_boxes consider
+    only the paths that might be affected by a given Box.'''
+    def __init__(self, doc, entries=None):
+        '''If entries is given, it maps each path element of doc to its
+        PathEntry, in document order, and the paths are not parsed.'''
+        if entries is None:
+            entries = {}
+            for path in doc.getElementsByTagName("path"):
+                transform, display = svg_context(path)
+                entries[path] = PathEntry(
+                    svg.path.parse_path(path.getAttribute("d")),
+                    transform, display)
+        # Maps each path element to its PathEntry, in document order.
+        self.entries = entries
+        # Each entry's position in document order, so that the paths a
+        # query finds can be put in document order without going through
+        # every entry.
+        for i, entry in enumerate(self.entries.values()):
+            entry.order = i
+        self.grid = GridIndex.for_boxes(
+            [e.bounds for e in self.entries.values() if e.bounds])
+        for path, entry in self.entries.items():
+            if entry.bounds:
+                self.grid.insert(path, entry.bounds)
+
+    def update(self, path, parsed):
+        '''Record that the d attribute of path now describes parsed.'''
+        entry = self.entries[path]
+        entry.set_parsed(parsed)
+        if entry.bounds:
+            self.grid.insert(path, entry.bounds)
+        else:
+            self.grid.remove(path)
+
+    def remove(self, path):
+        '''Forget path, which is being removed from the document.'''
+        self.entries.pop(path, None)
+        self.grid.remove(path)
+
+    def query(self, box):
+        '''Returns the set of path elements whose bounds intersect box.'''
+        return self.grid.query(box)
+
+    def in_document_order(self, paths):
+        return sorted(paths, key=lambda p: self.entries[p].order)
+
+
 ################################################################################
 
 def remove_empty_groups(doc):
@@ -370,26 +844,22 @@ def remove_empty_groups(doc):
             else:
                 return True
         return False
-    def walk(node):
-        # childNodes iteration is compilcated because nodes in the
-        # childNodes NodeList might get deleted during the iteration
-        # and NodeList iteration doesn';t seem to cope with that.
-        i = 0
-        previous_node = None
-        while i < len(node.childNodes):
-            child = node.childNodes.item(i)
-            walk(child)
-            if node.childNodes.item(i) == child:
-                i += 1
-        if empty(node):
-                node.parentNode.removeChild(node)
-    walk(doc.documentElement)
+    elements = []
+    do_elements(doc, elements.append)
+    # Each element's descendants come after it in document order, so
+    # working backwards we get to a group only after its contents.
+    for element in reversed(elements):
+        for child in list(element.childNodes):
+            if child.nodeType != xml.dom.Node.ELEMENT_NODE and empty(child):
+                element.removeChild(child)
+        if element.parentNode and empty(element):
+            element.parentNode.removeChild(element)
 
 
 def remove_elements(elements):
     '''Remove each of the XML element nodes in elements from their respective parent nodes.'''
     for r in elements:
-        r.parentNode.removeChild(r)
+        remove_element(r)
 
 
 ################################################################################
@@ -445,11 +915,11 @@ def locator_circle(doc, parent, x, y, radius):
 # Box purging
 
 def read_box_file(filename):
-    '''Reads the box file and returns a list of Box objects.
+    '''Reads the box file and returns a BoxArray.
 Each line of the file contains the left X, top Y, right X and bottom Y,
 in global coordinates, of a box, delimited by whitespace.'''
     if not filename:
-        return []
+        return BoxArray()
     boxes = []
     with open(filename, "r") as f:
         for line in f.readlines():
@@ -457,46 +927,42 @@ in global coordinates, of a box, delimited by whitespace.'''
             if len(split) != 4:
                 print("Wrong number of coordinates in box line: %r"% line)
                 continue
-            boxes.append(Box(*[float(v) for v in split]))
-    return boxes
+            boxes.append([float(v) for v in split])
+    return BoxArray(boxes)
 
 
-def tag_boxes(doc, boxes, comment=True):
+def tag_boxes(doc, boxes, comment=True, index=None):
     '''Tag any SVG paths that are wholly contained within any of boxes by adding an XML comment.
     Returns a dict mapping each Box to a list of the elements that have been tagged for it.'''
+    if index is None:
+        index = PathIndex(doc)
     # Tag paths
     map = defaultdict(list)
-    for path in doc.getElementsByTagName("path"):
-        transform, _ = svg_context(path)
-        parsed_path = svg.path.parse_path(path.getAttribute("d"))
-        matched_boxes = set([])
-        for box in boxes:
-            for step in parsed_path:
-                if isinstance(step, svg.path.Line):
-                    if (box.point_within(transform.apply(step.start)) and
-                        box.point_within(transform.apply(step.end))):
-                        matched_boxes.add(box)
-                        map[box].append(path)
-                        continue
-                elif isinstance(step, svg.path.CubicBezier):
-                    if (box.point_within(transform.apply(step.start)) and
-                        box.point_within(transform.apply(step.control1)) and
-                        box.point_within(transform.apply(step.control2)) and
-                        box.point_within(transform.apply(step.end))):
-                        matched_boxes.add(box)
-                        map[box].append(path)
-                        continue
-        if comment and len(matched_boxes) > 0:
-            add_tagged_box_comment(doc, path, matched_boxes)
+    path_boxes = defaultdict(list)
+    for box in boxes:
+        for path in index.in_document_order(index.query(box)):
+            entry = index.entries[path]
+            if not (entry.exact and box.contains(entry.bounds)):
+                if not entry.any_segment_within(box):
+                    continue
+            map[box].append(path)
+            path_boxes[path].append(box)
+    if comment:
+        for path in index.in_document_order(path_boxes):
+            add_tagged_box_comment(doc, path, path_boxes[path])
     # Tag text
-    for text in doc.getElementsByTagName("text"):
-        matched_boxes = []
-        for box in boxes:
-            if text_in_box(text, box):
-                matched_boxes.append(box)
+    texts = doc.getElementsByTagName("text")
+    positions = text_positions(texts)
+    text_boxes = defaultdict(list)
+    for box in boxes:
+        for text, within in zip(texts, box.points_within(positions)):
+            if within:
                 map[box].append(text)
-        if comment and len(matched_boxes) > 0:
-            add_tagged_box_comment(doc, text, matched_boxes)
+                text_boxes[text].append(box)
+    if comment:
+        for text in texts:
+            if text in text_boxes:
+                add_tagged_box_comment(doc, text, text_boxes[text])
     return map
 
 
@@ -507,6 +973,436 @@ def add_tagged_box_comment(doc, element, matching_boxes):
         "\n"))
 
 
+################################################################################
+# Streaming cleanup
+
+# The DOM based cleanup in main needs several times the size of the
+# input file in memory.  stream_cleanup instead makes two passes over
+# a SAX event stream.  The first collects the styles and the viewBox.
+# The second rewrites each element as it goes by, keeping only the
+# transforms of its ancestors, and writes the output incrementally.
+# Features that need random access to the document, like relocating
+# the drawing scale or tagging boxes, are only available from main.
+
+STREAM_UNSUPPORTED_ARGUMENTS = [
+    "boxes_file", "drawing_scale_box", "scale_relocation", "tiles_directory"
+    ]
+
+
+def sax_parse(svg_file, handler):
+    reader = xml.sax.make_parser()
+    reader.setFeature(xml.sax.handler.feature_namespaces, False)
+    reader.setFeature(xml.sax.handler.feature_external_ges, False)
+    reader.setContentHandler(handler)
+    reader.setProperty(xml.sax.handler.property_lexical_handler, handler)
+    reader.parse(svg_file)
+
+
+class LexicalEvents (object):
+    '''Default lexical handler methods for our SAX handlers.'''
+    def comment(self, content):
+        pass
+
+    def startDTD(self, name, public_id, system_id):
+        pass
+
+    def endDTD(self):
+        pass
+
+    def startCDATA(self):
+        pass
+
+    def endCDATA(self):
+        pass
+
+    def startEntity(self, name):
+        pass
+
+    def endEntity(self, name):
+        pass
+
+
+class StyleScanner (xml.sax.handler.ContentHandler, LexicalEvents):
+    '''The first streaming pass.  Assigns a CSS class to each distinct
+    style attribute, in document order, just as extract_styles does, and
+    notes the attributes of the outermost SVG element.'''
+    def __init__(self, stylemap):
+        super().__init__()
+        self.stylemap = stylemap
+        # Maps each style attribute value to its class name.
+        self.style_classes = stylemap.classes_by_style
+        self.element_counts = Counter()
+        self.root_attributes = None
+
+    def startElement(self, name, attrs):
+        self.element_counts.update([name])
+        if self.root_attributes is None:
+            self.root_attributes = dict(attrs.items())
+        style = attrs.get("style", "")
+        if style:
+            style_class(style, self.stylemap)
+
+
+class StreamCleaner (xml.sax.handler.ContentHandler, LexicalEvents):
+    '''The second streaming pass.  Replaces style attributes with CSS
+    classes, removes ATTRIBUTES_TO_REMOVE, optionally clips paths, text
+    and empty groups, and writes each element to writer.  front and back
+    are the nodes to write at the start and end of the outermost element.'''
+    def __init__(self, writer, args, clip_box, style_classes, front, back):
+        super().__init__()
+        self.writer = writer
+        self.args = args
+        self.clip_box = clip_box
+        self.style_classes = style_classes
+        self.front = front
+        self.back = back
+        # (transform, display) for each open element.
+        self.contexts = []
+        # Depth within an element that has been clipped away.
+        self.skip_depth = 0
+        # Group start tags that are not written until we know the
+        # group is not empty.
+        self.pending = []
+        # Events of a text element whose fate is not yet known.
+        self.text_events = None
+        self.text_depth = 0
+        self.text_anchor = None
+        self.characters_seen = []
+        # The number of elements whose start tags, but not end tags,
+        # have been written.
+        self.written_depth = 0
+        self.element_counts = Counter()
+        self.class_counts = Counter()
+        self.simplify = simplifying(args)
+        self.bytes_saved = 0
+
+    def _context(self):
+        if self.contexts:
+            return self.contexts[-1]
+        return Transform.identity(), True
+
+    def _emit(self, event, *event_args):
+        if self.text_events is not None:
+            self.text_events.append((event, event_args))
+            return
+        if event != "end":
+            self._flush_pending()
+        getattr(self, "_write_" + event)(*event_args)
+
+    def _write_start(self, name, attributes):
+        self.element_counts.update([name])
+        self.class_counts.update([attributes.get("class", "")])
+        self.writer.start(name, attributes)
+        self.written_depth += 1
+        if self.written_depth == 1:
+            self.writer.nodes(self.front)
+
+    def _write_end(self, name):
+        if self.written_depth == 1:
+            self.writer.nodes(self.back)
+        self.written_depth -= 1
+        self.writer.end(name)
+
+    def _write_text(self, data):
+        self.writer.text(data)
+
+    def _write_comment(self, data):
+        self.writer.comment(data)
+
+    def _flush_pending(self):
+        for name, attributes in self.pending:
+            self._write_start(name, attributes)
+        self.pending = []
+
+    def _flush_characters(self):
+        if self.characters_seen:
+            data = "".join(self.characters_seen)
+            self.characters_seen = []
+            if data.strip():
+                self._emit("text", data)
+
+    def startElement(self, name, attrs):
+        if self.skip_depth:
+            self.skip_depth += 1
+            return
+        self._flush_characters()
+        attributes = dict(attrs.items())
+        parent_transform, parent_display = self._context()
+        transform = parent_transform
+        t = attributes.get("transform")
+        if t:
+            t = Transform.parseSVG(t)
+            if t:
+                transform = parent_transform.compose(t)
+        display = parent_display and name not in UNDISPLAYED_ELEMENTS
+        style = attributes.pop("style", "")
+        if style:
+            attributes["class"] = self.style_classes[style]
+        for a in list(attributes):
+            for delete_me in ATTRIBUTES_TO_REMOVE:
+                if delete_me.match_name(a):
+                    del attributes[a]
+                    break
+        if not self.contexts and self.args.clip_svg_viewbox:
+            box = self.clip_box
+            attributes["viewBox"] = " ".join([
+                str(x) for x in [
+                    box.minX, box.minY, box.width,
+                    box.height + self.args.increase_viewbox_height[0]]])
+            attributes["width"] = "100%"
+            attributes.pop("height", None)
+        parsed = None
+        if self.args.clip:
+            if name == "path" and display:
+                parsed = svg.path.parse_path(attributes.get("d", ""))
+                new_path = clip_entry(PathEntry(parsed, transform, display),
+                                      self.clip_box)
+                if new_path is not None:
+                    if len(new_path) <= 0:
+                        self.skip_depth = 1
+                        return
+                    attributes["d"] = new_path.d()
+                    parsed = new_path
+            if name == "text" and self.text_events is None:
+                self.text_events = []
+                self.text_depth = 0
+                self.text_anchor = None
+            if self.text_events is not None:
+                self.text_depth += 1
+                if name == "text" or (name == "tspan" and
+                                      self.text_anchor[0] == "text"):
+                    self.text_anchor = (name, transform,
+                                        attributes.get("x", ""),
+                                        attributes.get("y", ""))
+        if name == "path" and self.simplify:
+            d = attributes.get("d", "")
+            if parsed is None:
+                parsed = svg.path.parse_path(d)
+            new_d = simplify_path(parsed, d, transform,
+                                  simplification_tolerance(self.args),
+                                  self.args.precision)
+            if new_d is not None:
+                self.bytes_saved += len(d) - len(new_d)
+                attributes["d"] = new_d
+        self.contexts.append((transform, display))
+        if name == "g" and self.args.clip and self.text_events is None:
+            self.pending.append((name, attributes))
+        else:
+            self._emit("start", name, attributes)
+
+    def endElement(self, name):
+        if self.skip_depth:
+            self.skip_depth -= 1
+            return
+        self._flush_characters()
+        self.contexts.pop()
+        if self.pending and self.text_events is None:
+            # The group is empty.
+            self.pending.pop()
+            return
+        self._emit("end", name)
+        if self.text_events is not None:
+            self.text_depth -= 1
+            if self.text_depth == 0:
+                events = self.text_events
+                self.text_events = None
+                _, transform, x, y = self.text_anchor
+                if self.clip_box.points_within(
+                        transform.apply(anchor_point(x, y))[:2]):
+                    for event, event_args in events:
+                        self._emit(event, *event_args)
+
+    def characters(self, content):
+        if not self.skip_depth:
+            self.characters_seen.append(content)
+
+    def comment(self, content):
+        if self.skip_depth:
+            return
+        self._flush_characters()
+        self._emit("comment", content)
+
+
+def decoration_nodes(args, viewbox, clip_box, styles_map):
+    '''Use add_decorations to create the stylesheets, grids and other
+    additions that the command line arguments call for.  Returns the
+    nodes to insert before the original content of the outermost SVG
+    element and those to insert after it.'''
+    doc = xml.dom.minidom.getDOMImplementation().createDocument(
+        None, "svg", None)
+    content = doc.createComment("content")
+    doc.documentElement.appendChild(content)
+    add_decorations(doc, args, viewbox, clip_box, styles_map)
+    nodes = list(doc.documentElement.childNodes)
+    i = nodes.index(content)
+    return nodes[:i], nodes[i + 1:]
+
+
+def stream_cleanup(args, output_file="cleaned_up.svg"):
+    '''Perform the cleanup that main does, as far as it can be done on a
+    stream of SAX events.'''
+    styles_map = StyleMap()
+    scanner = StyleScanner(styles_map)
+    sax_parse(args.input_file, scanner)
+    print("\nBEFORE CHANGES")
+    print_counts(scanner.element_counts)
+    # *** HACK: viewBox could use different delimiters.  Maybe should use a regular expression.
+    viewbox = [ int(x) for x in scanner.root_attributes["viewBox"].split()]
+    print("viewBox", viewbox)
+    clip_box = Box(*args.clip_box) if args.clip_box else Box.xywh(*viewbox)
+    print(clip_box)
+    front, back = decoration_nodes(args, viewbox, clip_box, styles_map)
+    with atomic_open(output_file, "w") as f:
+        writer = PrettyXMLWriter(f)
+        writer.declaration()
+        cleaner = StreamCleaner(writer, args, clip_box,
+                                scanner.style_classes, front, back)
+        sax_parse(args.input_file, cleaner)
+    if cleaner.simplify:
+        print("\nSimplifying paths saved %d bytes" % cleaner.bytes_saved)
+    print("\nAFTER ALL CHANGES")
+    counts = cleaner.element_counts
+    classes = cleaner.class_counts
+    for node in front + back:
+        do_elements(node, element_counter(counts), css_class_counter(classes))
+    print_counts(counts)
+    print("\nCSS classes:")
+    print_counts(classes)
+
+
+################################################################################
+# Tiles
+#
+# For a large drawing, -tiles_directory writes the cleaned up drawing
+# as a quadtree of tiles so that a viewer need only load the part of
+# the drawing that it is showing, at the level of detail it is shown
+# at.  Level 0 is a single tile covering the clip box.  Each tile of a
+# level is divided into four tiles at the next level.  A tile is a
+# complete SVG document whose viewBox is its part of the clip box.  It
+# is made by clipping its parent tile with clip_text and clip_paths.
+# Every level but the last is meant to be shown at tile_pixels pixels
+# across, so paths too small to cover a pixel at that size are left
+# out, and the rest are simplified and rounded to within half a pixel
+# and a tenth of a pixel.  Tiles with nothing in them are not written.
+#
+# The manifest, tiles.json, is a JSON object:
+#
+#   format, version  identify the manifest format.
+#   viewBox          the minX, minY, width and height of the clip box.
+#   levels           the number of levels.
+#   tile_pixels      the width in pixels each tile is simplified for.
+#   tiles            a list of objects for the tiles that were written,
+#                    with the level, column and row of each tile, its
+#                    box as [minX, minY, maxX, maxY], and the name of
+#                    its file relative to the manifest.
+
+TILE_MANIFEST = "tiles.json"
+TILE_MANIFEST_FORMAT = "MapMyStuff floor plan tiles"
+TILE_MANIFEST_VERSION = 1
+
+# How far, as a fraction of its width, a tile's clip box extends beyond
+# the tile, so that text and paths that cross the edge of a tile still
+# appear in it.
+TILE_MARGIN = 0.05
+
+
+def remove_small_paths(index, size):
+    '''Remove the displayed paths of the PathIndex index whose bounds
+    are smaller than size in both dimensions.'''
+    remove_paths = [path for path, entry in index.entries.items()
+                    if (entry.display and entry.bounds and
+                        entry.bounds.width < size and
+                        entry.bounds.height < size)]
+    for path in remove_paths:
+        index.remove(path)
+    remove_elements(remove_paths)
+
+
+def copy_tile(doc, index, box):
+    '''Returns a copy of doc that leaves out the displayed paths of the
+    PathIndex index that can't be within box, and a PathIndex for the
+    copy that reuses the PathEntries of index.'''
+    candidates = index.query(box)
+    tile = xml.dom.minidom.getDOMImplementation().createDocument(
+        None, None, None)
+    entries = {}
+    def copy_node(node, parent):
+        entry = None
+        if (node.nodeType == xml.dom.Node.ELEMENT_NODE and
+            node.tagName == "path"):
+            entry = index.entries.get(node)
+            if (entry and entry.display and entry.exact and
+                node not in candidates):
+                return
+        c = tile.importNode(node, False)
+        parent.appendChild(c)
+        if entry:
+            entries[c] = copy.copy(entry)
+        for child in node.childNodes:
+            copy_node(child, c)
+    for child in doc.childNodes:
+        copy_node(child, tile)
+    return tile, PathIndex(tile, entries)
+
+
+def tile_file(level, column, row):
+    return "%d/%d_%d.svg" % (level, column, row)
+
+
+def write_tiles(doc, directory, clip_box, levels, tile_pixels,
+                precision=None):
+    '''Write the tiles of doc and their manifest to directory.  doc
+    itself is not changed.  precision is the most decimal places to
+    write the coordinates of paths with.'''
+    manifest = {
+        "format": TILE_MANIFEST_FORMAT,
+        "version": TILE_MANIFEST_VERSION,
+        "viewBox": [clip_box.minX, clip_box.minY,
+                    clip_box.width, clip_box.height],
+        "levels": levels,
+        "tile_pixels": tile_pixels,
+        "tiles": []
+    }
+    def write_tile(parent, parent_index, level, column, row, box):
+        clip = box.expand(TILE_MARGIN * box.width)
+        tile, index = copy_tile(parent, parent_index, clip)
+        clip_text(tile, clip)
+        clip_paths(tile, clip, index)
+        remove_empty_groups(tile)
+        if (not any([e.display for e in index.entries.values()]) and
+            not tile.getElementsByTagName("text")):
+            SVG_CONTEXTS.invalidate(tile.documentElement)
+            return
+        if level + 1 < levels:
+            for i, quadrant in enumerate(box.quadrants()):
+                write_tile(tile, index, level + 1,
+                           2 * column + i % 2, 2 * row + i // 2, quadrant)
+            pixel = box.width / tile_pixels
+            remove_small_paths(index, pixel)
+            remove_empty_groups(tile)
+            # Detail that's too small to see at this level's size.
+            simplify_paths(index, pixel / 2, precision, pixel / 10)
+        SVG_CONTEXTS.invalidate(tile.documentElement)
+        update_svg_viewbox(tile, box)
+        filename = tile_file(level, column, row)
+        path = os.path.join(directory, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_output(path) as temp:
+            write_pretty(tile, temp)
+        manifest["tiles"].append({
+            "level": level,
+            "column": column,
+            "row": row,
+            "box": [box.minX, box.minY, box.maxX, box.maxY],
+            "file": filename
+        })
+    write_tile(doc, PathIndex(doc), 0, 0, 0, clip_box)
+    manifest["tiles"].sort(key=lambda t: (t["level"], t["row"], t["column"]))
+    with atomic_open(os.path.join(directory, TILE_MANIFEST), "w") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    return manifest
+
+
 ################################################################################
 # Main
 
@@ -517,6 +1413,10 @@ parser.add_argument('-input_file', type=str, nargs=None, action='store',
                     default=INKSCAPE_OUTPUT_FILE,
                     help='the input SVG file as written by Inkscape.')
 
+parser.add_argument('-output_file', type=str, nargs=None, action='store',
+                    default="cleaned_up.svg",
+                    help='the SVG file to write the cleaned up drawing to.')
+
 parser.add_argument('-realworld_grid_spacing', type=float, nargs=1, action='store',
                     help='If positive, the spacing of a superimposed reference grid in real world coordinates.')
 
@@ -524,7 +1424,7 @@ parser.add_argument('-viewbox_grid_spacing', type=float, nargs=1, action='store'
                     help='If positive, the spacing of a superimposed reference grid in SVG viewBox coordinates.')
 
 parser.add_argument("-scale_factor", type=float, nargs=1, action="store",
-                    default=1.0,
+                    default=[1.0],
                     help='''The ratio of top level SVG drawing coordinates to some real world unit (e.g inches or feet).''')
 
 parser.add_argument("-clip_box", type=float, nargs=4, action="store",
@@ -563,58 +1463,66 @@ parser.add_argument('-clip',
 parser.add_argument('-thing_stylesheet_link', type=str, nargs=None, action="store",
                     help="URL of a CSS stylesheet to include a link for.")
 
+parser.add_argument('-simplify', type=float, nargs=None, action="store",
+                    help="""Simplify runs of lines in paths so that no point moves by more than this distance in real world units.""")
+
+parser.add_argument('-precision', type=int, nargs=None, action="store",
+                    help="Round path coordinates to this many decimal places.")
+
+parser.add_argument('-tiles_directory', type=str, nargs=None, action="store",
+                    help="""Also write the cleaned up drawing as a quadtree of tiles, with a %s manifest, to this directory.""" % TILE_MANIFEST)
+
+parser.add_argument('-tile_levels', type=int, nargs=None, action="store",
+                    default=4,
+                    help="The number of levels of tiles to write.")
+
+parser.add_argument('-tile_pixels', type=int, nargs=None, action="store",
+                    default=512,
+                    help="""The width in pixels that tiles are shown at.
+Paths smaller than a pixel are left out of all but the last level.""")
+
+parser.add_argument('-stream',
+                    action="store_true",
+                    help="""Process the input file as a stream rather than loading it into memory.
+Not compatible with -%s.""" % ", -".join(STREAM_UNSUPPORTED_ARGUMENTS))
+
+
+
+def element_counter(counts):
+    '''Returns a do_elements visitor that tallies tag names in the
+    Counter counts.'''
+    return lambda elt: counts.update([elt.tagName])
+
+
+def css_class_counter(counts):
+    '''Returns a do_elements visitor that tallies class attributes in
+    the Counter counts.'''
+    return lambda elt: counts.update([elt.getAttribute("class")])
+
+
+def print_counts(counts):
+    for item in counts.items():
+        print("%s\t%d" % item)
 
 
 def show_element_counts(doc):
     element_counts = Counter()
-    def counter(elt):
-        element_counts.update([elt.tagName])
-    do_elements(doc, counter)
-    for item in element_counts.items():
-        print("%s\t%d" % item)
+    do_elements(doc, element_counter(element_counts))
+    print_counts(element_counts)
 
 
 def show_css_class_counts(doc):
     class_counts = Counter()
-    def counter(elt):
-        class_counts.update([elt.getAttribute("class")])
-    do_elements(doc, counter)
-    for item in class_counts.items():
-        print("%s\t%d" % item)
+    do_elements(doc, css_class_counter(class_counts))
+    print_counts(class_counts)
 
 
-def main():
+def add_decorations(doc, args, viewbox, clip_box, styles_map,
+                    boxes_to_show=BoxArray(), scale_elements=[],
+                    path_index=None):
+    '''Add the grids, boxes, stylesheets and other things that the command
+    line arguments call for to doc, and relocate the drawing scale.'''
     need_grid_styles = False
-    args = parser.parse_args()
-    doc = load_inkscape(args.input_file)
-    # Count elements
-    print("\nBEFORE CHANGES")
-    show_element_counts(doc)
-    # Extract styles before any document modifications so that class
-    # names will be consistent from run to run.
-    styles_map = extract_styles(doc)
-    # Get the viewbox
-    # *** HACK: viewBox could use different delimiters.  Maybe should use a regular expression.
-    viewbox = [ int(x) for x in doc.documentElement.getAttribute("viewBox").split()]
-    print("viewBox", viewbox)
-    clip_box = Box(*args.clip_box) if args.clip_box else Box.xywh(*viewbox)
-    print(clip_box)
-    boxes_to_show = read_box_file(args.boxes_file)
-    # Find the drawing elements that show the drawing's scale and
-    # capture the transfomation matrix from each's current SVG context
-    scale_elements = [
-        (elt, svg_context(elt)[0])
-        for elt in ([] if args.drawing_scale_box == None
-                    else tag_boxes(doc, [Box(*args.drawing_scale_box)], False).values())]
-    # Remove elements that are outside the clip box.
-    if args.clip:
-        clip_text(doc, clip_box)
-        clip_paths(doc, clip_box)
-        remove_empty_groups(doc)
-        print("\nAFTER CLIPPING")
-        show_element_counts(doc)
-    if args.clip_svg_viewbox:
-        update_svg_viewbox(doc, clip_box, args.increase_viewbox_height[0])
     # Show clip box:
     if  args.show_clip_box:
         test_viewbox(doc, clip_box)
@@ -632,18 +1540,21 @@ def main():
             doc, ensure_stylesheet(doc, "decorations"),
             ".viewportGrid", "stroke: yellow;")
     # Show and tag the boxes we've been told to.
-    box_elements_map = tag_boxes(doc, boxes_to_show)
+    if len(boxes_to_show):
+        tag_boxes(doc, boxes_to_show, index=path_index)
     show_boxes(doc, boxes_to_show)
     # Relocate the scale elements by putting them into a new SVG group and translating them.
     scale_group = doc.createElement("g")
     doc.documentElement.appendChild(scale_group)
-    scale_group.setAttribute("id", "drawingScale")
+    set_element_id(scale_group, "drawingScale")
     for element, transform in scale_elements:
         scale_group.appendChild(element)
         element.setAttribute("transform", transform.toSVG())
+        SVG_CONTEXTS.invalidate(element)
     if args.scale_relocation != None:
         scale_group.setAttribute("transform",
                                  Transform.translate(*args.scale_relocation).toSVG())
+        SVG_CONTEXTS.invalidate(scale_group)
     # Replicate any style rules referenced by the scale group so that
     # we can modify the style rules of the drawiing proper without
     # affecting the sacale graphics.
@@ -654,8 +1565,6 @@ def main():
     hide_classes(styles_map, args.hide_classes.split(","))
     modify_styles(styles_map)
     add_stylesheet(doc, styles_map)
-    # Get rid of things we don't need
-    do_elements(doc, remove_attributes)
     real_world_group = add_real_world_group(doc,
                                             args.scale_factor[0],
                                             clip_box)
@@ -680,19 +1589,87 @@ def main():
     # Add comments about processing
     # This is done last so that the comment appears before any other
     # added frontmatter like stylesheets.
-    if boxes_to_show:
+    if len(boxes_to_show):
         doc.documentElement.insertBefore(doc.createComment(
             "\nShow boxes:\n%r\n" % boxes_to_show),
         doc.documentElement.firstChild)
     doc.documentElement.insertBefore(doc.createComment(
         '\n' + (' '.join(sys.argv).replace('--', '-') +'\n')),
         doc.documentElement.firstChild)
+
+
+def main():
+    args = parser.parse_args()
+    if args.stream:
+        for a in STREAM_UNSUPPORTED_ARGUMENTS:
+            if getattr(args, a) != None:
+                parser.error("-%s can't be used with -stream" % a)
+        stream_cleanup(args, args.output_file)
+        return
+    doc = load_inkscape(args.input_file)
+    SVG_CONTEXTS.prime(doc)
+    # Count elements, extract styles and get rid of attributes we
+    # don't need in one pass over the document.  Styles are extracted
+    # before any document modifications so that class names will be
+    # consistent from run to run.
+    element_counts = Counter()
+    styles_map = StyleMap()
+    do_elements(doc,
+                element_counter(element_counts),
+                style_extractor(styles_map),
+                remove_attributes)
+    print("\nBEFORE CHANGES")
+    print_counts(element_counts)
+    # Get the viewbox
+    # *** HACK: viewBox could use different delimiters.  Maybe should use a regular expression.
+    viewbox = [ int(x) for x in doc.documentElement.getAttribute("viewBox").split()]
+    print("viewBox", viewbox)
+    clip_box = Box(*args.clip_box) if args.clip_box else Box.xywh(*viewbox)
+    print(clip_box)
+    boxes_to_show = read_box_file(args.boxes_file)
+    # Parse every path once and index the paths by their bounds.
+    path_index = PathIndex(doc)
+    # Find the drawing elements that show the drawing's scale and
+    # capture the transfomation matrix from each's current SVG context
+    scale_elements = [
+        (elt, svg_context(elt)[0])
+        for elts in ([] if args.drawing_scale_box == None
+                     else tag_boxes(doc, [Box(*args.drawing_scale_box)], False,
+                                    path_index).values())
+        for elt in elts]
+    # Remove elements that are outside the clip box.
+    if args.clip:
+        clip_text(doc, clip_box)
+        clip_paths(doc, clip_box, path_index)
+        remove_empty_groups(doc)
+        print("\nAFTER CLIPPING")
+        show_element_counts(doc)
+    if simplifying(args):
+        saved = simplify_paths(path_index, simplification_tolerance(args),
+                               args.precision)
+        print("\nSimplifying paths saved %d bytes" % saved)
+    if args.clip_svg_viewbox:
+        update_svg_viewbox(doc, clip_box, args.increase_viewbox_height[0])
+    add_decorations(doc, args, viewbox, clip_box, styles_map,
+                    boxes_to_show, scale_elements, path_index)
     # Save
+    element_counts = Counter()
+    class_counts = Counter()
+    do_elements(doc,
+                element_counter(element_counts),
+                css_class_counter(class_counts))
     print("\nAFTER ALL CHANGES")
-    show_element_counts(doc)
+    print_counts(element_counts)
     print("\nCSS classes:")
-    show_css_class_counts(doc)
-    write_pretty(doc, "cleaned_up.svg")
+    print_counts(class_counts)
+    with atomic_output(args.output_file) as temp:
+        write_pretty(doc, temp)
+    if args.tiles_directory:
+        manifest = write_tiles(doc, args.tiles_directory, clip_box,
+                               args.tile_levels, args.tile_pixels,
+                               args.precision)
+        print("\nWrote %d tiles to %s" % (len(manifest["tiles"]),
+                                          args.tiles_directory))
 
 
 if __name__ == "__main__":
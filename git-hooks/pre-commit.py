@@ -1,78 +1,40 @@
 #!/usr/bin/python3
 
 # A precommit script to test that JSON files are without JSON syntax
-# error and only include supported properties.
+# error and that the furnishing files among them match the furnishing
+# schema in lib/furnishing_schema.py.  The furnishing files of each
+# facility that has a staged furnishing file are also checked against
+# each other, for unique_ids that are used more than once among the
+# files that a page of the facility loads together, see build.py, and
+# for description_uris that refer to files that aren't there.  Problems
+# are reported by line and column.
+#
+# As a hook it checks the staged content of each JSON file, which it
+# reads from the index with a single git cat-file --batch process.
+# The result of checking each blob is cached by its SHA in
+# json-check-cache.json in the git directory, so content that has been
+# checked before isn't checked again.  The cached result includes the
+# unique_ids and description_uris of the blob, so the checks across the
+# files of a facility only read the files that haven't been seen
+# before.  Large batches of unchecked blobs are checked in parallel.
+#
+# Furnishings bundles and search indices, see lib/bundle.py and
+# lib/search_index.py, are published along with the files they're made
+# from, so a commit that stages one of them, or one of the JSON files
+# that one is made from, is also checked for bundles and indices that
+# weren't made from the staged content of their files, as recorded in
+# them, see lib/sources.py.
 
 # To use this pre-commit hook in your local clone of the repository,
 # from your repository root do (on unix)
 #   ln -s `pwd`/git-hooks/pre-commit.py .git/hooks/pre-commit
 
+import hashlib
 import os
 import sys
 import subprocess
 import json
 
-SUPPORTED_PROPERTIES = [
-    'name',
-    'unique_id',
-    'cssClass',
-    'clustermarket_id',
-    'width',
-    'depth',
-    'path_d',
-    'x',
-    'y',
-    'rotation',
-    'description',
-    'description_uri',
-    'contents',
-    'booking_note',
-    'measured'
-    ]
-
-# Return a list of properties that appear in a JSON item description
-# but are not in SUPPORTED_PROPERTIES.
-def check_json_properties(data):
-    unknown = []
-    for d in data:
-        if isinstance(d, dict):
-            for property in d:
-                if not (property in SUPPORTED_PROPERTIES):
-                    if not (property in unknown):
-                        unknown.append(property)
-    return unknown
-
-
-def get_files():
-     cp = subprocess.run(["git", "diff", "--cached", "--name-only"],
-                         capture_output=True,
-                         text=True)
-     if cp.returncode != 0 or cp.stderr != "":
-         raise Exception("git diff failed: %s" % cp.stderr)
-         sys.exit(-1)
-     return [ s for s in cp.stdout.split("\n") if s ]
-     pass
-
-
-# Return True for failure.
-def check_json(filename):
-    if os.path.splitext(filename)[1] != ".json":
-        return False
-    with open(filename, 'r') as file:
-        try:
-            data = json.load(file)
-            unsupported = check_json_properties(data)
-            if unsupported:
-                print("%s: unsupported properties: %s" % (filename, unsupported))
-                return True
-        except Exception as e:
-            print("%s: %s" % (filename, e))
-            return True
-            pass
-        pass
-    return False
-    pass
-
 
 def repo_root():
     f = os.path.dirname(os.path.abspath(__file__))
@@ -81,20 +43,313 @@ def repo_root():
     return f
 
 
+# What's the right way to load these?
+sys.path.insert(0, os.path.join(repo_root(), "lib"))
+sys.path.insert(0, repo_root())
+
+from sources import blob_sha, changed_sources
+from furnishings import facility_directory, furnishing_files
+from furnishings import is_furnishing_file
+from furnishing_schema import IntegrityIndex, check_furnishings
+
+from build import Facility
+
+# The files whose code decides the result of checking a blob.
+CHECKER_FILES = [
+    os.path.abspath(__file__),
+    os.path.join(repo_root(), "lib", "furnishing_schema.py"),
+    os.path.join(repo_root(), "lib", "json_text.py")
+    ]
+
+BUNDLE_SUFFIX = ".bundle.json"
+
+SEARCH_INDEX = "search_index.json"
+
+# The hash of the empty tree, to compare the index to when there are no
+# commits yet.
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+CACHE_FILE = "json-check-cache.json"
+
+# The most results to keep in the cache.
+CACHE_SIZE = 10000
+
+# Check blobs in parallel if there are at least this many bytes of them.
+PARALLEL_BYTES = 1000000
+
+
+def git(*args, input=None):
+    cp = subprocess.run(["git"] + list(args), input=input,
+                        capture_output=True)
+    if cp.returncode != 0:
+        raise Exception("git %s failed: %s" % (args[0], cp.stderr.decode()))
+    return cp.stdout
+
+
+# Returns a list of (filename, blob SHA) for the JSON files whose
+# content is being added or changed by the commit.
+def get_staged_files():
+    head = "HEAD"
+    try:
+        git("rev-parse", "--verify", "--quiet", "HEAD")
+    except Exception:
+        head = EMPTY_TREE
+    # Each change is ":old_mode new_mode old_sha new_sha status\0path\0".
+    fields = git("diff-index", "--cached", "--no-renames", "-z",
+                 "--diff-filter=ACM", head).decode().split("\0")
+    files = []
+    for i in range(0, len(fields) - 1, 2):
+        sha = fields[i].split()[3]
+        filename = fields[i + 1]
+        if os.path.splitext(filename)[1] == ".json":
+            files.append((filename, sha))
+    return files
+    pass
+
+
+# Returns a list of (filename, blob SHA) for every file in the index.
+def get_indexed_files():
+    # Each entry is "mode sha stage\tpath\0".
+    files = []
+    for entry in git("ls-files", "--stage", "-z").decode().split("\0"):
+        if not entry:
+            continue
+        info, filename = entry.split("\t", 1)
+        mode, sha, stage = info.split()
+        if stage == "0":
+            files.append((filename, sha))
+    return files
+
+
+# Returns a dict mapping each of the blob SHAs in shas to its content,
+# read with one git cat-file process.
+def read_blobs(shas):
+    if not shas:
+        return {}
+    output = git("cat-file", "--batch",
+                 input="".join([sha + "\n" for sha in shas]).encode())
+    blobs = {}
+    i = 0
+    while i < len(output):
+        header_end = output.index(b"\n", i)
+        sha, kind, size = output[i:header_end].decode().split()
+        start = header_end + 1
+        blobs[sha] = output[start : start + int(size)]
+        # The content is followed by a newline.
+        i = start + int(size) + 1
+    return blobs
+
+
+# Returns the result of checking the JSON file content, a dict with
+# the list of its problems, each [line, column, problem], and the
+# unique_ids and description_uris in it.  A JSON array is checked as a
+# furnishing file, anything else only for syntax.
+def check_json_content(content):
+    result = { "problems": [], "unique_ids": [], "description_uris": [] }
+    try:
+        text = content.decode("utf-8")
+        if text.lstrip()[:1] == "[":
+            return check_furnishings(text)
+        json.loads(text)
+    except json.JSONDecodeError as e:
+        result["problems"].append([e.lineno, e.colno, e.msg])
+    except Exception as e:
+        result["problems"].append([1, 1, str(e)])
+        pass
+    return result
+
+
+class CheckCache (object):
+    '''CheckCache remembers the result of checking each blob, by SHA.
+    The cache is discarded if any of the CHECKER_FILES change.'''
+    def __init__(self, path):
+        self.path = path
+        checker = hashlib.sha256()
+        for filename in CHECKER_FILES:
+            with open(filename, "rb") as f:
+                checker.update(f.read())
+        self.checker = checker.hexdigest()
+        self.results = {}
+        self.changed = False
+        try:
+            with open(path, "r") as f:
+                cache = json.load(f)
+            if cache.get("checker") == self.checker:
+                self.results = cache["results"]
+        except (OSError, ValueError):
+            pass
+
+    def record(self, sha, result):
+        self.results.pop(sha, None)
+        self.results[sha] = result
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        results = list(self.results.items())[-CACHE_SIZE:]
+        temp = self.path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump({ "checker": self.checker, "results": dict(results) }, f)
+        os.replace(temp, self.path)
+
+
+# Check the blobs, a dict mapping SHA to content.  Returns a dict
+# mapping each SHA to the result of checking it.
+def check_blobs(blobs):
+    shas = list(blobs)
+    contents = [blobs[sha] for sha in shas]
+    if (len(contents) > 1 and
+        sum([len(c) for c in contents]) >= PARALLEL_BYTES):
+        # Only imported when needed, since importing it takes a while.
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor() as executor:
+            results = list(executor.map(check_json_content, contents,
+                                        chunksize=16))
+    else:
+        results = [check_json_content(c) for c in contents]
+    return dict(zip(shas, results))
+
+
+# Add the content of the file filename in the working tree to contents,
+# a dict mapping SHA to content, and return its SHA.
+def read_file(filename, contents):
+    with open(filename, "rb") as f:
+        content = f.read()
+    sha = blob_sha(content)
+    contents[sha] = content
+    return sha
+
+
+# Returns True iff filename is a generated file that records the files
+# it was made from: a furnishings bundle or a search index.
+def is_generated(filename):
+    return (filename.endswith(BUNDLE_SUFFIX) or
+            os.path.basename(filename) == SEARCH_INDEX)
+
+
+# Returns a list of (filename, line, column, problem) for the generated
+# files, a list of (filename, SHA), that weren't made from the content
+# of the files they record, for each one that is or was made from a
+# file among checked.  contents maps SHA to content and sha_of returns
+# the SHA of the content of a file, or None if there's no such file.
+def generated_problems(generated, contents, sha_of, checked):
+    problems = []
+    for filename, sha in generated:
+        try:
+            data = json.loads(contents[sha].decode("utf-8"))
+        except ValueError:
+            # Reported by the JSON syntax check.
+            continue
+        filename = os.path.normpath(filename)
+        directory = os.path.dirname(filename)
+        sources = data.get("sources") if isinstance(data, dict) else None
+        if not isinstance(sources, dict):
+            if filename in checked:
+                problems.append((filename, 1, 1,
+                                 "doesn't record the files it was made "
+                                 "from, rebuild it with build.py"))
+            continue
+        paths = set([os.path.normpath(os.path.join(directory, f))
+                     for f in sources])
+        if filename not in checked and not paths.intersection(checked):
+            continue
+        for path in changed_sources(sources, directory, sha_of):
+            problems.append((filename, 1, 1,
+                             "wasn't made from the content of %s, "
+                             "rebuild it with build.py" % path))
+    return problems
+
+
 def main():
     os.chdir(repo_root())
-    if len(sys.argv) > 1:
-        files = sys.argv[1:]
+    working_tree = len(sys.argv) > 1
+    if working_tree:
+        # Check the named files as they are in the working tree.
+        contents = {}
+        files = [(filename, read_file(filename, contents))
+                 for filename in sys.argv[1:]
+                 if os.path.splitext(filename)[1] == ".json"]
     else:
-        files = get_files()
-    failed = False
-    for file in files:
-        failed = check_json(file) or failed
-    if failed:
+        contents = None
+        files = get_staged_files()
+    # Maps the directory of each facility with a furnishing file being
+    # checked to a list of (filename, SHA) for all of its furnishing
+    # files, to check them against each other.
+    facilities = {}
+    for filename, sha in files:
+        if is_furnishing_file(filename):
+            facility = facility_directory(filename)
+            if facility:
+                facilities[facility] = []
+    if facilities:
+        if working_tree:
+            exists = os.path.exists
+            for facility, facility_files in facilities.items():
+                for filename in furnishing_files(facility):
+                    facility_files.append(
+                        (filename, read_file(filename, contents)))
+        else:
+            indexed = get_indexed_files()
+            paths = set([os.path.normpath(f) for f, sha in indexed])
+            exists = lambda path: path in paths
+            for filename, sha in indexed:
+                if is_furnishing_file(filename):
+                    facility = facility_directory(filename)
+                    if facility in facilities:
+                        facilities[facility].append((filename, sha))
+    cache = CheckCache(os.path.join(
+        git("rev-parse", "--git-dir").decode().strip(), CACHE_FILE))
+    unchecked = set([sha for filename, sha in files
+                     if sha not in cache.results])
+    for facility_files in facilities.values():
+        unchecked.update([sha for filename, sha in facility_files
+                          if sha not in cache.results])
+    if contents is None:
+        contents = read_blobs(sorted(unchecked))
+    for sha, result in check_blobs(
+            dict([(sha, contents[sha]) for sha in unchecked])).items():
+        cache.record(sha, result)
+    cache.save()
+    problems = []
+    for filename, sha in files:
+        for line, column, problem in cache.results[sha]["problems"]:
+            problems.append((filename, line, column, problem))
+    # Only the problems across files that involve a file being checked
+    # are reported.
+    checked = set([os.path.normpath(filename) for filename, sha in files])
+    for facility, facility_files in sorted(facilities.items()):
+        groups = Facility(facility).page_groups(
+            [os.path.normpath(filename) for filename, sha in facility_files])
+        index = IntegrityIndex(exists, groups)
+        for filename, sha in facility_files:
+            index.add(os.path.normpath(filename), cache.results[sha])
+        problems += index.problems(checked)
+    if any([is_furnishing_file(f) or is_generated(f) for f in checked]):
+        if working_tree:
+            generated = []
+            for d, subdirectories, filenames in os.walk("Facilities"):
+                generated += [(os.path.join(d, f),
+                               read_file(os.path.join(d, f), contents))
+                              for f in sorted(filenames)
+                              if is_generated(f)]
+            sha_of = lambda path: (read_file(path, contents)
+                                   if os.path.exists(path) else None)
+        else:
+            if not facilities:
+                indexed = get_indexed_files()
+            generated = [(f, sha) for f, sha in indexed if is_generated(f)]
+            contents.update(read_blobs([sha for f, sha in generated
+                                        if sha not in contents]))
+            sha_of = dict([(os.path.normpath(f), sha)
+                           for f, sha in indexed]).get
+        problems += generated_problems(generated, contents, sha_of, checked)
+    for problem in problems:
+        print("%s:%d:%d: %s" % problem)
+    if problems:
         sys.exit(-1)
     sys.exit(0)
 
 
 if __name__ == "__main__":
     main()
-
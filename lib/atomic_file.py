@@ -0,0 +1,51 @@
+# Write files so that readers never see a partly written file.
+
+
+import contextlib
+import os
+import os.path
+import stat
+import tempfile
+
+
+def umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# The permissions a new file is created with.
+NEW_FILE_MODE = 0o666 & ~umask()
+
+
+@contextlib.contextmanager
+def atomic_output(path):
+    '''A context manager that provides the name of a temporary file to
+    write instead of path.  If the body of the with statement completes
+    normally the temporary file replaces path, otherwise it is deleted.
+    The temporary file is in the same directory as path, so that it can
+    be renamed to path, and its name is unique, so that two writers of
+    the same path don't write to the same temporary file.'''
+    directory, name = os.path.split(path)
+    fd, temp = tempfile.mkstemp(prefix="." + name + ".", suffix=".tmp",
+                                dir=directory or ".")
+    os.close(fd)
+    try:
+        # mkstemp makes a file that only its owner can read.
+        os.chmod(temp, stat.S_IMODE(os.stat(path).st_mode)
+                 if os.path.exists(path)
+                 else NEW_FILE_MODE)
+        yield temp
+        os.replace(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode="w", **kwargs):
+    '''Like open, but path is only replaced once the body of the with
+    statement completes normally.'''
+    with atomic_output(path) as temp:
+        with open(temp, mode, **kwargs) as f:
+            yield f
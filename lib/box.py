@@ -1,9 +1,6 @@
 # Boxes
 
 
-from functools import reduce
-import operator
-
 import svg.path
 
 from points import *
@@ -11,12 +8,20 @@ from points import *
 
 class Box (object):
     '''Box defines a rectangular region aligned in the viewPort.'''
+    __slots__ = ("minX", "minY", "maxX", "maxY")
 
     @classmethod
     def xywh(cls, x, y, width, height):
         '''Create a new box given top left X and Y and width and height.'''
         return Box(x, y, x + width, y + height)
 
+    @classmethod
+    def bounding(cls, xs, ys):
+        '''Create the smallest box that contains all of the points whose
+        X and Y coordinates are given by the sequences xs and ys.'''
+        return Box(float(numpy.min(xs)), float(numpy.min(ys)),
+                   float(numpy.max(xs)), float(numpy.max(ys)))
+
     def __init__(self, minX, minY, maxX, maxY):
         self.minX = minX
         self.minY = minY
@@ -30,7 +35,7 @@ class Box (object):
                 self.maxY == other.maxY)
 
     def __hash__(self):
-        return hash(repr(self))
+        return hash((self.minX, self.minY, self.maxX, self.maxY))
 
     def __str__(self):
         return "x: %d..%d y: %d..%d" % (
@@ -76,30 +81,78 @@ class Box (object):
                 self.minY <= y and
                 self.maxY >= y)
 
-    def line_intersects(self, transform, svgLine):
-        '''Returns True iff any of svgLine is within this Box.'''
-        assert isinstance(svgLine, svg.path.Line)
-        # The line does not cross the rectangle if all four corners
-        # of self are on the same side of svgLine.
-        p1 = transform.apply(cToV(svgLine.start))
-        p2 = transform.apply(cToV(svgLine.end))
+    def intersects(self, other):
+        '''Returns True iff this Box and the Box other overlap.'''
+        return (self.minX <= other.maxX and
+                self.maxX >= other.minX and
+                self.minY <= other.maxY and
+                self.maxY >= other.minY)
+
+    def contains(self, other):
+        '''Returns True iff the Box other is wholly within this Box.'''
+        return (self.minX <= other.minX and
+                self.maxX >= other.maxX and
+                self.minY <= other.minY and
+                self.maxY >= other.maxY)
+
+    def points_within(self, points, transform=None):
+        '''points is an (N,2) array of X and Y coordinates.  If
+        transform is provided it is first applied to each point.  Returns
+        an N element boolean array which is True for each point that is
+        within the box.'''
+        points = transformed(transform, points)
+        x = points[..., 0]
+        y = points[..., 1]
+        return ((self.minX <= x) & (self.maxX >= x) &
+                (self.minY <= y) & (self.maxY >= y))
+
+    def lines_intersect(self, starts, ends, transform=None):
+        '''starts and ends are (N,2) arrays of the end points of N line
+        segments.  If transform is provided it is first applied to each
+        point.  Returns an N element boolean array which is True for each
+        line segment that is within this Box.'''
+        p1 = transformed(transform, starts)
+        p2 = transformed(transform, ends)
         v = p2 - p1
-        sides = [ numpy.sign(numpy.cross(v, p - p1)[2])
-                  for p in self.corners() ]
-        if 4 == abs(reduce(operator.add, sides)):
-            # All four corners are on the same side
-            return False
+        # The line does not cross the rectangle if all four corners
+        # of self are on the same side of it.
+        sides = numpy.zeros(len(p1))
+        for cx, cy in ((self.minX, self.minY), (self.maxX, self.minY),
+                       (self.minX, self.maxY), (self.maxX, self.maxY)):
+            sides += numpy.sign(v[:, 0] * (cy - p1[:, 1]) -
+                                v[:, 1] * (cx - p1[:, 0]))
         # We need to check the end points of the line
-        return self.point_within(p1) or self.point_within(p2)
+        return ((numpy.abs(sides) != 4) &
+                (self.points_within(p1) | self.points_within(p2)))
+
+    def cubicBeziers_intersect(self, starts, control1s, control2s, ends,
+                               transform=None):
+        '''The arguments are (N,2) arrays of the start, control and end
+        points of N cubic Bezier curves.  If transform is provided it is
+        first applied to each point.  Returns an N element boolean array
+        which is True for each curve that has its start, end or control
+        points within the box.'''
+        return (self.points_within(starts, transform) |
+                self.points_within(control1s, transform) |
+                self.points_within(control2s, transform) |
+                self.points_within(ends, transform))
+
+    def line_intersects(self, transform, svgLine):
+        '''Returns True iff any of svgLine is within this Box.'''
+        assert isinstance(svgLine, (svg.path.Line, svg.path.Close))
+        return bool(self.lines_intersect(xy_array([svgLine.start]),
+                                         xy_array([svgLine.end]),
+                                         transform)[0])
 
     def cubicBezier_intersects(self, transform, cb):
         '''Returns true iff the start, end and control points
         of cb are within the box.'''
         assert isinstance(cb, svg.path.CubicBezier)
-        return (self.point_within(transform.apply(cToV(cb.start))) or
-                self.point_within(transform.apply(cToV(cb.control1))) or
-                self.point_within(transform.apply(cToV(cb.control2))) or
-                self.point_within(transform.apply(cToV(cb.end))))
+        return bool(self.cubicBeziers_intersect(xy_array([cb.start]),
+                                                xy_array([cb.control1]),
+                                                xy_array([cb.control2]),
+                                                xy_array([cb.end]),
+                                                transform)[0])
 
     def translate(self, dx, dy):
         '''Returns a new box that has been translated by the specified dx and dy.'''
@@ -112,6 +165,151 @@ class Box (object):
         return Box(scale_factor * self.minX,
                    scale_factor * self.minY,
                    scale_factor * self.maxX,
-                   scale_factor * self.maxX)
+                   scale_factor * self.maxY)
+
+    def expand(self, margin):
+        '''Returns a new box that extends margin beyond this one on
+        every side.'''
+        return Box(self.minX - margin,
+                   self.minY - margin,
+                   self.maxX + margin,
+                   self.maxY + margin)
+
+    def quadrants(self):
+        '''Returns the four boxes that divide this one in half in each
+        dimension, in the order top left, top right, bottom left, bottom
+        right.'''
+        midX = (self.minX + self.maxX) / 2
+        midY = (self.minY + self.maxY) / 2
+        return [ Box(self.minX, self.minY, midX, midY),
+                 Box(midX, self.minY, self.maxX, midY),
+                 Box(self.minX, midY, midX, self.maxY),
+                 Box(midX, midY, self.maxX, self.maxY) ]
+
+    def union(self, other):
+        '''Returns the smallest Box that contains both this Box and other.'''
+        return Box(min(self.minX, other.minX), min(self.minY, other.minY),
+                   max(self.maxX, other.maxX), max(self.maxY, other.maxY))
+
+    def intersection(self, other):
+        '''Returns the Box that is within both this Box and other, or None
+        if they don't overlap.'''
+        if not self.intersects(other):
+            return None
+        return Box(max(self.minX, other.minX), max(self.minY, other.minY),
+                   min(self.maxX, other.maxX), min(self.maxY, other.maxY))
+
+
+class BoxArray (object):
+    '''BoxArray holds many boxes as the rows of a single (N,4) numpy array
+    of minX, minY, maxX and maxY.  Iterating over a BoxArray or indexing it
+    with an integer gives Box objects.'''
+    __slots__ = ("array",)
+
+    @classmethod
+    def from_boxes(cls, boxes):
+        return cls([[b.minX, b.minY, b.maxX, b.maxY] for b in boxes])
+
+    def __init__(self, array=()):
+        self.array = numpy.array(array, dtype=float).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, i):
+        return Box(*self.array[i].tolist())
+
+    def __iter__(self):
+        for row in self.array.tolist():
+            yield Box(*row)
+
+    def __eq__(self, other):
+        return (isinstance(other, BoxArray) and
+                numpy.array_equal(self.array, other.array))
+
+    def __repr__(self):
+        return "BoxArray(%r)" % list(self)
+
+    @property
+    def minX(self):
+        return self.array[:, 0]
+
+    @property
+    def minY(self):
+        return self.array[:, 1]
+
+    @property
+    def maxX(self):
+        return self.array[:, 2]
+
+    @property
+    def maxY(self):
+        return self.array[:, 3]
+
+    @property
+    def width(self):
+        return self.maxX - self.minX
+
+    @property
+    def height(self):
+        return self.maxY - self.minY
+
+    def point_within(self, points):
+        '''points is an (M,2) array of X and Y coordinates, or a single
+        point.  Returns an (N,M) boolean array, or an N element one for a
+        single point, which is True where a point is within a box.'''
+        points = numpy.asarray(points, dtype=float)
+        x = points[..., 0]
+        y = points[..., 1]
+        if points.ndim > 1:
+            x = x[numpy.newaxis, :]
+            y = y[numpy.newaxis, :]
+            a = self.array[:, :, numpy.newaxis]
+        else:
+            a = self.array
+        return ((a[:, 0] <= x) & (a[:, 2] >= x) &
+                (a[:, 1] <= y) & (a[:, 3] >= y))
+
+    def intersects(self, box):
+        '''Returns an N element boolean array which is True for each box
+        that overlaps the Box box.'''
+        a = self.array
+        return ((a[:, 0] <= box.maxX) & (a[:, 2] >= box.minX) &
+                (a[:, 1] <= box.maxY) & (a[:, 3] >= box.minY))
+
+    def translate(self, dx, dy):
+        '''Returns a new BoxArray with every box translated by dx and dy.'''
+        return BoxArray(self.array + [dx, dy, dx, dy])
+
+    def scale(self, scale_factor):
+        '''Returns a new BoxArray with every box scaled by scale_factor.'''
+        return BoxArray(self.array * scale_factor)
+
+    def union(self):
+        '''Returns the smallest Box that contains all of the boxes.'''
+        if len(self) == 0:
+            return None
+        return Box(*numpy.concatenate([self.array[:, :2].min(axis=0),
+                                       self.array[:, 2:].max(axis=0)]).tolist())
+
+    def intersection(self):
+        '''Returns the Box that is within all of the boxes, or None if
+        there is no such Box.'''
+        if len(self) == 0:
+            return None
+        box = Box(*numpy.concatenate([self.array[:, :2].max(axis=0),
+                                      self.array[:, 2:].min(axis=0)]).tolist())
+        if box.minX > box.maxX or box.minY > box.maxY:
+            return None
+        return box
+
+
 
 
+def transformed(transform, points):
+    '''Apply transform to the (N,2) array points.  Returns points itself
+    if transform is None.'''
+    points = numpy.asarray(points, dtype=float)
+    if transform is None:
+        return points
+    return transform.apply_many(points)
@@ -0,0 +1,178 @@
+# A furnishings bundle holds the things from several furnishing JSON
+# files in one compact, columnar JSON document so that a floor plan
+# page can load them all with one request.
+#
+# The bundle is a JSON object:
+#
+#   format, version  identify the bundle format.
+#   count            the number of things.
+#   dictionaries     for each of DICTIONARY_COLUMNS, the list of its
+#                    distinct values.
+#   columns          for each of the COLUMNS, a list with one value per
+#                    thing, or null if the thing lacks that property.
+#                    Values of DICTIONARY_COLUMNS are indices into the
+#                    dictionary.  NUMERIC_COLUMNS only hold numbers; a
+#                    thing whose value isn't a number keeps it in other.
+#   other            for each thing, an object with the rest of its
+#                    properties.
+#   index            maps each unique_id to the index of its thing.
+#   sources          maps the from_file of each JSON file the bundle was
+#                    made from to the SHA that git gives its content, so
+#                    that a bundle that's out of date can be recognized,
+#                    see sources.py.
+
+
+import json
+import os.path
+
+import numpy
+
+from atomic_file import atomic_open
+from sources import blob_sha, changed_sources, file_sha
+
+
+BUNDLE_FORMAT = "MapMyStuff furnishings bundle"
+BUNDLE_VERSION = 2
+
+NUMERIC_COLUMNS = ("x", "y", "width", "depth", "rotation")
+DICTIONARY_COLUMNS = ("cssClass", "from_file")
+COLUMNS = ("unique_id", "name") + DICTIONARY_COLUMNS + NUMERIC_COLUMNS
+
+
+def is_number(x):
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+
+def make_bundle(things_files, relative_to="."):
+    '''Returns the bundle, as a JSON compatible dict, of the things in
+    the JSON files things_files.  The from_file of each thing is the
+    name of its file relative to the directory relative_to.'''
+    columns = dict([(c, []) for c in COLUMNS])
+    dictionaries = dict([(c, []) for c in DICTIONARY_COLUMNS])
+    codes = dict([(c, {}) for c in DICTIONARY_COLUMNS])
+    other = []
+    index = {}
+    sources = {}
+    def encode(column, value):
+        code = codes[column].get(value)
+        if code is None:
+            code = codes[column][value] = len(dictionaries[column])
+            dictionaries[column].append(value)
+        return code
+    for things_file in things_files:
+        with open(things_file, "rb") as f:
+            content = f.read()
+        things = json.loads(content.decode("utf-8"))
+        from_file = os.path.relpath(things_file, relative_to).replace(
+            os.path.sep, "/")
+        sources[from_file] = blob_sha(content)
+        for thing in things:
+            thing = dict(thing)
+            thing["from_file"] = from_file
+            unique_id = thing.get("unique_id")
+            if unique_id is not None and unique_id not in index:
+                index[unique_id] = len(other)
+            for c in COLUMNS:
+                value = thing.get(c)
+                if c in NUMERIC_COLUMNS and not is_number(value):
+                    value = None
+                if value is not None:
+                    del thing[c]
+                    if c in DICTIONARY_COLUMNS:
+                        value = encode(c, value)
+                columns[c].append(value)
+            other.append(thing)
+    return {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "count": len(other),
+        "dictionaries": dictionaries,
+        "columns": columns,
+        "other": other,
+        "index": index,
+        "sources": sources
+    }
+
+
+def write_bundle(things_files, output_file, relative_to=None):
+    '''Write the bundle of the JSON files things_files to output_file.
+    By default from_file names are relative to the directory of
+    output_file.'''
+    if relative_to is None:
+        relative_to = os.path.dirname(os.path.abspath(output_file))
+    bundle = make_bundle(things_files, relative_to)
+    with atomic_open(output_file, "w") as f:
+        json.dump(bundle, f, separators=(",", ":"))
+
+
+class FurnishingsBundle (object):
+    '''FurnishingsBundle reads a furnishings bundle.'''
+
+    @classmethod
+    def read(cls, path):
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def __init__(self, bundle):
+        if (bundle.get("format") != BUNDLE_FORMAT or
+            bundle.get("version") != BUNDLE_VERSION):
+            raise ValueError("Not a version %d furnishings bundle" %
+                             BUNDLE_VERSION)
+        self.bundle = bundle
+        self.count = bundle["count"]
+        self.columns = bundle["columns"]
+        self.dictionaries = bundle["dictionaries"]
+        self.other = bundle["other"]
+        self.index = bundle["index"]
+        self.sources = bundle["sources"]
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, unique_id):
+        return unique_id in self.index
+
+    def __getitem__(self, unique_id):
+        '''Returns the thing with the specified unique_id.'''
+        return self.thing(self.index[unique_id])
+
+    def column(self, name):
+        '''Returns the list of the values of the named column, with
+        dictionary columns decoded.'''
+        values = self.columns[name]
+        if name in DICTIONARY_COLUMNS:
+            dictionary = self.dictionaries[name]
+            return [None if v is None else dictionary[v] for v in values]
+        return values
+
+    def numeric(self, name):
+        '''Returns the named numeric column as a numpy array, with NaN
+        where a thing has no numeric value.'''
+        assert name in NUMERIC_COLUMNS
+        return numpy.array([numpy.nan if v is None else v
+                            for v in self.columns[name]], dtype=float)
+
+    def thing(self, i):
+        '''Returns the thing at index i as a dict like the one it was
+        read from, with the additional property from_file.'''
+        thing = dict(self.other[i])
+        for c in COLUMNS:
+            value = self.columns[c][i]
+            if value is None:
+                continue
+            if c in DICTIONARY_COLUMNS:
+                value = self.dictionaries[c][value]
+            thing[c] = value
+        return thing
+
+    def things(self):
+        for i in range(self.count):
+            yield self.thing(i)
+
+    def changed_sources(self, directory, sha_of=file_sha):
+        '''Returns the paths of the JSON files that the bundle was made
+        from whose content has changed since, or that are gone.  directory
+        is the directory that their from_file names are relative to, and
+        sha_of returns the SHA of the content of a file, or None if there's
+        no such file.'''
+        return changed_sources(self.sources, directory, sha_of)
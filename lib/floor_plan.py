@@ -0,0 +1,165 @@
+# Reading what's needed from the SVG drawing of a floor plan: its
+# viewBox, the transform of the real-world group that items are placed
+# in, and the outlines of the shapes of the drawing.
+#
+# The drawing is read with xml.etree.ElementTree.iterparse, which is
+# much quicker than xml.dom.minidom for a large drawing, and stops as
+# soon as it has what it was asked for.
+
+
+import math
+import xml.etree.ElementTree
+
+import numpy
+
+from box import Box, transformed
+from footprint import path_polygons
+from transform import Transform
+
+
+SVG_NAMESPACE = "{http://www.w3.org/2000/svg}"
+
+# The number of lines that a circle or ellipse is replaced by.
+ELLIPSE_SEGMENTS = 32
+
+
+def numbers(s):
+    return [float(n) for n in Transform.NUMBER_REGEXP.findall(s or "")]
+
+
+def number_attribute(element, name):
+    n = numbers(element.get(name))
+    return n[0] if n else 0.0
+
+
+def ellipse(cx, cy, rx, ry, segments=ELLIPSE_SEGMENTS):
+    a = numpy.linspace(0, 2 * math.pi, segments, endpoint=False)
+    return numpy.stack([cx + rx * numpy.cos(a), cy + ry * numpy.sin(a)],
+                       axis=1)
+
+
+def element_polygons(element):
+    '''Returns a list of the polygons, each an (N,2) array, of the
+    outline of the SVG element, in its own coordinates.  An open path
+    or polyline is closed, as it is when it's filled.  Elements that
+    can't be filled have none.'''
+    tag = element.tag.replace(SVG_NAMESPACE, "")
+    get = lambda name: number_attribute(element, name)
+    if tag == "path":
+        return path_polygons(element.get("d", ""))
+    if tag == "rect":
+        x, y, w, h = get("x"), get("y"), get("width"), get("height")
+        return [numpy.array([[x, y], [x + w, y],
+                             [x + w, y + h], [x, y + h]])]
+    if tag in ("polygon", "polyline"):
+        points = numbers(element.get("points"))
+        if len(points) < 6:
+            return []
+        return [numpy.array(points[:len(points) // 2 * 2]).reshape(-1, 2)]
+    if tag == "circle":
+        return [ellipse(get("cx"), get("cy"), get("r"), get("r"))]
+    if tag == "ellipse":
+        return [ellipse(get("cx"), get("cy"), get("rx"), get("ry"))]
+    return []
+
+
+class Shape (object):
+    '''Shape is one of the elements of a floor plan drawing: its tag, its
+    id if it has one, its position in document order, and its outline
+    as a list of polygons, with their bounding Box, in real world
+    coordinates.'''
+
+    def __init__(self, tag, id, index, polygons):
+        self.tag = tag
+        self.id = id
+        self.index = index
+        self.polygons = polygons
+        everything = numpy.concatenate(polygons)
+        self.box = Box.bounding(everything[:, 0], everything[:, 1])
+
+    def contains(self, x, y):
+        '''Returns True iff the point x, y is inside the shape by the
+        nonzero winding rule, SVG's default fill-rule.'''
+        winding = 0
+        for polygon in self.polygons:
+            x0 = polygon[:, 0]
+            y0 = polygon[:, 1]
+            x1 = numpy.roll(x0, -1)
+            y1 = numpy.roll(y0, -1)
+            side = (x1 - x0) * (y - y0) - (x - x0) * (y1 - y0)
+            up = (y0 <= y) & (y1 > y) & (side > 0)
+            down = (y0 > y) & (y1 <= y) & (side < 0)
+            winding += int(up.sum()) - int(down.sum())
+        return winding != 0
+
+    def summary(self):
+        return {
+            "tag": self.tag,
+            "id": self.id,
+            "index": self.index,
+            "bbox": [self.box.minX, self.box.minY,
+                     self.box.maxX, self.box.maxY]
+        }
+
+
+class FloorPlan (object):
+    '''FloorPlan is what's known about the SVG drawing of a floor plan:
+    the Box of its viewBox, the Transform from the real world
+    coordinates that items are placed in to those of the viewBox, and,
+    if they were read, the Shapes of the drawing.'''
+
+    @classmethod
+    def read(cls, svg_file, shapes=False):
+        '''Read the SVG file svg_file.  Its Shapes are only read if shapes
+        is True.  The elements of the real-world group, which are grid
+        lines and the like rather than the floor plan, aren't Shapes.'''
+        box = None
+        real_world = None
+        found = []
+        # The Transform and whether it's in the real-world group of each
+        # open element.
+        stack = []
+        for event, element in xml.etree.ElementTree.iterparse(
+                svg_file, events=("start", "end")):
+            if event == "end":
+                stack.pop()
+                element.clear()
+                continue
+            t, in_real_world = (stack[-1] if stack
+                                else (Transform.identity(), False))
+            if element.get("transform"):
+                parsed = Transform.parseSVG(element.get("transform"))
+                if parsed is not None:
+                    t = t.compose(parsed)
+            if element.get("id") == "real-world":
+                real_world = t
+                in_real_world = True
+                if not shapes:
+                    break
+            stack.append((t, in_real_world))
+            if box is None:
+                viewbox = numbers(element.get("viewBox"))
+                if len(viewbox) == 4:
+                    box = Box.xywh(*viewbox)
+            if shapes and not in_real_world:
+                try:
+                    polygons = element_polygons(element)
+                except Exception:
+                    # svg.path can't parse it, so neither can we.
+                    polygons = []
+                if polygons:
+                    found.append((element.tag.replace(SVG_NAMESPACE, ""),
+                                  element.get("id"), len(found),
+                                  polygons, t))
+        plan = cls(box, real_world or Transform.identity())
+        to_real_world = plan.real_world.inverse()
+        plan.shapes = [Shape(tag, id, index,
+                             [transformed(to_real_world.compose(t), p)
+                              for p in polygons])
+                       for tag, id, index, polygons, t in found]
+        return plan
+
+    def __init__(self, box, real_world):
+        self.box = box
+        self.real_world = real_world
+        self.shapes = []
@@ -0,0 +1,288 @@
+# The footprints of the items on a floor plan, the area of floor that
+# each one covers, and finding the items that overlap.
+#
+# placement.js draws an item as a width by depth rectangle, or as its
+# path_d, centered on 0, 0, then rotates it by its rotation, which is a
+# fraction of a circle, and moves it to x, y.  A Footprint is that
+# drawing as a list of convex polygons in floor plan coordinates.  A
+# rectangle is one polygon.  A path is one polygon for each subpath,
+# with its curves and arcs replaced by lines, and any that isn't convex
+# is cut into triangles.
+#
+# Overlapping items are found in two phases.  The broad phase is a
+# sweep and prune: the bounding Boxes of the footprints are sorted by
+# minX and swept from left to right, so only the Boxes that overlap in
+# X are compared.  The narrow phase applies the separating axis test to
+# the convex polygons of each pair of footprints whose Boxes intersect.
+
+
+import math
+
+import numpy
+import svg.path
+
+from box import Box, transformed
+from transform import Transform
+
+
+# Two footprints only overlap if they overlap by more than this, so
+# that items that are placed against each other don't.
+OVERLAP_TOLERANCE = 1e-3
+
+# The number of lines that a curve or an arc of a path_d is replaced by.
+CURVE_SEGMENTS = 16
+
+
+def is_number(x):
+    return type(x) in (int, float) and math.isfinite(x)
+
+
+def item_transform(item):
+    '''The Transform that placement.js gives the drawing of item.'''
+    rotation = item.get("rotation", 0)
+    if not is_number(rotation):
+        rotation = 0
+    return Transform.translate(item["x"], item["y"]).compose(
+        Transform.rotate(rotation * 360))
+
+
+def path_polygons(path_d, segments=CURVE_SEGMENTS):
+    '''Returns a list of the polygons, each an (N,2) array, of the
+    subpaths of the SVG path path_d.  Each polygon is closed whether or
+    not its subpath is.'''
+    polygons = []
+    points = []
+    for step in svg.path.parse_path(path_d):
+        if isinstance(step, svg.path.Move):
+            polygons.append(points)
+            points = [step.end]
+        elif isinstance(step, (svg.path.Line, svg.path.Close)):
+            points.append(step.end)
+        else:
+            points += [step.point(i / segments)
+                       for i in range(1, segments + 1)]
+    polygons.append(points)
+    return [numpy.array([(p.real, p.imag) for p in points])
+            for points in polygons if len(points) >= 3]
+
+
+def cross(o, a, b):
+    '''The z component of the cross product of a - o and b - o.'''
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def simple_polygon(polygon):
+    '''Returns polygon counterclockwise, or rather with positive area,
+    without repeated or collinear points.'''
+    points = []
+    for p in polygon.tolist():
+        if not points or points[-1] != p:
+            points.append(p)
+    while len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    changed = True
+    while changed and len(points) >= 3:
+        changed = False
+        for i in range(len(points)):
+            if abs(cross(points[i - 1], points[i],
+                         points[(i + 1) % len(points)])) < 1e-12:
+                del points[i]
+                changed = True
+                break
+    area = sum([cross((0, 0), points[i - 1], points[i])
+                for i in range(len(points))])
+    if area < 0:
+        points.reverse()
+    return points
+
+
+def convex_parts(polygon):
+    '''Returns a list of convex polygons, as (N,2) arrays, that together
+    cover the simple polygon polygon.  A polygon that isn't convex is
+    cut into triangles by ear clipping.'''
+    points = simple_polygon(polygon)
+    if len(points) < 3:
+        return []
+    n = len(points)
+    if all([cross(points[i - 1], points[i], points[(i + 1) % n]) > 0
+            for i in range(n)]):
+        return [numpy.array(points)]
+    triangles = []
+    while len(points) > 3:
+        n = len(points)
+        for i in range(n):
+            a, b, c = points[i - 1], points[i], points[(i + 1) % n]
+            if cross(a, b, c) <= 0:
+                continue
+            # b is an ear if no other point is inside the triangle.
+            if any([cross(a, b, p) >= 0 and cross(b, c, p) >= 0 and
+                    cross(c, a, p) >= 0
+                    for p in points if p is not a and p is not b and
+                    p is not c]):
+                continue
+            triangles.append(numpy.array([a, b, c]))
+            del points[i]
+            break
+        else:
+            # Not a simple polygon.  Its convex hull will have to do.
+            return [numpy.array(convex_hull(points))]
+    triangles.append(numpy.array(points))
+    return triangles
+
+
+def convex_hull(points):
+    '''The convex hull of points, counterclockwise.'''
+    points = sorted(set([tuple(p) for p in points]))
+    if len(points) < 3:
+        return points
+    lower = []
+    upper = []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def axes(polygon):
+    '''The unit normals of the edges of polygon.'''
+    edges = numpy.roll(polygon, -1, axis=0) - polygon
+    normals = numpy.stack([-edges[:, 1], edges[:, 0]], axis=1)
+    lengths = numpy.hypot(normals[:, 0], normals[:, 1])
+    return normals[lengths > 0] / lengths[lengths > 0, None]
+
+
+def polygons_overlap(a, b, tolerance=OVERLAP_TOLERANCE):
+    '''Returns True iff the convex polygons a and b overlap by more than
+    tolerance, by the separating axis test: they don't overlap if their
+    projections onto the normal of one of their edges don't.'''
+    normals = numpy.concatenate([axes(a), axes(b)])
+    pa = a @ normals.T
+    pb = b @ normals.T
+    overlap = (numpy.minimum(pa.max(axis=0), pb.max(axis=0)) -
+               numpy.maximum(pa.min(axis=0), pb.min(axis=0)))
+    return bool(overlap.min() > tolerance)
+
+
+class Footprint (object):
+    '''Footprint is the floor an item covers, as a list of convex
+    polygons, each an (N,2) array, and their bounding Box.  key
+    identifies the item.'''
+
+    @classmethod
+    def of_item(cls, key, item):
+        '''Returns the Footprint of item as placement.js draws it, or
+        None if placement.js wouldn't draw it.'''
+        if not (is_number(item.get("x")) and is_number(item.get("y"))):
+            return None
+        if item.get("path_d"):
+            parts = []
+            for polygon in path_polygons(item["path_d"]):
+                parts += convex_parts(polygon)
+        elif is_number(item.get("width")) and is_number(item.get("depth")):
+            w = item["width"] / 2
+            d = item["depth"] / 2
+            parts = [numpy.array([[-w, -d], [w, -d], [w, d], [-w, d]])]
+        else:
+            return None
+        if not parts:
+            return None
+        return cls(key, parts).transformed(item_transform(item))
+
+    def __init__(self, key, polygons):
+        self.key = key
+        self.polygons = polygons
+        everything = numpy.concatenate(polygons)
+        self.box = Box.bounding(everything[:, 0], everything[:, 1])
+        # The edges of each polygon, as vectors, once they're needed.
+        self.edges = None
+
+    def polygon_edges(self):
+        '''Returns a list of (polygon, edges) for each of the polygons,
+        where edges is an (N,2) array of the vector from each point to the
+        next.'''
+        if self.edges is None:
+            self.edges = [(p, numpy.roll(p, -1, axis=0) - p)
+                          for p in self.polygons]
+        return self.edges
+
+    def __repr__(self):
+        return "Footprint(%r, %r)" % (self.key, self.polygons)
+
+    def transformed(self, transform):
+        return Footprint(self.key, [transformed(transform, p)
+                                    for p in self.polygons])
+
+    def overlaps(self, other, tolerance=OVERLAP_TOLERANCE):
+        if not self.box.intersects(other.box):
+            return False
+        for a in self.polygons:
+            for b in other.polygons:
+                if polygons_overlap(a, b, tolerance):
+                    return True
+        return False
+
+    def contains(self, x, y):
+        '''Returns True iff the point x, y is in the footprint, which it is
+        if it isn't on the outside of any edge of one of its convex
+        polygons.'''
+        if not (self.box.minX <= x <= self.box.maxX and
+                self.box.minY <= y <= self.box.maxY):
+            return False
+        for polygon, edges in self.polygon_edges():
+            side = (edges[:, 0] * (y - polygon[:, 1]) -
+                    edges[:, 1] * (x - polygon[:, 0]))
+            if (side >= 0).all() or (side <= 0).all():
+                return True
+        return False
+
+    def distance(self, x, y):
+        '''Returns the distance from the point x, y to the footprint, 0 if
+        it's in it.'''
+        if self.contains(x, y):
+            return 0.0
+        nearest = math.inf
+        for polygon, edges in self.polygon_edges():
+            offsets = numpy.array([x, y]) - polygon
+            lengths = (edges * edges).sum(axis=1)
+            t = numpy.clip((offsets * edges).sum(axis=1) /
+                           numpy.where(lengths > 0, lengths, 1), 0, 1)
+            gaps = offsets - edges * t[:, None]
+            nearest = min(nearest, float(numpy.sqrt(
+                (gaps * gaps).sum(axis=1).min())))
+        return nearest
+
+    def within(self, box, tolerance=OVERLAP_TOLERANCE):
+        '''Returns "inside" if the footprint is within box, "outside" if
+        it doesn't overlap box at all, or else "partly outside".'''
+        if box.expand(tolerance).contains(self.box):
+            return "inside"
+        rectangle = numpy.array([[box.minX, box.minY], [box.maxX, box.minY],
+                                 [box.maxX, box.maxY], [box.minX, box.maxY]])
+        if self.box.intersects(box):
+            for polygon in self.polygons:
+                if polygons_overlap(polygon, rectangle, tolerance):
+                    return "partly outside"
+        return "outside"
+
+
+def overlapping_pairs(footprints, tolerance=OVERLAP_TOLERANCE):
+    '''Returns a list of the pairs of footprints that overlap, by sweep
+    and prune.'''
+    footprints = sorted(footprints, key=lambda f: f.box.minX)
+    pairs = []
+    # The footprints whose boxes reach the X of the sweep line.
+    active = []
+    for f in footprints:
+        active = [a for a in active if a.box.maxX > f.box.minX + tolerance]
+        for a in active:
+            if (a.box.minY < f.box.maxY - tolerance and
+                f.box.minY < a.box.maxY - tolerance and
+                a.overlaps(f, tolerance)):
+                pairs.append((a, f))
+        active.append(f)
+    return pairs
@@ -0,0 +1,296 @@
+# The schema of the furnishing JSON files, and a check of the integrity
+# of the furnishing files of a facility taken together.
+#
+# A furnishing file is a JSON array of items, and of strings, which are
+# comments.  SCHEMA gives the kinds of value each property of an item
+# can have.  It is compiled once into a validator for each property, so
+# checking an item is a dictionary lookup and a call for each of its
+# properties.
+#
+# Problems are reported by line and column.  A file is decoded one item
+# at a time, which gives the position of each item, and a property is
+# only looked for in the text of its item when it has to be reported.
+
+
+import json
+import math
+import os.path
+import re
+import urllib.parse
+
+from json_text import LineIndex, array_elements, key_position
+
+
+# Maps each property that an item can have to the kinds of value it can
+# have.
+SCHEMA = {
+    "name": ("string",),
+    "unique_id": ("string",),
+    "cssClass": ("string",),
+    "clustermarket_id": ("string", "integer"),
+    "width": ("number",),
+    "depth": ("number",),
+    "path_d": ("path",),
+    "x": ("number",),
+    "y": ("number",),
+    "rotation": ("number",),
+    "description": ("string",),
+    "description_uri": ("string",),
+    "contents": ("contents",),
+    "booking_note": ("string",),
+    "measured": ("string",)
+}
+
+
+def describe(value):
+    '''A short description of value for a problem report.'''
+    text = json.dumps(value)
+    return text if len(text) <= 40 else text[:37] + "..."
+
+
+def check_string(value):
+    if type(value) is not str:
+        return "should be a string, not %s" % describe(value)
+
+
+def check_integer(value):
+    if type(value) is not int:
+        return "should be an integer, not %s" % describe(value)
+
+
+def check_number(value):
+    # type() rather than isinstance() so that true and false aren't
+    # numbers.
+    if type(value) is int:
+        return None
+    if type(value) is not float or not math.isfinite(value):
+        return "should be a number, not %s" % describe(value)
+
+
+def check_path(value):
+    if type(value) is not str:
+        return "should be an SVG path, not %s" % describe(value)
+    if not value.strip():
+        return "is an empty SVG path"
+    # Only imported when there's a path to check, since importing it
+    # takes a while.
+    import svg.path
+    try:
+        svg.path.parse_path(value)
+    except Exception as e:
+        return "isn't a valid SVG path: %s" % e
+
+
+def check_contents(value):
+    '''contents is a list of strings and of things that have a name and
+    maybe contents of their own.'''
+    if type(value) is not list:
+        return "should be a list, not %s" % describe(value)
+    for i, v in enumerate(value):
+        if type(v) is str:
+            continue
+        if type(v) is not dict or type(v.get("name")) is not str:
+            return "[%d] should be a string or have a name, not %s" % (
+                i, describe(v))
+        if "contents" in v:
+            problem = check_contents(v["contents"])
+            if problem:
+                return "[%d].contents %s" % (i, problem)
+
+
+# Maps each kind of value in SCHEMA to a function that returns None if
+# a value is of that kind, or else what's wrong with it, and to how the
+# kind is described.
+KINDS = {
+    "string": (check_string, "a string"),
+    "integer": (check_integer, "an integer"),
+    "number": (check_number, "a number"),
+    "path": (check_path, "an SVG path"),
+    "contents": (check_contents, "a list of contents")
+}
+
+
+def compile_property(name, kinds):
+    '''Returns a function that returns None if a value for the property
+    name is of one of kinds, or else what's wrong with it.'''
+    checks = [KINDS[kind][0] for kind in kinds]
+    if len(checks) == 1:
+        check = checks[0]
+        def validate(value):
+            problem = check(value)
+            if problem:
+                return "%s %s" % (name, problem)
+        return validate
+    expected = " or ".join([KINDS[kind][1] for kind in kinds])
+    def validate(value):
+        for check in checks:
+            if check(value) is None:
+                return None
+        return "%s should be %s, not %s" % (name, expected, describe(value))
+    return validate
+
+
+def compile_schema(schema):
+    '''Returns a dict mapping each property in schema to its validator.'''
+    return dict([(name, compile_property(name, kinds))
+                 for name, kinds in schema.items()])
+
+
+VALIDATORS = compile_schema(SCHEMA)
+
+
+def check_item(item):
+    '''Returns a list of (property, problem) for the problems with item,
+    where property is None for a problem with the item as a whole.'''
+    problems = []
+    for name, value in item.items():
+        validate = VALIDATORS.get(name)
+        if validate is None:
+            problems.append((name, "unsupported property %s" % name))
+            continue
+        problem = validate(value)
+        if problem:
+            problems.append((name, problem))
+    if "name" not in item:
+        problems.append((None, "item has no name"))
+    # Only an item with a position is drawn, and it needs a shape.
+    if "x" in item or "y" in item:
+        for name in ("x", "y"):
+            if name not in item:
+                problems.append((None, "item has no %s" % name))
+        if "path_d" not in item:
+            if "width" not in item and "depth" not in item:
+                problems.append(
+                    (None, "item has neither width and depth nor path_d"))
+    for name, other in (("width", "depth"), ("depth", "width")):
+        if name in item and other not in item:
+            problems.append((name, "item has %s but no %s" % (name, other)))
+    return problems
+
+
+def check_furnishings(text):
+    '''Checks the text of a furnishing file.  Returns a dict that is
+    JSON serializable, so that it can be cached, of:
+
+    problems: a list of [line, column, problem]
+
+    unique_ids: a list of [unique_id, line, column] for the items
+    that have one
+
+    description_uris: a list of [uri, line, column]
+
+    The last two are for an IntegrityIndex.'''
+    problems = []
+    unique_ids = []
+    uris = []
+    lines = LineIndex(text)
+    try:
+        for item, start, end in array_elements(text):
+            if type(item) is str:
+                continue
+            if type(item) is not dict:
+                problems.append(list(lines.location(start)) + [
+                    "expected an item or a comment string, not %s" %
+                    describe(item)])
+                continue
+            for name, problem in check_item(item):
+                position = start
+                if name is not None:
+                    position = key_position(text, item, start, end, name)
+                problems.append(list(lines.location(position)) + [problem])
+            for name, found in (("unique_id", unique_ids),
+                                ("description_uri", uris)):
+                value = item.get(name)
+                if type(value) is str and value != "":
+                    found.append([value] + list(lines.location(
+                        key_position(text, item, start, end, name))))
+    except json.JSONDecodeError as e:
+        problems.append([e.lineno, e.colno, e.msg])
+    return {
+        "problems": problems,
+        "unique_ids": unique_ids,
+        "description_uris": uris
+    }
+
+
+def description_target(uri, filename):
+    '''Returns the local file that the description_uri uri of an item in
+    the furnishing file filename refers to, or None if it isn't local.
+    Like placement.js, the URI is relative to the furnishing file.'''
+    if re.match(r"^[a-z][a-z0-9+.-]*:", uri, re.I) or uri.startswith("/"):
+        return None
+    path = urllib.parse.unquote(re.split(r"[?#]", uri)[0])
+    if not path:
+        return None
+    return os.path.normpath(os.path.join(os.path.dirname(filename), path))
+
+
+class IntegrityIndex (object):
+    '''IntegrityIndex checks the furnishing files of a facility against
+    each other and against the files they refer to: no two items that
+    are shown together can have the same unique_id and the
+    description_uri of each item has to be there.  Files are added with
+    the results of check_furnishings, which can have come from a cache.
+
+    exists is called to find out whether the file a description_uri
+    refers to exists.  groups, if it's given, is a list of the lists of
+    files that are shown together, and a unique_id can be used once in
+    each; otherwise all of the files are shown together.'''
+
+    def __init__(self, exists=os.path.exists, groups=None):
+        self.exists = exists
+        # Maps each file to the set of the groups it's in.
+        self.groups = None
+        if groups is not None:
+            self.groups = {}
+            for i, group in enumerate(groups):
+                for filename in group:
+                    self.groups.setdefault(filename, set()).add(i)
+        # Maps each unique_id to a list of (filename, line, column).
+        self.unique_ids = {}
+        # A list of (filename, line, column, uri, target).
+        self.targets = []
+
+    def add(self, filename, result):
+        for uid, line, column in result["unique_ids"]:
+            self.unique_ids.setdefault(uid, []).append(
+                (filename, line, column))
+        for uri, line, column in result["description_uris"]:
+            target = description_target(uri, filename)
+            if target is not None:
+                self.targets.append((filename, line, column, uri, target))
+
+    def together(self, a, b):
+        '''Returns True iff the files a and b are shown together.'''
+        if self.groups is None or a == b:
+            return True
+        return bool(self.groups.get(a, set()) & self.groups.get(b, set()))
+
+    def problems(self, filenames=None):
+        '''Returns a sorted list of (filename, line, column, problem),
+        only for the files in filenames if it's given.'''
+        problems = []
+        for uid, places in self.unique_ids.items():
+            if len(places) < 2:
+                continue
+            for place in places:
+                others = [p for p in places
+                          if p is not place and self.together(p[0], place[0])]
+                if others:
+                    problems.append(place + (
+                        "unique_id %s is also used at %s" % (
+                            json.dumps(uid), ", ".join(
+                                ["%s:%d:%d" % p for p in others])),))
+        exists = {}
+        for filename, line, column, uri, target in self.targets:
+            if target not in exists:
+                exists[target] = self.exists(target)
+            if not exists[target]:
+                problems.append((filename, line, column,
+                                 "description_uri %s: there's no %s" % (
+                                     uri, target)))
+        if filenames is not None:
+            filenames = set(filenames)
+            problems = [p for p in problems if p[0] in filenames]
+        problems.sort()
+        return problems
@@ -0,0 +1,57 @@
+# Finding the furnishing JSON files of the facilities.
+
+
+import os
+import os.path
+
+
+# JSON files that are generated from the furnishing files rather than
+# being furnishing files themselves.
+GENERATED_JSON_FILES = ("search_index.json", "tiles.json")
+
+# The properties that every item on a floor plan has.  width and depth
+# aren't included because some items are described by a path_d rather
+# than a rectangle.
+REQUIRED_ITEM_FIELDS = ("name", "cssClass", "x", "y")
+
+
+def is_furnishing_file(filename):
+    '''Returns True iff filename names a furnishing JSON file rather than
+    one that is generated or hidden.'''
+    name = os.path.basename(filename)
+    return (name.endswith(".json") and not name.endswith(".bundle.json") and
+            not name.startswith(".") and name not in GENERATED_JSON_FILES)
+
+
+def furnishing_files(directory):
+    '''Returns the furnishing JSON files in or under directory, in a
+    consistent order.'''
+    files = []
+    for d, subdirectories, filenames in os.walk(directory):
+        subdirectories.sort()
+        for f in sorted(filenames):
+            if is_furnishing_file(f):
+                files.append(os.path.join(d, f))
+    return files
+
+
+def is_item(item):
+    '''Returns True iff item, from a furnishing file, is an item to be
+    shown on a floor plan.'''
+    if not isinstance(item, dict):
+        return False
+    for field in REQUIRED_ITEM_FIELDS:
+        if not field in item:
+            return False
+    return True
+
+
+def facility_directory(filename):
+    '''Returns the directory of the facility that the furnishing file
+    filename belongs to, which is the directory in Facilities that it's
+    under, or None if it isn't under a Facilities directory.'''
+    parts = os.path.normpath(filename).split(os.sep)
+    for i, part in enumerate(parts[:-2]):
+        if part == "Facilities":
+            return os.sep.join(parts[:i + 2])
+    return None
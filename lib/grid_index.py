@@ -0,0 +1,180 @@
+# A uniform grid spatial index over Boxes.
+
+
+import math
+from collections import defaultdict
+
+from box import Box
+
+
+class GridIndex (object):
+    '''GridIndex associates keys with Boxes and finds the keys whose
+    Boxes intersect some query Box without testing every Box.
+
+    The plane is divided into square cells of side cell_size.  Each
+    key is recorded in every cell that its Box overlaps.'''
+
+    @classmethod
+    def for_boxes(cls, boxes, cells_per_box=1):
+        '''Choose a cell size suited to the Boxes in the iterable boxes.
+        The cell size is based on the average Box size so that a typical
+        Box covers about cells_per_box cells.'''
+        boxes = list(boxes)
+        if not boxes:
+            return cls(1)
+        average = sum([max(b.width, b.height) for b in boxes]) / len(boxes)
+        return cls(max(average / math.sqrt(cells_per_box), 1e-6))
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        # Maps (column, row) to the set of keys recorded in that cell.
+        self.cells = defaultdict(set)
+        # Maps key to Box.
+        self.boxes = {}
+        # The least and greatest column and row of the occupied cells, or
+        # None if they need to be worked out again.
+        self.extent = None
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __contains__(self, key):
+        return key in self.boxes
+
+    def _cell_range(self, box):
+        size = self.cell_size
+        return (range(math.floor(box.minX / size),
+                      math.floor(box.maxX / size) + 1),
+                range(math.floor(box.minY / size),
+                      math.floor(box.maxY / size) + 1))
+
+    def _cells_of(self, box):
+        columns, rows = self._cell_range(box)
+        for column in columns:
+            for row in rows:
+                yield (column, row)
+
+    def _ring(self, column, row, ring):
+        '''Yields the cells ring cells away from column, row.'''
+        if ring == 0:
+            yield (column, row)
+            return
+        for c in range(column - ring, column + ring + 1):
+            yield (c, row - ring)
+            yield (c, row + ring)
+        for r in range(row - ring + 1, row + ring):
+            yield (column - ring, r)
+            yield (column + ring, r)
+
+    def insert(self, key, box):
+        '''Record key as occupying box.  If key is already present its
+        previous Box is replaced.'''
+        if key in self.boxes:
+            self.remove(key)
+        self.boxes[key] = box
+        self.extent = None
+        for cell in self._cells_of(box):
+            self.cells[cell].add(key)
+
+    def remove(self, key):
+        '''Forget key.  It is not an error if key is not present.'''
+        box = self.boxes.pop(key, None)
+        if box is None:
+            return
+        self.extent = None
+        for cell in self._cells_of(box):
+            keys = self.cells.get(cell)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.cells[cell]
+
+    def query(self, box):
+        '''Return the set of keys whose Boxes intersect box.'''
+        columns, rows = self._cell_range(box)
+        candidates = set()
+        if len(columns) * len(rows) > len(self.cells):
+            # The query covers more cells than are occupied.
+            for (column, row), keys in self.cells.items():
+                if column in columns and row in rows:
+                    candidates.update(keys)
+        else:
+            for column in columns:
+                for row in rows:
+                    keys = self.cells.get((column, row))
+                    if keys:
+                        candidates.update(keys)
+        return set([key for key in candidates
+                    if self.boxes[key].intersects(box)])
+
+    def nearest(self, x, y, k, distance):
+        '''Returns a list of up to k (d, key) pairs for the keys nearest
+        to the point x, y, nearest first.  d is distance(key), which must
+        be no less than the distance from the point to key's Box.  If the
+        point is among the occupied cells they are searched in rings
+        around the point's cell, until no key in a further ring could be
+        nearer, otherwise every key is considered.  distance is only
+        called for the keys whose Boxes are near enough to matter.'''
+        if not (math.isfinite(x) and math.isfinite(y)):
+            raise ValueError("the point %r, %r isn't finite" % (x, y))
+        if not self.boxes or k <= 0:
+            return []
+        size = self.cell_size
+        if self.extent is None:
+            columns = [c for c, r in self.cells]
+            rows = [r for c, r in self.cells]
+            self.extent = (min(columns), min(rows), max(columns), max(rows))
+        min_column, min_row, max_column, max_row = self.extent
+        # Maps keys to distance(key).
+        exact = {}
+        if not (min_column * size <= x < (max_column + 1) * size and
+                min_row * size <= y < (max_row + 1) * size):
+            # Rings around a point outside of the occupied cells would
+            # mostly be empty, however far away the point is.
+            found = dict([(key, box_distance(box, x, y))
+                          for key, box in self.boxes.items()])
+            return nearest_of(found, exact, k, distance)
+        column = math.floor(x / size)
+        row = math.floor(y / size)
+        # Past this ring there are no occupied cells.
+        last = max(column - min_column, row - min_row,
+                   max_column - column, max_row - row)
+        # Maps each key found so far to the distance to its Box.
+        found = {}
+        ring = 0
+        while True:
+            for cell in self._ring(column, row, ring):
+                for key in self.cells.get(cell, ()):
+                    if key not in found:
+                        found[key] = box_distance(self.boxes[key], x, y)
+            best = nearest_of(found, exact, k, distance)
+            # How far from the point any key that hasn't been found is.
+            reach = min(x - (column - ring) * size,
+                        (column + ring + 1) * size - x,
+                        y - (row - ring) * size,
+                        (row + ring + 1) * size - y)
+            if ring >= last or (len(best) == k and best[-1][0] <= reach):
+                return best
+            ring += 1
+
+
+def nearest_of(found, exact, k, distance):
+    '''Returns a list of the k (distance(key), key) pairs with the least
+    distance among the keys of found, which maps each key to no more
+    than its distance, nearest first.  exact caches distance(key).'''
+    best = []
+    for key in sorted(found, key=found.get):
+        if len(best) == k and found[key] >= best[-1][0]:
+            break
+        if key not in exact:
+            exact[key] = distance(key)
+        best.append((exact[key], key))
+        best.sort(key=lambda pair: pair[0])
+        del best[k:]
+    return best
+
+def box_distance(box, x, y):
+    '''The distance from the point x, y to box, 0 if it's in box.'''
+    dx = max(box.minX - x, 0, x - box.maxX)
+    dy = max(box.minY - y, 0, y - box.maxY)
+    return math.hypot(dx, dy)
@@ -0,0 +1,197 @@
+# A registry of the unique_ids used by the furnishing files of every
+# facility, so that new ids can be allocated without clashing with any
+# id in any facility.
+#
+# The registry is kept in a JSON file, by default .unique_ids.json in
+# the facilities directory, which records for each furnishing file its
+# size, modification time and SHA-256 hash, the unique_ids in it and
+# the number of items that have none.  A scan only reads the files
+# whose size or modification time has changed, and only parses those
+# whose hash has changed too.
+
+
+import hashlib
+import json
+import os
+import os.path
+import re
+
+from atomic_file import atomic_open
+from furnishings import furnishing_files, is_item
+from json_text import DECODER, object_members, skip_whitespace
+
+
+UNIQUE_ID_FIELD_NAME = "unique_id"
+
+# Allocated unique_ids look like _x_0042.
+UID_FORMAT = "_x_%04d"
+UID_REGEXP = re.compile(r"_x_([0-9]{4,})")
+
+REGISTRY_FILE = ".unique_ids.json"
+
+
+def uid_number(uid):
+    '''Returns the number of an allocated unique_id, or None if uid
+    wasn't allocated by UID_FORMAT.'''
+    m = UID_REGEXP.fullmatch(uid) if isinstance(uid, str) else None
+    return int(m.group(1)) if m else None
+
+
+def scan_items(text):
+    '''Returns the unique_ids of the items in the furnishing file text,
+    in order, and the number of items that have none.'''
+    ids = []
+    missing = 0
+    data = json.loads(text)
+    if not isinstance(data, list):
+        return ids, missing
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        uid = item.get(UNIQUE_ID_FIELD_NAME, "")
+        if uid != "":
+            ids.append(uid)
+        elif is_item(item):
+            missing += 1
+    return ids, missing
+
+
+class IdRegistry (object):
+    '''IdRegistry knows every unique_id in the furnishing files under a
+    directory and allocates new ones.'''
+    VERSION = 1
+
+    def __init__(self, directory, path=None):
+        self.directory = directory
+        self.path = path or os.path.join(directory, REGISTRY_FILE)
+        # Maps the path of each furnishing file relative to directory
+        # to its entry.
+        self.entries = {}
+        try:
+            with open(self.path, "r") as f:
+                registry = json.load(f)
+            if registry.get("version") == self.VERSION:
+                self.entries = registry["entries"]
+        except (OSError, ValueError):
+            pass
+        self.next_id = None
+        self.all_ids = None
+
+    def scan(self):
+        '''Bring the registry up to date with the furnishing files.
+        Returns the list of the files that were parsed.'''
+        parsed = []
+        entries = {}
+        for f in furnishing_files(self.directory):
+            name = os.path.relpath(f, self.directory)
+            stat = os.stat(f)
+            entry = self.entries.get(name)
+            if (entry and entry["size"] == stat.st_size and
+                entry["mtime_ns"] == stat.st_mtime_ns):
+                entries[name] = entry
+                continue
+            with open(f, "rb") as io:
+                content = io.read()
+            digest = hashlib.sha256(content).hexdigest()
+            if not entry or entry["sha256"] != digest:
+                try:
+                    ids, missing = scan_items(content.decode())
+                except ValueError as e:
+                    print("%s: %s" % (f, e))
+                    ids, missing = [], 0
+                entry = { "ids": ids, "missing": missing }
+                parsed.append(f)
+            entry.update({
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": digest
+            })
+            entries[name] = entry
+        self.entries = entries
+        self.all_ids = set()
+        highest = 0
+        for entry in entries.values():
+            self.all_ids.update(entry["ids"])
+            for uid in entry["ids"]:
+                n = uid_number(uid)
+                if n is not None and n > highest:
+                    highest = n
+        self.next_id = highest + 1
+        return parsed
+
+    def collisions(self):
+        '''Returns a dict mapping each unique_id that is used more than
+        once to the list of the files that use it.'''
+        files = {}
+        for name, entry in sorted(self.entries.items()):
+            for uid in entry["ids"]:
+                files.setdefault(uid, []).append(name)
+        return dict([(uid, names) for uid, names in files.items()
+                     if len(names) > 1])
+
+    def files_missing_ids(self):
+        '''Returns the furnishing files with items that have no unique_id.'''
+        return [os.path.join(self.directory, name)
+                for name, entry in sorted(self.entries.items())
+                if entry["missing"]]
+
+    def allocate(self):
+        '''Returns a new unique_id that isn't used anywhere.'''
+        while True:
+            uid = UID_FORMAT % self.next_id
+            self.next_id += 1
+            if uid not in self.all_ids:
+                self.all_ids.add(uid)
+                return uid
+
+    def save(self):
+        with atomic_open(self.path, "w") as f:
+            json.dump({ "version": self.VERSION, "entries": self.entries },
+                      f, indent=2, sort_keys=True)
+
+
+################################################################################
+# Adding unique_ids to the text of a furnishing file
+
+def add_unique_ids(text, allocate):
+    '''Returns the text of a furnishing file with a unique_id from
+    allocate() given to each item that has none, and the number of ids
+    added.  The rest of the text is left as it is.  A new unique_id
+    property goes right after the item's name, with the same
+    indentation.'''
+    edits = []
+    i = skip_whitespace(text, 0)
+    if text[i] != "[":
+        return text, 0
+    i = skip_whitespace(text, i + 1)
+    while text[i] != "]":
+        item, end = DECODER.raw_decode(text, i)
+        if is_item(item) and item.get(UNIQUE_ID_FIELD_NAME, "") == "":
+            uid = json.dumps(allocate())
+            for key, key_start, value_start, value_end in object_members(
+                    text, i):
+                if key == UNIQUE_ID_FIELD_NAME:
+                    edits = [(value_start, value_end, uid)] + edits
+                    break
+            else:
+                for key, key_start, value_start, value_end in object_members(
+                        text, i):
+                    if key == "name":
+                        line_start = text.rfind("\n", 0, key_start) + 1
+                        indent = text[line_start:key_start]
+                        if indent.strip():
+                            indent = " "
+                        else:
+                            indent = "\n" + indent
+                        edits = [(value_end, value_end, ",%s%s: %s" % (
+                            indent, json.dumps(UNIQUE_ID_FIELD_NAME),
+                            uid))] + edits
+                        break
+        i = skip_whitespace(text, end)
+        if text[i] == ",":
+            i = skip_whitespace(text, i + 1)
+    # edits is in reverse order, so applying each leaves the positions
+    # of the rest unchanged.
+    for start, end, replacement in edits:
+        text = text[:start] + replacement + text[end:]
+    return text, len(edits)
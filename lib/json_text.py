@@ -0,0 +1,101 @@
+# Finding where things are in the text of a JSON file, so that it can
+# be edited in place and problems with it can be reported by line and
+# column.
+
+
+import bisect
+import json
+import re
+
+
+WHITESPACE = re.compile(r"\s*")
+
+DECODER = json.JSONDecoder()
+
+
+def skip_whitespace(text, i):
+    return WHITESPACE.match(text, i).end()
+
+
+def array_elements(text, start=None):
+    '''Yields (value, start, end) for each element of the JSON array
+    that starts at start in text, by default the array that is the
+    whole of text.  Each element is decoded by the C scanner, so this
+    is about as fast as json.loads.'''
+    i = skip_whitespace(text, 0 if start is None else start)
+    if text[i:i + 1] != "[":
+        raise json.JSONDecodeError("Expecting '['", text, i)
+    i = skip_whitespace(text, i + 1)
+    if text[i:i + 1] != "]":
+        while True:
+            value, end = DECODER.raw_decode(text, i)
+            yield value, i, end
+            i = skip_whitespace(text, end)
+            if text[i:i + 1] == "]":
+                break
+            if text[i:i + 1] != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", text, i)
+            i = skip_whitespace(text, i + 1)
+    if start is None and skip_whitespace(text, i + 1) < len(text):
+        raise json.JSONDecodeError("Extra data", text,
+                                   skip_whitespace(text, i + 1))
+
+
+def object_members(text, start):
+    '''Yields (key, key_start, value_start, value_end) for each member
+    of the JSON object that starts at start in text.'''
+    i = skip_whitespace(text, start + 1)
+    if text[i] == "}":
+        return
+    while True:
+        key_start = i
+        key, i = json.decoder.scanstring(text, i + 1)
+        i = skip_whitespace(text, i)
+        assert text[i] == ":"
+        value_start = skip_whitespace(text, i + 1)
+        value, value_end = DECODER.raw_decode(text, value_start)
+        yield key, key_start, value_start, value_end
+        i = skip_whitespace(text, value_end)
+        if text[i] == "}":
+            return
+        assert text[i] == ","
+        i = skip_whitespace(text, i + 1)
+
+
+# Maps each key to a regular expression that finds it in the text of an
+# object.
+KEY_PATTERNS = {}
+
+
+def key_position(text, obj, start, end, key):
+    '''Returns the position of key in the text of the JSON object obj,
+    which is text[start:end], or start if obj has no such key.  An
+    object without nested objects is searched with a regular
+    expression rather than decoded member by member.'''
+    if key not in obj:
+        return start
+    if text.find("{", start + 1, end) < 0:
+        pattern = KEY_PATTERNS.get(key)
+        if pattern is None:
+            pattern = KEY_PATTERNS[key] = re.compile(
+                r'%s\s*:' % re.escape(json.dumps(key)))
+        m = pattern.search(text, start, end)
+        if m:
+            return m.start()
+    for k, key_start, value_start, value_end in object_members(text, start):
+        if k == key:
+            return key_start
+    return start
+
+
+class LineIndex (object):
+    '''LineIndex converts positions in a text to line and column
+    numbers, counting from 1 as json.JSONDecodeError does.'''
+
+    def __init__(self, text):
+        self.line_starts = [0] + [m.end() for m in re.finditer("\n", text)]
+
+    def location(self, position):
+        '''Returns the (line, column) of position.'''
+        line = bisect.bisect_right(self.line_starts, position)
+        return line, position - self.line_starts[line - 1] + 1
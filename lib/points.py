@@ -5,6 +5,9 @@
 #
 # To use numpy's matrix operations we need to represent a point as a
 # one dimentionsl numpy.array.
+#
+# When working with many points at once we represent them as an (N,2)
+# numpy.array of X and Y coordinates.
 
 import numpy
 
@@ -32,3 +35,10 @@ def cPointX(c):
 def cPointY(c):
     '''Return the Y component of a coordinate represented as a complex number.'''
     return c.imag
+
+
+def xy_array(points):
+    '''Represents a sequence of complex numbers as an (N,2) numpy array
+    of X and Y coordinates.'''
+    c = numpy.asarray(points, dtype=complex).reshape(-1)
+    return numpy.stack([c.real, c.imag], axis=-1)
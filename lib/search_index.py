@@ -0,0 +1,310 @@
+# A search index over the things of one or more facilities.
+#
+# The words of each thing's name, contents, description, measured
+# notes and the text of its description_uri HTML page are indexed.
+# A query matches a thing if each word of the query matches some
+# indexed word of the thing exactly, as a prefix, or approximately, by
+# the proportion of the trigrams of the two words that they share.
+#
+# The index is a JSON object:
+#
+#   format, version  identify the index format.
+#   documents        a list with an object for each thing, with its
+#                    name, unique_id, facility and url.  The url is
+#                    relative to the directory of the index file.
+#   terms            the sorted list of every indexed word.
+#   postings         parallel to terms, a list of [document, weight]
+#                    pairs for the documents containing the term.
+#                    weight is the FIELD_WEIGHTS of the most important
+#                    field the term appears in.
+#   trigrams         maps each trigram to the list of the indices of
+#                    the terms that contain it.
+#   fuzzy_threshold  FUZZY_THRESHOLD, so that placement.js matches words
+#                    approximately just as SearchIndex.search does.
+#   sources          the files the index was made from, see sources.py.
+#
+# placement.js has a JavaScript version of SearchIndex.search.
+
+
+import bisect
+import html.parser
+import json
+import os.path
+import re
+from collections import defaultdict
+
+from atomic_file import atomic_open
+from sources import changed_sources, file_sha, record_sources
+
+
+SEARCH_INDEX_FORMAT = "MapMyStuff search index"
+SEARCH_INDEX_VERSION = 2
+
+FIELD_WEIGHTS = {
+    "name": 4,
+    "contents": 3,
+    "description": 2,
+    "measured": 1,
+    "description_uri": 1
+}
+
+WORD_REGEXP = re.compile(r"[a-z0-9]+")
+
+# How much a prefix or approximate match counts relative to an exact
+# match of the same word.
+PREFIX_MATCH = 0.8
+FUZZY_MATCH = 0.6
+
+# Words whose trigram similarity is less than this don't match.
+FUZZY_THRESHOLD = 0.4
+
+
+def words(text):
+    return WORD_REGEXP.findall(text.lower())
+
+
+def trigrams(word):
+    padded = " " + word + " "
+    return set([padded[i : i + 3] for i in range(len(padded) - 2)])
+
+
+def similarity(trigrams1, trigrams2):
+    '''The Dice coefficient of two sets of trigrams.'''
+    if not trigrams1 or not trigrams2:
+        return 0
+    return 2 * len(trigrams1 & trigrams2) / (len(trigrams1) + len(trigrams2))
+
+
+class TextExtractor (html.parser.HTMLParser):
+    '''Collects the text of an HTML document, except for scripts and
+    styles.'''
+    def __init__(self):
+        super().__init__()
+        self.text = []
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self.skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self.skip:
+            self.skip -= 1
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.text.append(data)
+
+
+def html_text(path):
+    extractor = TextExtractor()
+    with open(path, "r", errors="replace") as f:
+        extractor.feed(f.read())
+    extractor.close()
+    return " ".join(extractor.text)
+
+
+def description_file(thing, things_file):
+    '''Returns the local HTML file of thing's description_uri, or None.
+    Like placement.js, the URI is relative to the JSON file things_file
+    that thing came from.'''
+    uri = thing.get("description_uri")
+    if not isinstance(uri, str) or re.match(r"^[a-z]+:", uri):
+        return None
+    path = os.path.normpath(os.path.join(os.path.dirname(things_file),
+                                         uri.split("#")[0]))
+    if os.path.splitext(path)[1].lower() not in (".html", ".htm"):
+        return None
+    if not os.path.exists(path):
+        return None
+    return path
+
+
+def thing_text(thing, field):
+    '''Returns the text of the named field of thing.  contents can be a
+    list of strings and things with their own contents.'''
+    value = thing.get(field)
+    if value is None:
+        return ""
+    if field == "contents" and isinstance(value, list):
+        text = []
+        for v in value:
+            if isinstance(v, dict):
+                text.append(thing_text(v, "name"))
+                text.append(thing_text(v, "contents"))
+            else:
+                text.append(str(v))
+        return " ".join(text)
+    return str(value)
+
+
+class SearchIndexBuilder (object):
+    '''SearchIndexBuilder collects the documents and words of a
+    SearchIndex.'''
+    def __init__(self):
+        self.documents = []
+        # Maps each term to a dict mapping document index to weight.
+        self.terms = defaultdict(dict)
+        # The files that the index is made from.
+        self.sources = []
+
+    def add_source(self, path):
+        '''Record that the index is made from the file path.'''
+        if path not in self.sources:
+            self.sources.append(path)
+
+    def add_document(self, document, weighted_texts):
+        '''Add document, a dict, whose text is given by weighted_texts, a
+        sequence of (weight, text) pairs.'''
+        d = len(self.documents)
+        self.documents.append(document)
+        for weight, text in weighted_texts:
+            for w in words(text):
+                postings = self.terms[w]
+                if postings.get(d, 0) < weight:
+                    postings[d] = weight
+
+    def add_things_file(self, things_file, facility, page_url, seen=None):
+        '''Add the things in the JSON file things_file.  page_url is the
+        URL, relative to the index, of the page that shows them.  Things
+        whose unique_id is in the set seen are skipped.'''
+        if seen is None:
+            seen = set()
+        self.add_source(things_file)
+        with open(things_file, "r") as f:
+            things = json.load(f)
+        for thing in things:
+            if not isinstance(thing, dict):
+                continue
+            unique_id = thing.get("unique_id")
+            if unique_id is not None:
+                if unique_id in seen:
+                    continue
+                seen.add(unique_id)
+            texts = [(FIELD_WEIGHTS[f], thing_text(thing, f))
+                     for f in ("name", "contents", "description", "measured")]
+            description = description_file(thing, things_file)
+            if description:
+                self.add_source(description)
+                texts.append((FIELD_WEIGHTS["description_uri"],
+                              html_text(description)))
+            url = page_url
+            if unique_id is not None:
+                url += "#" + str(unique_id)
+            self.add_document({
+                "name": thing.get("name", ""),
+                "unique_id": unique_id,
+                "facility": facility,
+                "url": url
+            }, texts)
+
+    def add_index(self, index, url_prefix=""):
+        '''Add the documents of the SearchIndex index, prefixing their
+        urls with url_prefix.'''
+        base = len(self.documents)
+        for document in index.documents:
+            document = dict(document)
+            document["url"] = url_prefix + document["url"]
+            self.documents.append(document)
+        for term, postings in zip(index.terms, index.postings):
+            p = self.terms[term]
+            for d, weight in postings:
+                p[base + d] = weight
+
+    def index(self, directory="."):
+        '''Returns the SearchIndex, to be written to a file in
+        directory.'''
+        terms = sorted(self.terms.keys())
+        grams = defaultdict(list)
+        for i, term in enumerate(terms):
+            for g in sorted(trigrams(term)):
+                grams[g].append(i)
+        return SearchIndex({
+            "format": SEARCH_INDEX_FORMAT,
+            "version": SEARCH_INDEX_VERSION,
+            "documents": self.documents,
+            "terms": terms,
+            "postings": [sorted(self.terms[t].items()) for t in terms],
+            "trigrams": grams,
+            "fuzzy_threshold": FUZZY_THRESHOLD,
+            "sources": record_sources(self.sources, directory)
+        })
+
+
+class SearchIndex (object):
+    '''SearchIndex answers queries from an index made by
+    SearchIndexBuilder.'''
+
+    @classmethod
+    def read(cls, path):
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def __init__(self, index):
+        if (index.get("format") != SEARCH_INDEX_FORMAT or
+            index.get("version") != SEARCH_INDEX_VERSION):
+            raise ValueError("Not a version %d search index" %
+                             SEARCH_INDEX_VERSION)
+        self.index = index
+        self.documents = index["documents"]
+        self.terms = index["terms"]
+        self.postings = index["postings"]
+        self.trigrams = index["trigrams"]
+        self.fuzzy_threshold = index["fuzzy_threshold"]
+        self.sources = index["sources"]
+
+    def write(self, path):
+        with atomic_open(path, "w") as f:
+            json.dump(self.index, f, separators=(",", ":"))
+
+    def changed_sources(self, directory, sha_of=file_sha):
+        '''Returns the paths of the files that the index was made from
+        that have changed since, or are gone.  directory is the directory
+        of the index.'''
+        return changed_sources(self.sources, directory, sha_of)
+
+    def matching_terms(self, word):
+        '''Returns a dict mapping the index of each term that matches
+        word to how well it matches.'''
+        matches = {}
+        # Exact and prefix matches are a contiguous run of terms.
+        i = bisect.bisect_left(self.terms, word)
+        while i < len(self.terms) and self.terms[i].startswith(word):
+            matches[i] = 1.0 if self.terms[i] == word else PREFIX_MATCH
+            i += 1
+        grams = trigrams(word)
+        candidates = set()
+        for g in grams:
+            candidates.update(self.trigrams.get(g, []))
+        for i in candidates:
+            if i in matches:
+                continue
+            s = similarity(grams, trigrams(self.terms[i]))
+            if s >= self.fuzzy_threshold:
+                matches[i] = FUZZY_MATCH * s
+        return matches
+
+    def search(self, query, limit=None):
+        '''Returns a list of (score, document) pairs for the documents
+        that match every word of query, best first.'''
+        scores = None
+        for word in words(query):
+            word_scores = {}
+            for i, match in self.matching_terms(word).items():
+                for d, weight in self.postings[i]:
+                    s = match * weight
+                    if s > word_scores.get(d, 0):
+                        word_scores[d] = s
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = dict([(d, s + word_scores[d])
+                               for d, s in scores.items()
+                               if d in word_scores])
+        if not scores:
+            return []
+        ranked = sorted(scores.items(),
+                        key=lambda ds: (-ds[1], self.documents[ds[0]]["name"]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(s, self.documents[d]) for d, s in ranked]
@@ -0,0 +1,63 @@
+# Simplifying polylines and writing coordinates compactly.
+
+
+import numpy
+
+
+def douglas_peucker(points, tolerance):
+    '''Returns a boolean array selecting the points of the (N,2) array
+    points that the Douglas-Peucker algorithm keeps for tolerance.
+    Every point that is left out is within tolerance of the polyline
+    through the points that are kept.  The first and last points are
+    always kept.  Duplicate points, and collinear points between their
+    neighbours, are left out even when tolerance is 0.'''
+    points = numpy.asarray(points, dtype=float)
+    keep = numpy.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start = points[first]
+        direction = points[last] - start
+        offsets = points[first + 1 : last] - start
+        # The distance to the segment between the endpoints, not to the
+        # line through them, so a path that doubles back keeps its turn.
+        length2 = numpy.dot(direction, direction)
+        if length2 == 0:
+            t = numpy.zeros(len(offsets))
+        else:
+            t = numpy.clip(offsets.dot(direction) / length2, 0, 1)
+        nearest = numpy.outer(t, direction)
+        distances = numpy.hypot(offsets[:, 0] - nearest[:, 0],
+                                offsets[:, 1] - nearest[:, 1])
+        i = int(numpy.argmax(distances))
+        if distances[i] > tolerance:
+            i += first + 1
+            keep[i] = True
+            stack.append((first, i))
+            stack.append((i, last))
+    return keep
+
+
+def format_number(x, precision=None):
+    '''Returns the shortest text that SVG will read as x, rounded to
+    precision digits after the decimal point unless precision is None.'''
+    if precision is None:
+        text = repr(float(x))
+        if text.endswith(".0"):
+            text = text[:-2]
+    else:
+        text = "%.*f" % (precision, x)
+        if "." in text:
+            text = text.rstrip("0").rstrip(".")
+    if text.startswith("0."):
+        text = text[1:]
+    elif text.startswith("-0."):
+        text = "-" + text[2:]
+    if text in ("-0", ""):
+        text = "0"
+    return text
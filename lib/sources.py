@@ -0,0 +1,61 @@
+# Recording the files that a generated JSON file was made from, so
+# that one that is out of date can be recognized.
+#
+# A generated file records its sources as a dict mapping the name of
+# each file it was made from, relative to the generated file's
+# directory and with / as the separator, to the SHA that git gives that
+# file's content.  That's the SHA the file has in the git index, so the
+# pre-commit hook can check the staged files without reading them.
+
+
+import hashlib
+import json
+import os.path
+
+
+def blob_sha(content):
+    '''The SHA that git gives a blob with content.'''
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def file_sha(path):
+    '''The blob_sha of the content of the file path, or None if there's
+    no such file.'''
+    try:
+        with open(path, "rb") as f:
+            return blob_sha(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def source_name(path, directory):
+    '''The name of the file path relative to directory.'''
+    return os.path.relpath(path, directory).replace(os.path.sep, "/")
+
+
+def record_sources(paths, directory):
+    '''Returns the sources dict of a generated file in directory that is
+    made from the files paths.'''
+    return dict([(source_name(p, directory), file_sha(p)) for p in paths])
+
+
+def changed_sources(sources, directory, sha_of=file_sha):
+    '''Returns the paths of the files in the sources dict of a generated
+    file in directory whose content has changed since it was made, or
+    that are gone.  sha_of returns the SHA of the content of a file, or
+    None if there's no such file.'''
+    changed = []
+    for name, sha in sorted(sources.items()):
+        path = os.path.normpath(os.path.join(directory, name))
+        if sha_of(path) != sha:
+            changed.append(path)
+    return changed
+
+
+def read_sources(path):
+    '''Returns the sources dict recorded in the generated JSON file path,
+    or None if it doesn't record one.'''
+    with open(path, "r") as f:
+        data = json.load(f)
+    sources = data.get("sources") if isinstance(data, dict) else None
+    return sources if isinstance(sources, dict) else None
@@ -0,0 +1,137 @@
+# Answering "what's here?" about a floor plan: which items and which
+# shapes of the floor plan drawing contain a point, and which items are
+# nearest to it, all in real world coordinates.
+#
+# The footprints of the items, see footprint.py, and the shapes of the
+# drawing, see floor_plan.py, are each kept in a GridIndex, so a query
+# only looks at the few that are near the point however many there are.
+# Whether an item contains the point is then decided exactly by which
+# side of each edge of its convex polygons the point is on, and
+# whether a shape does by the winding number of its outline.
+
+
+import json
+import math
+import os.path
+
+from box import Box
+from floor_plan import FloorPlan
+from footprint import Footprint
+from grid_index import GridIndex
+
+
+# The properties of an item that a query returns.
+ITEM_SUMMARY_FIELDS = ("name", "unique_id", "cssClass", "x", "y")
+
+
+# How far outside the bounds of its items and shapes a point can be and
+# still be asked about, as a multiple of the larger of their width and
+# height.  Distances to points much further away than that are
+# meaningless, and can't even be represented once they overflow.
+QUERY_MARGIN = 1
+
+
+def item_summary(item, filename):
+    summary = dict([(field, item[field]) for field in ITEM_SUMMARY_FIELDS
+                    if field in item])
+    summary["file"] = filename
+    return summary
+
+
+def box_area(box):
+    return box.width * box.height
+
+
+def grid_for(boxes):
+    '''Returns an empty GridIndex for boxes with cells no smaller than a
+    typical Box, and big enough that there's about one Box in a cell,
+    so that a nearest query finds some in the first few rings of cells
+    even where the Boxes are far apart.'''
+    size = GridIndex.for_boxes(boxes).cell_size
+    if boxes:
+        extent = boxes[0]
+        for box in boxes[1:]:
+            extent = extent.union(box)
+        size = max(size, math.sqrt(box_area(extent) / len(boxes)))
+    return GridIndex(size)
+
+
+class SpatialIndex (object):
+    '''SpatialIndex answers point queries about the items placed on a
+    floor plan, and the shapes of its drawing.  items is a list of item
+    summaries and footprints is a list of their Footprints, keyed by
+    their position in items.  shapes is a list of floor_plan.Shapes.'''
+
+    @classmethod
+    def read(cls, directory, svg, things):
+        '''Returns the SpatialIndex of the floor plan page in directory
+        that shows the SVG file svg with the items of the JSON files
+        things.  The file names are relative to directory.'''
+        items = []
+        footprints = []
+        for f in things:
+            with open(os.path.join(directory, f), "r") as io:
+                data = json.load(io)
+            for item in data:
+                if not isinstance(item, dict):
+                    continue
+                try:
+                    footprint = Footprint.of_item(len(items), item)
+                except Exception:
+                    footprint = None
+                if footprint is not None:
+                    items.append(item_summary(item, f))
+                    footprints.append(footprint)
+        shapes = []
+        path = os.path.join(directory, svg)
+        if os.path.exists(path):
+            shapes = FloorPlan.read(path, shapes=True).shapes
+        return cls(items, footprints, shapes)
+
+    def __init__(self, items, footprints, shapes=()):
+        self.items = items
+        self.footprints = footprints
+        self.shapes = list(shapes)
+        self.item_grid = grid_for([f.box for f in footprints])
+        for f in footprints:
+            self.item_grid.insert(f.key, f.box)
+        self.shape_grid = grid_for([s.box for s in self.shapes])
+        for i, s in enumerate(self.shapes):
+            self.shape_grid.insert(i, s.box)
+        # The bounds of the items and shapes, or None if there are none.
+        boxes = [f.box for f in footprints] + [s.box for s in self.shapes]
+        self.bounds = boxes[0] if boxes else None
+        for box in boxes[1:]:
+            self.bounds = self.bounds.union(box)
+
+    def covers(self, x, y):
+        '''Returns True iff the point x, y is near enough to the items
+        and shapes to be asked about, see QUERY_MARGIN.'''
+        if self.bounds is None:
+            return True
+        margin = QUERY_MARGIN * max(self.bounds.width, self.bounds.height)
+        return self.bounds.expand(margin).contains(Box(x, y, x, y))
+
+    def items_at(self, x, y):
+        '''Returns the summaries of the items that contain the point x, y,
+        smallest first.'''
+        point = Box(x, y, x, y)
+        found = [self.footprints[key] for key in self.item_grid.query(point)
+                 if self.footprints[key].contains(x, y)]
+        found.sort(key=lambda f: (box_area(f.box), f.key))
+        return [self.items[f.key] for f in found]
+
+    def shapes_at(self, x, y):
+        '''Returns the Shapes of the floor plan that contain the point
+        x, y, smallest first.'''
+        point = Box(x, y, x, y)
+        found = [self.shapes[i] for i in self.shape_grid.query(point)
+                 if self.shapes[i].contains(x, y)]
+        found.sort(key=lambda s: (box_area(s.box), s.index))
+        return found
+
+    def nearest(self, x, y, k):
+        '''Returns a list of (distance, summary) for the k items nearest
+        to the point x, y, nearest first.'''
+        return [(d, self.items[key]) for d, key in self.item_grid.nearest(
+            x, y, k, lambda key: self.footprints[key].distance(x, y))]
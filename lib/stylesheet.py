@@ -6,17 +6,15 @@ import cssutils
 from xml_utils import *
 
 
-# *** TODO: getElementById isn't finding existing elements, presumably
-# because xml.dom doesn't know what the declared ID type attribute is
-# because it doesn't have the DTD.
-# The SVG namespace URI doesn't point to an XML schema.
+# xml.dom's getElementById doesn't know that id is the ID attribute
+# because it doesn't have the DTD.  The SVG namespace URI doesn't point
+# to an XML schema.  xml_utils.getElementById uses an index instead.
 def ensure_stylesheet(doc, id):
     '''Ensure that doc has a styleseet with id id and return it.'''
-    # style = doc.getElementById(id)
     style = getElementById(doc, id)
     if not style:
         style = new_stylesheet(doc)
-        style.setAttribute("id", id)
+        set_element_id(style, id)
         style.setAttribute("type", "text/css")
     return style
 
@@ -39,3 +37,103 @@ def add_stylesheet_rule(doc, style, selector, properties):
     style.appendChild(doc.createTextNode("\n" + rule.cssText))
     return rule
 
+
+
+def declarations(style):
+    '''Split the value of a style attribute into its declarations, at the
+    semicolons that aren't in a quoted string or in parentheses, as in
+    url(data:image/png;base64,...).'''
+    if not ("(" in style or '"' in style or "'" in style):
+        return style.split(";")
+    result = []
+    start = 0
+    depth = 0
+    quote = None
+    i = 0
+    while i < len(style):
+        c = style[i]
+        if c == "\\":
+            i += 1
+        elif quote:
+            if c == quote:
+                quote = None
+        elif c in "\"'":
+            quote = c
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth = max(depth - 1, 0)
+        elif c == ";" and depth == 0:
+            result.append(style[start:i])
+            start = i + 1
+        i += 1
+    result.append(style[start:])
+    return result
+
+
+def parse_style(style):
+    '''Parse the value of a style attribute into a dict mapping CSS
+    property names to values, in the order they first appear.  This is
+    much faster than cssutils.parseStyle but does no validation.'''
+    properties = {}
+    for declaration in declarations(style):
+        name, colon, value = declaration.partition(":")
+        name = name.strip().lower()
+        value = " ".join(value.split())
+        if colon and name and value:
+            properties[name] = value
+    return properties
+
+
+def style_text(properties):
+    '''Returns CSS declarations text for the properties dict.'''
+    return "".join(["%s: %s; " % (name, value)
+                    for name, value in properties.items()]).strip()
+
+
+class StyleMap (object):
+    '''StyleMap assigns a CSS class name to each distinct set of CSS
+    properties that is given to it as the value of a style attribute.
+    Each distinct style attribute value is only parsed once.'''
+    def __init__(self, prefix="style"):
+        self.prefix = prefix
+        # Maps each style attribute value seen to its class name.
+        self.classes_by_style = {}
+        # Maps the sorted properties of each style to its class name.
+        self.classes_by_key = {}
+        # Maps each class name to its properties dict.
+        self.properties = {}
+
+    def __len__(self):
+        return len(self.properties)
+
+    def __contains__(self, class_name):
+        return class_name in self.properties
+
+    def __getitem__(self, class_name):
+        '''Returns the properties dict of the named class.'''
+        return self.properties[class_name]
+
+    def get(self, class_name, default=None):
+        return self.properties.get(class_name, default)
+
+    def class_names(self):
+        return list(self.properties.keys())
+
+    def class_for(self, style):
+        '''Returns the name of the CSS class that stands for style, the
+        value of a style attribute, creating it if necessary.'''
+        class_name = self.classes_by_style.get(style)
+        if class_name is not None:
+            return class_name
+        properties = parse_style(style)
+        key = ";".join(["%s:%s" % item for item in sorted(properties.items())])
+        class_name = self.classes_by_key.get(key)
+        if class_name is None:
+            # Classes are numbered by even numbers, as they always have
+            # been, so that class names in existing scripts stay valid.
+            class_name = "%s%d" % (self.prefix, 2 * len(self.properties))
+            self.classes_by_key[key] = class_name
+            self.properties[class_name] = properties
+        self.classes_by_style[style] = class_name
+        return class_name
@@ -2,12 +2,64 @@
 # Ru7n with
 #  python -m unittest test
 
+import importlib.util
+import io
+import json
+import math
+import os
+import queue
+import subprocess
+import sys
+import tempfile
 import unittest
+import unittest.mock
+import xml.dom.minidom
 
+import numpy
+import svg.path
 from svg.path import Line
 
-from box import Box
+from atomic_file import atomic_open, atomic_output
+from box import Box, BoxArray
+from floor_plan import FloorPlan
+from footprint import Footprint, convex_parts, overlapping_pairs
+from bundle import FurnishingsBundle, make_bundle
+from furnishing_schema import IntegrityIndex, check_furnishings, check_item
+from furnishings import facility_directory
+from grid_index import GridIndex
+from id_registry import IdRegistry, add_unique_ids
+from json_text import LineIndex, array_elements, key_position
+from search_index import FUZZY_THRESHOLD, SearchIndex, SearchIndexBuilder
+from simplify import douglas_peucker, format_number
+from spatial_index import SpatialIndex
+from stylesheet import StyleMap, parse_style
 from transform import Transform
+from xml_utils import PrettyXMLWriter, do_elements
+from xml_utils import getElementById, remove_element, set_element_id
+
+
+def load_script(*path):
+    '''Loads the script at path under the top level directory, which
+    isn't in lib, as a module.  Its directory is added to sys.path, as
+    it is when it's run.'''
+    filename = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", *path)
+    directory = os.path.dirname(os.path.abspath(filename))
+    if directory not in sys.path:
+        sys.path.append(directory)
+    name = os.path.splitext(path[-1])[0]
+    spec = importlib.util.spec_from_file_location(name, filename)
+    module = importlib.util.module_from_spec(spec)
+    # So that importing it again gets this module.
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+build = load_script("build.py")
+bump = load_script("bump.py")
+cleanup = load_script("floor_plan_cleanup", "cleanup_inkscape_svg.py")
+web_server = load_script("web_server.py")
 
 
 class TestBox (unittest.TestCase):
@@ -58,6 +110,82 @@ class TestBox (unittest.TestCase):
         self.assertFalse(self.box.line_intersects(Transform.identity(),
                                                   Line(18+25j, 28+33j)))
 
+    def test_lines_intersect(self):
+        '''The batched test agrees with line_intersects.'''
+        lines = [Line(25+45j, 5+25j), Line(18+32j, 12+38j),
+                 Line(15+32j, 25+25j), Line(25+25j, 15+32j),
+                 Line(0+33j, 8+35j), Line(22+33j, 28+35j),
+                 Line(5+25j, 12+28j), Line(15+42j, 8+50j),
+                 Line(18+25j, 28+33j)]
+        starts = numpy.array([[l.start.real, l.start.imag] for l in lines])
+        ends = numpy.array([[l.end.real, l.end.imag] for l in lines])
+        self.assertEqual(
+            list(self.box.lines_intersect(starts, ends)),
+            [self.box.line_intersects(Transform.identity(), l)
+             for l in lines])
+
+    def test_points_within_transform(self):
+        points = numpy.array([[5, 15], [15, 15], [15, 35]])
+        self.assertEqual(
+            list(self.box.points_within(points, Transform.translate(0, 20))),
+            [False, True, False])
+
+    def test_intersects(self):
+        self.assertTrue(self.box.intersects(Box(15, 35, 25, 45)))
+        self.assertTrue(self.box.intersects(Box(0, 0, 100, 100)))
+        self.assertFalse(self.box.intersects(Box(21, 30, 25, 40)))
+
+    def test_contains(self):
+        self.assertTrue(self.box.contains(Box(12, 32, 18, 38)))
+        self.assertFalse(self.box.contains(Box(15, 35, 25, 45)))
+
+    def test_scale(self):
+        self.assertEqual(self.box.scale(2), Box(20, 60, 40, 80))
+
+    def test_union_intersection(self):
+        other = Box(15, 35, 25, 45)
+        self.assertEqual(self.box.union(other), Box(10, 30, 25, 45))
+        self.assertEqual(self.box.intersection(other), Box(15, 35, 20, 40))
+        self.assertIsNone(self.box.intersection(Box(50, 50, 60, 60)))
+
+    def test_expand(self):
+        self.assertEqual(self.box.expand(1), Box(9, 29, 21, 41))
+
+    def test_quadrants(self):
+        quadrants = self.box.quadrants()
+        self.assertEqual(quadrants, [Box(10, 30, 15, 35), Box(15, 30, 20, 35),
+                                     Box(10, 35, 15, 40), Box(15, 35, 20, 40)])
+        union = quadrants[0]
+        for q in quadrants[1:]:
+            union = union.union(q)
+        self.assertEqual(union, self.box)
+
+
+class TestBoxArray (unittest.TestCase):
+    boxes = BoxArray([[10, 30, 20, 40], [15, 35, 25, 45]])
+
+    def test_boxes(self):
+        self.assertEqual(len(self.boxes), 2)
+        self.assertEqual(list(self.boxes),
+                         [Box(10, 30, 20, 40), Box(15, 35, 25, 45)])
+        self.assertEqual(BoxArray.from_boxes(self.boxes), self.boxes)
+
+    def test_point_within(self):
+        self.assertEqual(list(self.boxes.point_within([12, 32])),
+                         [True, False])
+        self.assertEqual(
+            self.boxes.point_within([[12, 32], [18, 38], [0, 0]]).tolist(),
+            [[True, True, False], [False, True, False]])
+
+    def test_translate_scale(self):
+        self.assertEqual(self.boxes.translate(1, 2).scale(2)[1],
+                         Box(32, 74, 52, 94))
+
+    def test_union_intersection(self):
+        self.assertEqual(self.boxes.union(), Box(10, 30, 25, 45))
+        self.assertEqual(self.boxes.intersection(), Box(15, 35, 20, 40))
+        self.assertIsNone(BoxArray([[0, 0, 1, 1], [2, 2, 3, 3]]).intersection())
+
 
 # I need a way to visualize the test cases:
 #
@@ -111,6 +239,929 @@ class TestTransform (unittest.TestCase):
             self.assertEqual(trans, parsed)
             self.assertEqual(trans, parsed)
 
+    def test_parse_list(self):
+        '''A transform list is applied from right to left.'''
+        parsed = Transform.parseSVG("translate(10, 20) scale(2)")
+        self.assertTrue(numpy.allclose(parsed.apply(complex(1, 1)),
+                                       [12, 22, 1]))
+        self.assertIs(parsed, Transform.parseSVG("translate(10, 20) scale(2)"))
+
+    def test_parse_rotate_about_center(self):
+        parsed = Transform.parseSVG("rotate(90 10 10)")
+        self.assertTrue(numpy.allclose(parsed.apply(complex(20, 10)),
+                                       [10, 20, 1]))
+
+    def test_parse_skew(self):
+        self.assertTrue(numpy.allclose(
+            Transform.parseSVG("skewX(45)").apply(complex(0, 1)), [1, 1, 1]))
+        self.assertTrue(numpy.allclose(
+            Transform.parseSVG("skewY(45)").apply(complex(1, 0)), [1, 1, 1]))
+
+    def test_parse_unsupported(self):
+        self.assertIsNone(Transform.parseSVG("bogus(1)"))
+
+    def test_apply_many(self):
+        t = Transform.parseSVG("matrix(1,2,3,4,5,6)")
+        points = [complex(1, 0), complex(0, 1), complex(2, 3)]
+        expected = numpy.array([t.apply(p) for p in points])
+        self.assertTrue(numpy.allclose(
+            t.apply_many(numpy.array([[1, 0, 1], [0, 1, 1], [2, 3, 1]])),
+            expected))
+        self.assertTrue(numpy.allclose(
+            t.apply_many(numpy.array([[1, 0], [0, 1], [2, 3]])),
+            expected[:, :2]))
+        self.assertTrue(numpy.allclose(
+            t.apply_many(numpy.array(points)),
+            expected[:, 0] + expected[:, 1] * 1j))
+
+    def test_max_stretch(self):
+        self.assertAlmostEqual(Transform.scale(2, -3).max_stretch(), 3)
+        self.assertAlmostEqual(
+            Transform.rotate(30).compose(Transform.scale(0.5, 0.5)
+                                         ).max_stretch(), 0.5)
+
+
+class TestGridIndex (unittest.TestCase):
+    def test_query(self):
+        index = GridIndex(10)
+        index.insert("a", Box(0, 0, 5, 5))
+        index.insert("b", Box(12, 12, 38, 14))
+        index.insert("c", Box(100, 100, 101, 101))
+        self.assertEqual(index.query(Box(4, 4, 13, 13)), {"a", "b"})
+        self.assertEqual(index.query(Box(30, 0, 40, 20)), {"b"})
+        self.assertEqual(index.query(Box(-100, -100, 200, 200)),
+                         {"a", "b", "c"})
+        self.assertEqual(index.query(Box(50, 50, 60, 60)), set())
+
+    def test_update_and_remove(self):
+        index = GridIndex(10)
+        index.insert("a", Box(0, 0, 5, 5))
+        index.insert("a", Box(50, 50, 55, 55))
+        self.assertEqual(index.query(Box(0, 0, 5, 5)), set())
+        self.assertEqual(index.query(Box(50, 50, 51, 51)), {"a"})
+        index.remove("a")
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.query(Box(50, 50, 51, 51)), set())
+
+    def test_nearest(self):
+        index = GridIndex(10)
+        boxes = { "a": Box(0, 0, 5, 5), "b": Box(12, 12, 38, 14),
+                  "c": Box(100, 100, 101, 101) }
+        for key, box in boxes.items():
+            index.insert(key, box)
+        distance = lambda key: math.hypot(
+            max(boxes[key].minX - 20, 0, 20 - boxes[key].maxX),
+            max(boxes[key].minY - 30, 0, 30 - boxes[key].maxY))
+        self.assertEqual([key for d, key in index.nearest(20, 30, 2, distance)],
+                         ["b", "a"])
+        self.assertEqual(len(index.nearest(20, 30, 5, distance)), 3)
+        self.assertEqual(index.nearest(101, 101, 1, distance)[0][1], "c")
+
+    def test_nearest_far_away(self):
+        '''A point far outside of the occupied cells doesn't search the
+        empty rings between them.'''
+        index = GridIndex(1)
+        boxes = { "a": Box(0, 0, 5, 5), "b": Box(12, 12, 38, 14) }
+        for key, box in boxes.items():
+            index.insert(key, box)
+        for x, y in [(1e12, 13), (-1e300, -1e300), (1.7e308, 0)]:
+            distance = lambda key: math.hypot(
+                max(boxes[key].minX - x, 0, x - boxes[key].maxX),
+                max(boxes[key].minY - y, 0, y - boxes[key].maxY))
+            self.assertEqual([key for d, key in
+                              index.nearest(x, y, 2, distance)],
+                             sorted(boxes, key=distance))
+        for x in [math.nan, math.inf]:
+            self.assertRaises(ValueError, index.nearest, x, 0, 1, distance)
+
+
+class TestDoElements (unittest.TestCase):
+    def test_visitors_in_document_order(self):
+        doc = xml.dom.minidom.parseString(
+            '<a><b><c/></b>text<d/><!--x--></a>')
+        first = []
+        second = []
+        do_elements(doc, lambda e: first.append(e.tagName),
+                    lambda e: second.append(e.tagName))
+        self.assertEqual(first, ["a", "b", "c", "d"])
+        self.assertEqual(second, first)
+
+    def test_deep_document(self):
+        depth = 5000
+        doc = xml.dom.minidom.parseString("<g>" * depth + "</g>" * depth)
+        count = []
+        do_elements(doc, count.append)
+        self.assertEqual(len(count), depth)
+
+
+class TestElementIds (unittest.TestCase):
+    def test_index(self):
+        doc = xml.dom.minidom.parseString(
+            '<svg><g id="a"><path id="b"/></g><g id="dup"/><g id="dup"/></svg>')
+        b = getElementById(doc, "b")
+        self.assertEqual(b.tagName, "path")
+        self.assertIs(doc.getElementById("b"), b)
+        self.assertIsNone(getElementById(doc, "dup"))
+        self.assertIsNone(getElementById(doc, "missing"))
+        g = doc.createElement("g")
+        doc.documentElement.appendChild(g)
+        set_element_id(g, "new")
+        self.assertIs(getElementById(doc, "new"), g)
+        remove_element(getElementById(doc, "a"))
+        self.assertIsNone(getElementById(doc, "a"))
+        self.assertIsNone(getElementById(doc, "b"))
+        # Removed without telling the index:
+        doc.documentElement.removeChild(g)
+        self.assertIsNone(getElementById(doc, "new"))
+
+
+class TestPrettyXMLWriter (unittest.TestCase):
+    def test_matches_writexml(self):
+        '''PrettyXMLWriter formats like minidom's writexml.'''
+        source = ('<svg a="1"><g id="x &amp; y"><path d="M 0 0"/>'
+                  '<text>Hi &lt;there&gt;</text></g><!--note--></svg>')
+        expected = io.StringIO()
+        xml.dom.minidom.parseString(source).documentElement.writexml(
+            expected, addindent="  ", newl="\n")
+        out = io.StringIO()
+        w = PrettyXMLWriter(out)
+        w.start("svg", {"a": "1"})
+        w.start("g", {"id": "x & y"})
+        w.start("path", {"d": "M 0 0"})
+        w.end("path")
+        w.start("text", {})
+        w.text("Hi <there>")
+        w.end("text")
+        w.end("g")
+        w.comment("note")
+        w.end("svg")
+        self.assertEqual(out.getvalue(), expected.getvalue())
+
+
+class TestStyleMap (unittest.TestCase):
+    def test_parse_style(self):
+        self.assertEqual(parse_style("fill:#fff; Stroke : 1px  solid ;;"),
+                         {"fill": "#fff", "stroke": "1px solid"})
+
+    def test_parse_style_nested_semicolons(self):
+        self.assertEqual(
+            parse_style("fill:url(data:image/png;base64,AAA=);"
+                        "font-family:'a;b', \"c;d\";stroke:none"),
+            {"fill": "url(data:image/png;base64,AAA=)",
+             "font-family": "'a;b', \"c;d\"",
+             "stroke": "none"})
+
+    def test_class_for(self):
+        m = StyleMap()
+        a = m.class_for("fill:red;stroke:none")
+        self.assertEqual(a, "style0")
+        # Equivalent styles share a class.
+        self.assertEqual(m.class_for("stroke: none; fill: red"), a)
+        self.assertEqual(m.class_for("fill:red;stroke:none"), a)
+        b = m.class_for("fill:blue")
+        self.assertEqual(b, "style2")
+        self.assertEqual(len(m), 2)
+        self.assertEqual(m[b], {"fill": "blue"})
+        self.assertEqual(m.class_names(), [a, b])
+
+    def test_separate_maps(self):
+        StyleMap().class_for("fill:red")
+        self.assertEqual(len(StyleMap()), 0)
+
+
+class TestAtomicFile (unittest.TestCase):
+    def test_atomic_open(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "out.txt")
+            with atomic_open(path) as f:
+                f.write("new")
+                self.assertFalse(os.path.exists(path))
+            with open(path) as f:
+                self.assertEqual(f.read(), "new")
+            # A failure leaves the old contents in place.
+            with self.assertRaises(ValueError):
+                with atomic_open(path) as f:
+                    f.write("partial")
+                    raise ValueError()
+            with open(path) as f:
+                self.assertEqual(f.read(), "new")
+            self.assertEqual(os.listdir(d), ["out.txt"])
+
+    def test_unique_temporary_files(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "out.txt")
+            with atomic_output(path) as a:
+                with atomic_output(path) as b:
+                    self.assertNotEqual(a, b)
+                    self.assertEqual(os.path.dirname(a), d)
+            self.assertEqual(os.listdir(d), ["out.txt"])
+
+
+class TestBundle (unittest.TestCase):
+    def test_round_trip(self):
+        files = [
+            [{"name": "a", "unique_id": "a", "cssClass": "saw",
+              "x": 1, "y": 2.5, "width": 3, "depth": 4, "rotation": 0.25},
+             {"name": "b", "unique_id": "b", "cssClass": "saw",
+              "x": 5, "y": 6, "rotation": "0.5", "contents": ["c"]}],
+            [{"name": "d", "cssClass": "bench", "path_d": "M 0 0 h 1"}]]
+        with tempfile.TemporaryDirectory() as d:
+            paths = []
+            for i, things in enumerate(files):
+                paths.append(os.path.join(d, "f%d.json" % i))
+                with open(paths[-1], "w") as f:
+                    json.dump(things, f)
+            bundle = FurnishingsBundle(make_bundle(paths, d))
+        self.assertEqual(len(bundle), 3)
+        self.assertEqual(bundle.dictionaries["cssClass"], ["saw", "bench"])
+        self.assertEqual(bundle.columns["cssClass"], [0, 0, 1])
+        self.assertEqual(bundle.column("from_file"),
+                         ["f0.json", "f0.json", "f1.json"])
+        self.assertEqual(bundle.index, {"a": 0, "b": 1})
+        # A rotation that isn't a number is kept, but not in the column.
+        self.assertTrue(numpy.isnan(bundle.numeric("rotation")[1]))
+        for i, thing in enumerate(files[0] + files[1]):
+            t = bundle.thing(i)
+            del t["from_file"]
+            self.assertEqual(t, thing)
+        self.assertEqual(bundle["b"]["contents"], ["c"])
+
+    def test_changed_sources(self):
+        with tempfile.TemporaryDirectory() as d:
+            paths = [os.path.join(d, "f%d.json" % i) for i in range(2)]
+            for path in paths:
+                with open(path, "w") as f:
+                    json.dump([{"name": path}], f)
+            bundle = FurnishingsBundle(make_bundle(paths, d))
+            self.assertEqual(bundle.changed_sources(d), [])
+            with open(paths[1], "w") as f:
+                json.dump([], f)
+            os.remove(paths[0])
+            self.assertEqual(bundle.changed_sources(d), paths)
+
+
+class TestBuildCache (unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.directory = self.temp.name
+        self.tool = self.path("tool.py")
+        self.input = self.path("in.json")
+        self.output = self.path("out.json")
+        for f in [self.tool, self.input, self.output]:
+            self.write(f, "1")
+        self.tools = unittest.mock.patch.dict(build.TOOL_FILES,
+                                              {"test": [self.tool]})
+        self.tools.start()
+        self.record()
+
+    def tearDown(self):
+        self.tools.stop()
+        self.temp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, path, text):
+        with open(path, "w") as f:
+            f.write(text)
+
+    def key(self, cache, arguments=["-a"]):
+        return cache.key("test", [self.input], arguments)
+
+    def record(self):
+        '''Build the output, as build_facility would.'''
+        cache = build.BuildCache(self.directory)
+        cache.record(self.output, self.key(cache))
+        cache.save()
+
+    def up_to_date(self, arguments=["-a"]):
+        '''Whether a later build would skip the step.'''
+        cache = build.BuildCache(self.directory)
+        return cache.up_to_date(self.output, self.key(cache, arguments))
+
+    def test_unchanged(self):
+        self.assertTrue(self.up_to_date())
+
+    def test_source_changed(self):
+        self.write(self.input, "2")
+        self.assertFalse(self.up_to_date())
+
+    def test_arguments_changed(self):
+        self.assertFalse(self.up_to_date(["-b"]))
+
+    def test_tool_changed(self):
+        self.write(self.tool, "2")
+        self.assertFalse(self.up_to_date())
+
+    def test_output_changed(self):
+        self.write(self.output, "2")
+        self.assertFalse(self.up_to_date())
+        os.remove(self.output)
+        self.assertFalse(self.up_to_date())
+
+
+class TestSimplify (unittest.TestCase):
+    def test_douglas_peucker(self):
+        points = [[0, 0], [1, 0], [2, 0.01], [3, 0], [3, 0], [3, 3], [0, 0]]
+        self.assertEqual(list(douglas_peucker(points, 0.1)),
+                         [True, False, False, True, False, True, True])
+        self.assertEqual(list(douglas_peucker([[0, 0], [1, 0], [2, 0], [2, 2]],
+                                              0)),
+                         [True, False, True, True])
+        self.assertEqual(list(douglas_peucker(points[:2], 10)), [True, True])
+        # A path that doubles back keeps the point where it turns.
+        self.assertEqual(list(douglas_peucker([[0, 0], [5, 0], [1, 0]], 0)),
+                         [True, True, True])
+
+    def test_format_number(self):
+        self.assertEqual([format_number(x, 2)
+                          for x in (1.0, -0.0001, 0.5, -0.5, 123.456, 100)],
+                         ["1", "0", ".5", "-.5", "123.46", "100"])
+        self.assertEqual([format_number(x) for x in (3.0, 0.25, -12.5)],
+                         ["3", ".25", "-12.5"])
+
+
+class TestIdRegistry (unittest.TestCase):
+    ITEM = '"cssClass": "machine", "x": 1, "y": 2'
+
+    def test_add_unique_ids(self):
+        text = ('[\n  "A comment",\n  {\n    "name": "Lathe",\n    %s\n  },\n'
+                '  { "name": "Mill", "unique_id": "", %s },\n'
+                '  { "name": "Saw", "unique_id": "_x_0001", %s }\n]\n' % (
+                    self.ITEM, self.ITEM, self.ITEM))
+        ids = iter(["_x_0002", "_x_0003"])
+        new_text, count = add_unique_ids(text, lambda: next(ids))
+        self.assertEqual(count, 2)
+        self.assertEqual(new_text, text.replace(
+            '"Lathe",', '"Lathe",\n    "unique_id": "_x_0002",').replace(
+                '"unique_id": ""', '"unique_id": "_x_0003"'))
+        self.assertEqual([t["unique_id"] for t in json.loads(new_text)[1:]],
+                         ["_x_0002", "_x_0003", "_x_0001"])
+
+    def test_registry(self):
+        with tempfile.TemporaryDirectory() as d:
+            for facility, uid in (("a", "_x_0007"), ("b", "_x_0007"),
+                                  ("c", "_x_0012")):
+                os.mkdir(os.path.join(d, facility))
+                with open(os.path.join(d, facility, "things.json"), "w") as f:
+                    f.write('[{ "name": "Bench", "unique_id": "%s", %s }, '
+                            '{ "name": "Vise", %s }]' % (
+                                uid, self.ITEM, self.ITEM))
+            registry = IdRegistry(d)
+            self.assertEqual(len(registry.scan()), 3)
+            self.assertEqual(registry.collisions(), {
+                "_x_0007": [os.path.join("a", "things.json"),
+                            os.path.join("b", "things.json")]})
+            self.assertEqual(len(registry.files_missing_ids()), 3)
+            self.assertEqual(registry.allocate(), "_x_0013")
+            self.assertEqual(registry.allocate(), "_x_0014")
+            registry.save()
+            registry = IdRegistry(d)
+            self.assertEqual(registry.scan(), [])
+            self.assertEqual(registry.next_id, 13)
+
+
+class TestJsonText (unittest.TestCase):
+    def test_array_elements(self):
+        text = '[ "a",\n  {"x": {"y": 1}, "y": 2}, 3 ]'
+        elements = list(array_elements(text))
+        self.assertEqual([v for v, start, end in elements],
+                         ["a", {"x": {"y": 1}, "y": 2}, 3])
+        self.assertEqual([text[start:end] for v, start, end in elements],
+                         ['"a"', '{"x": {"y": 1}, "y": 2}', '3'])
+        value, start, end = elements[1]
+        self.assertEqual(key_position(text, value, start, end, "y"),
+                         text.index('"y": 2'))
+        self.assertEqual(LineIndex(text).location(start), (2, 3))
+        for bad in ('{}', '[1, 2', '[1 2]', '[1] 2', ''):
+            with self.assertRaises(json.JSONDecodeError):
+                list(array_elements(bad))
+
+
+class TestFootprint (unittest.TestCase):
+    def footprint(self, key, **item):
+        return Footprint.of_item(key, item)
+
+    def test_rectangle(self):
+        f = self.footprint("a", x=10, y=20, width=4, depth=2, rotation=0.25)
+        self.assertTrue(numpy.allclose(
+            [f.box.minX, f.box.minY, f.box.maxX, f.box.maxY],
+            [9, 18, 11, 22]))
+        self.assertIsNone(self.footprint("b", x=1, y=2, width=3))
+
+    def test_overlapping_pairs(self):
+        footprints = [
+            self.footprint("a", x=0, y=0, width=2, depth=2),
+            # Against a, but not overlapping it.
+            self.footprint("b", x=2, y=0, width=2, depth=2),
+            self.footprint("c", x=3, y=1, width=1, depth=1),
+            # A diamond whose bounding box overlaps a's, but not a.
+            self.footprint("d", x=2, y=-2, width=1.4, depth=1.4,
+                           rotation=0.125),
+            self.footprint("e", x=50, y=50, width=1, depth=1)]
+        self.assertEqual(sorted([tuple(sorted([a.key, b.key]))
+                                 for a, b in overlapping_pairs(footprints)]),
+                         [("b", "c")])
+
+    def test_path(self):
+        # An L shape, with a box in the corner that it goes around.
+        l = self.footprint("l", x=0, y=0,
+                           path_d="M 0 0 h 3 v 1 h -2 v 2 h -1 z")
+        self.assertEqual(len(l.polygons), 4)
+        inside = self.footprint("i", x=1.5, y=1.5, width=0.9, depth=0.9)
+        self.assertFalse(l.overlaps(inside))
+        self.assertTrue(l.overlaps(self.footprint("j", x=0.5, y=2, width=0.5,
+                                                  depth=0.5)))
+        circle = self.footprint(
+            "c", x=10, y=10,
+            path_d="M 0 0 m 2 0 a 2 2 0 1 0 -4 0 a 2 2 0 1 0 4 0")
+        self.assertEqual(len(circle.polygons), 1)
+        self.assertTrue(numpy.allclose(
+            [circle.box.minX, circle.box.maxY], [8, 12]))
+        self.assertEqual(len(convex_parts(numpy.array(
+            [[0, 0], [1, 0], [1, 1], [0, 1]]))), 1)
+
+    def test_within(self):
+        box = Box(0, 0, 10, 10)
+        self.assertEqual(self.footprint(
+            "a", x=1, y=1, width=2, depth=2).within(box), "inside")
+        self.assertEqual(self.footprint(
+            "b", x=10, y=5, width=2, depth=2).within(box), "partly outside")
+        self.assertEqual(self.footprint("c", x=-2, y=-2, width=2, depth=2,
+                                        rotation=0.125).within(box), "outside")
+
+
+class TestSpatialIndex (unittest.TestCase):
+    SVG = ('<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 100 100">'
+           '<g transform="translate(10, 0)">'
+           '<path id="room" d="M 0 0 h 50 v 50 h -50 z"/>'
+           '<rect x="0" y="0" width="20" height="20"/>'
+           '<path d="M 0 0 L 90 90"/></g>'
+           '<g id="real-world" transform="scale(2)"/></svg>')
+
+    def test_floor_plan(self):
+        with tempfile.TemporaryDirectory() as d:
+            svg = os.path.join(d, "plan.svg")
+            with open(svg, "w") as f:
+                f.write(self.SVG)
+            plan = FloorPlan.read(svg, shapes=True)
+            self.assertEqual(plan.box, Box(0, 0, 100, 100))
+            self.assertEqual([(s.tag, s.id) for s in plan.shapes],
+                             [("path", "room"), ("rect", None)])
+            # In real world coordinates.
+            self.assertEqual(plan.shapes[0].box, Box(5, 0, 30, 25))
+            self.assertEqual(FloorPlan.read(svg).shapes, [])
+            index = SpatialIndex([], [], plan.shapes)
+            self.assertEqual([s.index for s in index.shapes_at(8, 8)], [1, 0])
+            self.assertEqual([s.index for s in index.shapes_at(20, 20)], [0])
+            self.assertEqual(index.shapes_at(40, 20), [])
+
+    def test_items(self):
+        items = [{ "name": "bench", "x": 10, "y": 10, "width": 10,
+                   "depth": 2, "rotation": 0.125 },
+                 { "name": "vise", "x": 10, "y": 10, "width": 1,
+                   "depth": 1 },
+                 { "name": "saw", "x": 30, "y": 10, "width": 2,
+                   "depth": 2 }]
+        index = SpatialIndex(items, [Footprint.of_item(i, item)
+                                     for i, item in enumerate(items)])
+        self.assertEqual([i["name"] for i in index.items_at(10, 10)],
+                         ["vise", "bench"])
+        # Inside the bench's bounding box, but not the bench.
+        self.assertEqual(index.items_at(13, 7), [])
+        self.assertEqual(index.items_at(13, 13), [items[0]])
+        nearest = index.nearest(30, 13, 2)
+        self.assertEqual([i["name"] for d, i in nearest], ["saw", "bench"])
+        self.assertAlmostEqual(nearest[0][0], 2)
+        # The bench's corners are about 5.76 and 14.24.
+        self.assertAlmostEqual(index.bounds.minX, 5.757, places=3)
+        self.assertEqual(index.bounds.maxX, 31)
+        self.assertTrue(index.covers(30, 13))
+        self.assertTrue(index.covers(-19, 39))
+        self.assertFalse(index.covers(-20, 10))
+        self.assertFalse(index.covers(10, 40))
+        self.assertFalse(index.covers(1e300, 10))
+        self.assertTrue(SpatialIndex([], []).covers(1e300, 10))
+
+
+class TestFurnishingSchema (unittest.TestCase):
+    def test_check_item(self):
+        item = { "name": "Bench", "cssClass": "bench", "x": 1, "y": 2.5,
+                 "width": 3, "depth": 4, "clustermarket_id": 12,
+                 "contents": ["vise", { "name": "drawer",
+                                        "contents": ["files"] }] }
+        self.assertEqual(check_item(item), [])
+        self.assertEqual(check_item(dict(item, x="1", colour="red")), [
+            ("x", 'x should be a number, not "1"'),
+            ("colour", "unsupported property colour")])
+        self.assertEqual(check_item(dict(item, clustermarket_id=True)), [
+            ("clustermarket_id", "clustermarket_id should be a string or "
+             "an integer, not true")])
+        del item["width"]
+        self.assertEqual(check_item(item), [
+            ("depth", "item has depth but no width")])
+        del item["depth"]
+        self.assertEqual(check_item(item), [
+            (None, "item has neither width and depth nor path_d")])
+        self.assertEqual(check_item(dict(item, path_d="M 0 0 h 2 v 1 z")), [])
+        self.assertEqual(len(check_item(dict(item, path_d="M 0 0 L 1"))), 1)
+
+    def test_check_furnishings(self):
+        text = ('[\n  "A comment",\n  { "name": "Bench", "unique_id": "b",\n'
+                '    "x": 1, "y": "2", "width": 1, "depth": 1,\n'
+                '    "description_uri": "bench.html#top" },\n  12\n]\n')
+        result = check_furnishings(text)
+        self.assertEqual(result["problems"], [
+            [4, 13, 'y should be a number, not "2"'],
+            [6, 3, "expected an item or a comment string, not 12"]])
+        self.assertEqual(result["unique_ids"], [["b", 3, 22]])
+        self.assertEqual(result["description_uris"],
+                         [["bench.html#top", 5, 5]])
+        result = check_furnishings(text.replace("12", "12,"))
+        self.assertEqual(result["problems"][-1], [7, 1, "Expecting value"])
+
+    def test_integrity_index(self):
+        with tempfile.TemporaryDirectory() as d:
+            with open(os.path.join(d, "bench.html"), "w") as f:
+                f.write("A bench")
+            index = IntegrityIndex()
+            a = os.path.join(d, "a.json")
+            b = os.path.join(d, "b.json")
+            index.add(a, { "unique_ids": [["b", 3, 5], ["c", 9, 5]],
+                           "description_uris": [
+                               ["bench.html#top", 4, 5],
+                               ["http://example.com/", 10, 5]] })
+            index.add(b, { "unique_ids": [["b", 2, 7]],
+                           "description_uris": [["saw.html", 3, 7]] })
+            self.assertEqual(index.problems(), [
+                (a, 3, 5, 'unique_id "b" is also used at %s:2:7' % b),
+                (b, 2, 7, 'unique_id "b" is also used at %s:3:5' % a),
+                (b, 3, 7, "description_uri saw.html: there's no %s" %
+                 os.path.join(d, "saw.html"))])
+            self.assertEqual(len(index.problems([a])), 1)
+
+    def test_integrity_index_groups(self):
+        '''A unique_id can be used once in each group of files that are
+        shown together.'''
+        ids = lambda *uids: { "unique_ids": [[u, 1, 1] for u in uids],
+                              "description_uris": [] }
+        index = IntegrityIndex(groups=[["a", "c"], ["b", "c"], ["d"]])
+        index.add("a", ids("shelf"))
+        index.add("b", ids("shelf", "table"))
+        index.add("c", ids("bench"))
+        index.add("d", ids("bench", "table", "table"))
+        self.assertEqual(index.problems(), [
+            ("d", 1, 1, 'unique_id "table" is also used at d:1:1'),
+            ("d", 1, 1, 'unique_id "table" is also used at d:1:1')])
+
+    def test_facility_directory(self):
+        self.assertEqual(facility_directory(
+            os.path.join("Facilities", "Shop", "furnashings", "a.json")),
+                         os.path.join("Facilities", "Shop"))
+        self.assertEqual(facility_directory(
+            os.path.join("Facilities", "a.json")), None)
+
+
+class TestSearchIndex (unittest.TestCase):
+    def index(self):
+        b = SearchIndexBuilder()
+        b.add_document({"name": "Drill Press", "url": "a"},
+                       [(4, "Drill Press")])
+        b.add_document({"name": "Cabinet", "url": "b"},
+                       [(4, "Cabinet"), (3, "1st drawer: drill bits")])
+        b.add_document({"name": "Band Saw", "url": "c"},
+                       [(4, "Band Saw")])
+        return SearchIndex(json.loads(json.dumps(b.index().index)))
+
+    def names(self, results):
+        return [d["name"] for s, d in results]
+
+    def test_exact_and_ranking(self):
+        self.assertEqual(self.names(self.index().search("drill")),
+                         ["Drill Press", "Cabinet"])
+
+    def test_prefix(self):
+        self.assertEqual(self.names(self.index().search("dri pre")),
+                         ["Drill Press"])
+
+    def test_fuzzy(self):
+        self.assertEqual(self.names(self.index().search("drll bits")),
+                         ["Cabinet"])
+
+    def test_no_match(self):
+        self.assertEqual(self.index().search("lathe"), [])
+
+    def test_combined(self):
+        b = SearchIndexBuilder()
+        b.add_index(self.index(), "f/")
+        combined = b.index()
+        self.assertEqual([d["url"] for s, d in combined.search("saw")],
+                         ["f/c"])
+
+    def test_fuzzy_threshold_is_recorded(self):
+        index = self.index()
+        self.assertEqual(index.index["fuzzy_threshold"], FUZZY_THRESHOLD)
+        index.fuzzy_threshold = 1.0
+        self.assertEqual(index.search("drll bits"), [])
+
+    def test_sources(self):
+        with tempfile.TemporaryDirectory() as d:
+            things = os.path.join(d, "things.json")
+            description = os.path.join(d, "saw.html")
+            with open(things, "w") as f:
+                json.dump([{"name": "Saw", "description_uri": "saw.html"}], f)
+            with open(description, "w") as f:
+                f.write("<p>Cuts wood</p>")
+            b = SearchIndexBuilder()
+            b.add_things_file(things, "f", "page.html")
+            index = b.index(d)
+            self.assertEqual(sorted(index.sources), ["saw.html", "things.json"])
+            self.assertEqual(index.changed_sources(d), [])
+            with open(description, "w") as f:
+                f.write("<p>Cuts metal</p>")
+            self.assertEqual(index.changed_sources(d), [description])
+
+
+class TestSVGContextCache (unittest.TestCase):
+    def setUp(self):
+        self.doc = xml.dom.minidom.parseString(
+            '<svg><g id="a" transform="translate(10, 0)"><g id="b">'
+            '<path id="c"/></g></g>'
+            '<g id="d" transform="scale(2)"/></svg>')
+        self.cache = cleanup.SVGContextCache()
+        self.cache.prime(self.doc)
+
+    def point(self, id):
+        transform, display = self.cache.context(
+            getElementById(self.doc, id))
+        x, y, w = transform.apply(complex(1, 1))
+        return complex(x, y)
+
+    def test_reparent(self):
+        '''Moving an element invalidates its context, and invalidating it
+        invalidates its descendants'.'''
+        self.assertEqual(self.point("c"), complex(11, 1))
+        b = getElementById(self.doc, "b")
+        getElementById(self.doc, "d").appendChild(b)
+        self.assertEqual(self.point("b"), complex(2, 2))
+        self.cache.invalidate(b)
+        self.assertEqual(self.point("c"), complex(2, 2))
+
+    def test_remove(self):
+        b = getElementById(self.doc, "b")
+        remove_element(b)
+        self.assertEqual(self.point("b"), complex(1, 1))
+        self.cache.invalidate(b)
+        self.assertEqual(self.point("c"), complex(1, 1))
+
+    def test_transform_changed(self):
+        a = getElementById(self.doc, "a")
+        a.setAttribute("transform", "translate(0, 5)")
+        self.cache.invalidate(a)
+        self.assertEqual(self.point("c"), complex(1, 6))
+
+
+class TestSimplifyPath (unittest.TestCase):
+    def test_rounding(self):
+        '''rounding is in global coordinates, so a path that's scaled up
+        keeps more decimal places.'''
+        d = "M 1.23456,2.34567 L 3.45678,4.56789"
+        parsed = svg.path.parse_path(d)
+        simplify = lambda transform, precision: cleanup.simplify_path(
+            parsed, d, transform, 0, precision, 0.05)
+        self.assertEqual(simplify(Transform.identity(), None),
+                         "M1.2,2.3 3.5,4.6")
+        self.assertEqual(simplify(Transform.scale(10, 10), None),
+                         "M1.23,2.35 3.46,4.57")
+        self.assertEqual(simplify(Transform.identity(), 0), "M1,2 3,5")
+
+
+class TestStreamCleanup (unittest.TestCase):
+    svg = '''<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<svg xmlns="http://www.w3.org/2000/svg" version="1.1" viewBox="0 0 200 100">
+  <g transform="matrix(1,0,0,-1,0,100)" id="g1">
+    <path d="M 10,10 L 40,10 L 40,40" id="p1"
+          style="fill:none;stroke:#000000;stroke-width:1"/>
+    <path d="M 150,10 L 190,90" id="p2"
+          style="fill:none;stroke:#ff0000;stroke-width:2"/>
+    <g transform="translate(5,5)">
+      <path d="M 60,60 L 60.1,60.2 L 70,70 C 70,70 80,70 90,60"
+            style="fill:none;stroke:#000000;stroke-width:1"/>
+    </g>
+  </g>
+  <text x="20" y="50" style="font-size:4px;fill:#000000">In</text>
+  <text x="180" y="50" style="font-size:4px;fill:#000000">Out</text>
+</svg>
+'''
+
+    def test_stream_matches_dom(self):
+        '''-stream writes the same file as the cleanup of the whole
+        document.'''
+        arguments = ["-input_file", "in.svg", "-output_file", "out.svg",
+                     "-clip", "-clip_box", "0", "0", "120", "100",
+                     "-clip_svg_viewbox", "-show_clip_box",
+                     "-hide_classes", "style2", "-scale_factor", "2",
+                     "-realworld_grid_spacing", "10",
+                     "-simplify", "0.5", "-precision", "1"]
+        outputs = []
+        with tempfile.TemporaryDirectory() as d:
+            for mode in [[], ["-stream"]]:
+                # The same file names in separate directories, since the
+                # command line is written into the output.
+                directory = os.path.join(d, str(len(outputs)))
+                os.mkdir(directory)
+                with open(os.path.join(directory, "in.svg"), "w") as f:
+                    f.write(self.svg)
+                subprocess.run([sys.executable, cleanup.__file__] +
+                               arguments + mode, cwd=directory, check=True,
+                               stdout=subprocess.DEVNULL)
+                with open(os.path.join(directory, "out.svg"), "r") as f:
+                    outputs.append(f.read())
+        self.assertEqual(outputs[0].replace(" -stream", ""),
+                         outputs[1].replace(" -stream", ""))
+        self.assertIn('class="style0"', outputs[0])
+        self.assertNotIn(">Out<", outputs[0])
+
+
+class TestWatcher (unittest.TestCase):
+    PAGE = '''<html><body>
+<object id="floor_plan_svg" data="plan.svg"></object>
+<script>load_and_draw_things(["furnashings/a.json"]);</script>
+</body></html>
+'''
+
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.facilities = os.path.join(self.temp.name, "Facilities")
+        for facility in ["Shop", "Other"]:
+            os.makedirs(os.path.join(self.facilities, facility, "furnashings"))
+            self.write(os.path.join(facility, "floor_plan.html"), self.PAGE)
+            self.write(os.path.join(facility, "plan.svg"), "<svg/>")
+            self.write(os.path.join(facility, "furnashings", "a.json"), "[]")
+        self.directory = unittest.mock.patch.object(
+            build, "FACILITIES_DIRECTORY", self.facilities)
+        self.directory.start()
+        self.events = web_server.EventBroadcaster()
+        self.received = queue.Queue()
+        self.events.clients.add(self.received)
+        self.watcher = web_server.Watcher(self.events, 0, self.temp.name)
+        self.watcher.tools = []
+        self.watcher.rebuild = unittest.mock.Mock()
+
+    def tearDown(self):
+        self.directory.stop()
+        self.temp.cleanup()
+
+    def write(self, name, text):
+        with open(os.path.join(self.facilities, name), "w") as f:
+            f.write(text)
+
+    def test_furnishing_file_changed(self):
+        '''Changing a furnishing file rebuilds its facility and reloads
+        that facility's pages.'''
+        before = self.watcher.poll(None)
+        self.write(os.path.join("Shop", "furnashings", "a.json"),
+                   '[{"name": "saw"}]')
+        self.watcher.poll(before)
+        self.watcher.rebuild.assert_called_once_with({"Shop"})
+        self.assertEqual(self.received.get_nowait(),
+                         ("reload", "/Facilities/Shop/"))
+        self.assertTrue(self.received.empty())
+
+    def test_outputs_ignored(self):
+        '''Writing the files that building writes doesn't rebuild.'''
+        before = self.watcher.poll(None)
+        self.write(os.path.join("Shop", "placed_floor_plan.html"), "x")
+        self.write(os.path.join("Other", "search_index.json"), "{}")
+        self.watcher.poll(before)
+        self.watcher.rebuild.assert_not_called()
+        self.assertTrue(self.received.empty())
+
+    def test_tools_changed(self):
+        '''Changing a tool rebuilds and reloads everything.'''
+        tool = os.path.join(self.temp.name, "placement.js")
+        with open(tool, "w") as f:
+            f.write("")
+        self.watcher.tools = [tool]
+        before = self.watcher.poll(None)
+        with open(tool, "w") as f:
+            f.write("// changed")
+        self.watcher.poll(before)
+        self.watcher.rebuild.assert_called_once_with(None)
+        self.assertEqual(self.received.get_nowait(), ("reload", "*"))
+
+
+class TestBump (unittest.TestCase):
+    def setUp(self):
+        self.temp = tempfile.TemporaryDirectory()
+        self.directory = self.temp.name
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def read(self, path):
+        with open(path, "r") as f:
+            return f.read()
+
+    def test_read_moves(self):
+        csv_moves = self.write("moves.csv", "unique_id,x,y,dx,dy,rotation\n"
+                               "a,1,,,2.5,\n"
+                               "b,,,-3,,0.25\n")
+        json_moves = self.write("moves.json", json.dumps([
+            {"unique_id": "a", "x": 1, "dy": 2.5, "y": None},
+            {"unique_id": "b", "dx": "-3", "rotation": 0.25, "y": " "}]))
+        expected = [{"unique_id": "a", "x": 1, "dy": 2.5},
+                    {"unique_id": "b", "dx": -3, "rotation": 0.25}]
+        self.assertEqual(bump.read_moves(csv_moves), expected)
+        self.assertEqual(bump.read_moves(json_moves), expected)
+
+    def test_read_moves_without_unique_id(self):
+        for moves in [[{"x": 1}], [{"unique_id": "", "x": 1}], [["a", 1]],
+                      ["a"], {"unique_id": "a"}]:
+            self.assertRaises(ValueError, bump.read_moves,
+                              self.write("moves.json", json.dumps(moves)))
+
+    def test_absolute_wins(self):
+        item = {"x": 10, "y": 20}
+        bump.move_item(item, {"x": 1, "dx": 5, "dy": 5, "rotation": 0.5})
+        self.assertEqual(item, {"x": 1, "y": 25, "rotation": 0.5})
+
+    def test_main(self):
+        '''Only the files with items that moved are written, and ids that
+        weren't found are reported with exit status 1.'''
+        moved = self.write("moved.json", json.dumps(
+            [{"unique_id": "a", "x": 1, "y": 2},
+             {"unique_id": "b", "x": 3, "y": 4}]))
+        unmoved = self.write("unmoved.json", json.dumps(
+            [{"unique_id": "c", "x": 5, "y": 6}]))
+        moves = self.write("moves.csv", "unique_id,dx,dy\na,1,\nb,,1\n")
+        command = [sys.executable, bump.__file__,
+                   "-directory", self.directory, "-moves", moves]
+        p = subprocess.run(command, capture_output=True,
+                           universal_newlines=True)
+        self.assertEqual(p.returncode, 0, p.stderr)
+        self.assertEqual(p.stdout, "Updating %s\n" % moved)
+        self.assertEqual(json.loads(self.read(moved)),
+                         [{"unique_id": "a", "x": 2, "y": 2},
+                          {"unique_id": "b", "x": 3, "y": 5}])
+        p = subprocess.run(command[:-2] + ["-dx", "1", "c", "d", "e"],
+                           capture_output=True, universal_newlines=True)
+        self.assertEqual(p.returncode, 1)
+        self.assertEqual(p.stdout, "Updating %s\n" % unmoved)
+        self.assertEqual(p.stderr, "Not found: d e\n")
+        self.assertEqual(json.loads(self.read(unmoved)),
+                         [{"unique_id": "c", "x": 6, "y": 6}])
+
+
+class TestExport (unittest.TestCase):
+    export = load_script("export", "export.py")
+
+    def test_output_format(self):
+        output_format = self.export.output_format
+        self.assertEqual(output_format("a.csv"), ("csv", "a.csv"))
+        self.assertEqual(output_format("a.DB"), ("sqlite", "a.DB"))
+        self.assertEqual(output_format("tsv:everything.csv"),
+                         ("tsv", "everything.csv"))
+        self.assertEqual(output_format("c:/a.jsonl"), ("jsonl", "c:/a.jsonl"))
+        self.assertRaises(self.export.argparse.ArgumentTypeError,
+                          output_format, "a.xlsx")
+
+    def test_headings_for(self):
+        headings_for = self.export.headings_for
+        self.assertEqual([h.heading for h in headings_for(
+            self.export.DEFAULT_FIELDS)], ["name", "id", "width", "depth"])
+        self.assertIs(headings_for("all"), self.export.HEADINGS)
+        self.assertEqual([h.heading for h in headings_for("id, new_shop,")],
+                         ["id", "new_shop"])
+
+    def test_rows(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, "a.json")
+            with open(filename, "w") as f:
+                json.dump([{ "name": "bench", "unique_id": "b", "x": 1,
+                             "y": 2, "width": 3, "depth": 4,
+                             "new_shop": True },
+                           "not an item"], f)
+            records = list(self.export.records(filename))
+        self.assertEqual(len(records), 1)
+        headings = self.export.headings_for(
+            "name,width,x,minX,minY,maxX,maxY,new_shop")
+        rows = [[h.in_units(units).value(records[0]) for h in headings]
+                for units in ("feet", "inches")]
+        self.assertEqual(rows[0][:3], ["bench", 3, 1])
+        self.assertEqual(rows[1][:3], ["bench", 36, 12])
+        numpy.testing.assert_allclose(rows[0][3:7], [-0.5, 0, 2.5, 4],
+                                      atol=1e-9)
+        numpy.testing.assert_allclose(rows[1][3:7], [-6, 0, 30, 48],
+                                      atol=1e-9)
+        self.assertEqual(rows[1][7], True)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,5 +1,6 @@
 # Coordinate system transformations.
 
+import functools
 import re
 import math
 import numpy
@@ -51,6 +52,22 @@ class Transform(object):
              [sinA, cosA, 0],
              [0, 0, 1]]))
 
+    @classmethod
+    def skewX(cls, angle):
+        '''Angle specified in degrees.'''
+        return cls(numpy.array(
+            [[1, math.tan(angle / cls.DEGREES_PER_RADIAN), 0],
+             [0, 1, 0],
+             [0, 0, 1]]))
+
+    @classmethod
+    def skewY(cls, angle):
+        '''Angle specified in degrees.'''
+        return cls(numpy.array(
+            [[1, 0, 0],
+             [math.tan(angle / cls.DEGREES_PER_RADIAN), 1, 0],
+             [0, 0, 1]]))
+
     def __init__(self, matrix):
         self.matrix = matrix
 
@@ -67,27 +84,63 @@ class Transform(object):
     def inverse(self):
         return Transform(numpy.linalg.inv(self.matrix))
 
+    def max_stretch(self):
+        '''Returns the most that the transform lengthens any distance.'''
+        return float(numpy.linalg.norm(self.matrix[:2, :2], 2))
+
     # matrix(0.06,0,0,0.06,7,7)
-    TRANSFORM_REGEXP = re.compile("(?P<type>[a-zA-Z-_]+)[(](?P<args>[^)]*)[)]")
+    TRANSFORM_REGEXP = re.compile(
+        r"[\s,]*(?P<type>[a-zA-Z-_]+)\s*[(](?P<args>[^)]*)[)][\s,]*")
+
+    NUMBER_REGEXP = re.compile(
+        r"[-+]?(?:[0-9]+[.]?[0-9]*|[.][0-9]+)(?:[eE][-+]?[0-9]+)?")
 
     @classmethod
-    def parseSVG(cls, transform_string):
-        '''Parse an SVG trransform attribute.  Returns a Transform.'''
-        # *** Does not yet consider multiple transformations in a single attribute string.
-        m = cls.TRANSFORM_REGEXP.match(transform_string)
-        if not m:
-            return
-        args = [float(x.strip()) for x in m.group("args").replace(" ", ",").split(",")]
-        if m.group("type") == "matrix":
+    def _parse_one(cls, type, args):
+        if type == "matrix" and len(args) == 6:
             return cls.matrix(*args)
-        if m.group("type") == "translate":
-            return cls.translate(*args)
-        if m.group("type") == "scale":
-            return cls.scale(*args)
-        if m.group("type") == "rotate":
+        if type == "translate" and len(args) in (1, 2):
+            return cls.translate(args[0], args[1] if len(args) > 1 else 0)
+        if type == "scale" and len(args) in (1, 2):
+            return cls.scale(args[0], args[-1])
+        if type == "rotate" and len(args) == 1:
             return cls.rotate(*args)
-        print("Unsupported transform %s" % transform_string)
-        return
+        if type == "rotate" and len(args) == 3:
+            # Rotation about the point cx, cy.
+            angle, cx, cy = args
+            return cls.translate(cx, cy).compose(
+                cls.rotate(angle)).compose(cls.translate(-cx, -cy))
+        if type == "skewX" and len(args) == 1:
+            return cls.skewX(*args)
+        if type == "skewY" and len(args) == 1:
+            return cls.skewY(*args)
+        return None
+
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def parseSVG(cls, transform_string):
+        '''Parse an SVG trransform attribute, which can be a list of
+        transformations.  Returns a Transform.  The same Transform is
+        returned for repeated calls with the same string, so it must not
+        be modified.'''
+        result = None
+        position = 0
+        while position < len(transform_string):
+            m = cls.TRANSFORM_REGEXP.match(transform_string, position)
+            if not m:
+                break
+            t = cls._parse_one(m.group("type"),
+                               [float(x) for x in cls.NUMBER_REGEXP.findall(
+                                   m.group("args"))])
+            if t is None:
+                break
+            # Transformations in a list are applied right to left.
+            result = t if result is None else result.compose(t)
+            position = m.end()
+        if position < len(transform_string) and transform_string.strip():
+            print("Unsupported transform %s" % transform_string)
+            return
+        return result
 
     def toSVG(self):
         a = self.matrix[0][0]
@@ -111,12 +164,27 @@ class Transform(object):
         return "matrix(%f,%f,%f,%f,%f,%f)" % (a, b, c, d, e, f)
 
     def apply(self, point):
-        '''Applies the transform to the point, returning a point that satisfies isPoint.'''
-        if isPoint(point):
-            return numpy.matmul(self.matrix, point)
+        '''Applies the transform to the point, returning a point that satisfies isPoint.
+        point can also be a complex number.'''
         if isinstance(point, complex):
-            return self.apply(cToV(point))
-        assert False, "Unsupported point type: %r" % point
+            point = (point.real, point.imag, 1)
+        return numpy.matmul(self.matrix, point)
+
+    def apply_many(self, points):
+        '''Applies the transform to many points at once.  points can be an
+        (N,3) array of points that satisfy isPoint, an (N,2) array of X and
+        Y coordinates, or an array of complex numbers.  The result has the
+        same representation as points.'''
+        points = numpy.asarray(points)
+        m = self.matrix
+        if numpy.iscomplexobj(points):
+            x = points.real
+            y = points.imag
+            return ((m[0][0] * x + m[0][1] * y + m[0][2]) +
+                    (m[1][0] * x + m[1][1] * y + m[1][2]) * 1j)
+        if points.shape[-1] == 3:
+            return points @ numpy.transpose(m)
+        return points @ numpy.transpose(m[:2, :2]) + m[:2, 2]
 
     def compose(self, other):
         return Transform(numpy.matmul(self.matrix, other.matrix))
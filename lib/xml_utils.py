@@ -4,17 +4,25 @@
 import xml.dom
 
 
-def do_elements(node, fun):
-    def walk(node):
-        if node.nodeType != xml.dom.Node.ELEMENT_NODE:
-            return
-        fun(node)
-        for n in node.childNodes:
-            walk(n)
+def do_elements(node, *funs):
+    '''Call each of funs on node, if it is an element, and on each of its
+    descendant elements, in document order.  All of the funs are applied
+    to an element before any of its children are visited, so several
+    independent visitors can share a single walk of the tree.  funs may
+    change the attributes of the element they are given, or its
+    children, but not its ancestors or siblings.'''
     if node.nodeType == xml.dom.Node.DOCUMENT_NODE:
-        walk(node.documentElement)
-    else:
-        walk(node)
+        node = node.documentElement
+    # An explicit stack rather than recursion, so that deeply nested
+    # documents don't exceed the recursion limit.
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.nodeType != xml.dom.Node.ELEMENT_NODE:
+            continue
+        for fun in funs:
+            fun(node)
+        stack.extend(reversed(node.childNodes))
 
 
 def write_pretty(document, filepath):
@@ -26,14 +34,176 @@ def write_pretty(document, filepath):
 def getElementById(doc, id):
     '''The getDocumentById methods in xml.dom depend on having a
     document schema that identifies an ID attribute..  This function
-    is a workaround for that.'''
-    found = []
-    def f(node):
-        eid = node.getAttribute("id")
-        if eid and eid == id:
-            found.append(node)
-    do_elements(doc.documentElement, f)
-    if len(found) == 1:
-        return found[0]
-    return None
+    is a workaround for that.  It uses the document's ElementIds index.'''
+    return element_ids(doc).get(id)
+
+
+class ElementIds (object):
+    '''ElementIds indexes the elements of a document by their id
+    attributes.  It is built with a single walk of the document and
+    updated by set_element_id and remove_element.  It also marks each id
+    attribute as an ID attribute, so that the document's own
+    getElementById method can find the element.'''
+    def __init__(self, doc):
+        self.doc = doc
+        # Maps id to a list of elements, since a document might
+        # erroneously use the same id more than once.
+        self.elements = {}
+        do_elements(doc, self.add)
+
+    def add(self, element):
+        '''Index element if it has an id.'''
+        id = element.getAttribute("id")
+        if not id:
+            return
+        element.setIdAttribute("id")
+        elements = self.elements.setdefault(id, [])
+        if not element in elements:
+            elements.append(element)
+
+    def discard(self, element):
+        '''Forget element.'''
+        id = element.getAttribute("id")
+        elements = self.elements.get(id)
+        if elements and element in elements:
+            elements.remove(element)
+            if not elements:
+                del self.elements[id]
+
+    def _current(self, element, id):
+        '''Returns True iff element still has id and is still in the
+        document.  This covers elements that were changed or removed
+        without telling us.'''
+        if element.getAttribute("id") != id:
+            return False
+        node = element
+        while node.parentNode is not None:
+            node = node.parentNode
+        return node is self.doc
+
+    def get(self, id):
+        '''Returns the element whose id is id, or None if there isn't
+        exactly one such element.'''
+        elements = self.elements.get(id)
+        if not elements:
+            return None
+        current = [e for e in elements if self._current(e, id)]
+        if len(current) != len(elements):
+            self.elements[id] = current
+        if len(current) == 1:
+            return current[0]
+        return None
+
+
+def element_ids(doc):
+    '''Returns the ElementIds index of doc, creating it if necessary.'''
+    ids = getattr(doc, "element_ids", None)
+    if ids is None:
+        ids = ElementIds(doc)
+        doc.element_ids = ids
+    return ids
+
+
+def set_element_id(element, id):
+    '''Set the id of element, which should already be in its document,
+    and record it in the document's ElementIds index.'''
+    ids = getattr(element.ownerDocument, "element_ids", None)
+    if ids:
+        ids.discard(element)
+    element.setAttribute("id", id)
+    if ids:
+        ids.add(element)
+    else:
+        element.setIdAttribute("id")
+
+
+def remove_element(element):
+    '''Remove element from its parent and from the document's ElementIds
+    index.'''
+    ids = getattr(element.ownerDocument, "element_ids", None)
+    if ids:
+        do_elements(element, ids.discard)
+    element.parentNode.removeChild(element)
+
+
+def escape_xml(data):
+    '''Escape data for use as XML text or a double quoted attribute value.'''
+    return (data.replace("&", "&amp;").replace("<", "&lt;")
+            .replace("\"", "&quot;").replace(">", "&gt;"))
+
+
+class PrettyXMLWriter (object):
+    '''PrettyXMLWriter writes XML to a file incrementally, as a sequence of
+    start, end, text and comment events, formatted the way write_pretty
+    formats a whole document.  Whitespace-only text is dropped.'''
+    def __init__(self, file, addindent="  ", newl="\n"):
+        self.file = file
+        self.addindent = addindent
+        self.newl = newl
+        self.depth = 0
+        # True if the most recent start tag has not yet been closed
+        # with ">" because we don't yet know whether it has content.
+        self.unclosed = False
+        self.pending_text = None
+
+    def _indent(self):
+        return self.addindent * self.depth
+
+    def _close_start_tag(self, newline=True):
+        if self.unclosed:
+            self.file.write(">" + (self.newl if newline else ""))
+            self.unclosed = False
+
+    def _flush_text(self):
+        if self.pending_text is None:
+            return
+        text = self.pending_text
+        self.pending_text = None
+        self._close_start_tag()
+        self.file.write(self._indent() + escape_xml(text) + self.newl)
+
+    def declaration(self):
+        self.file.write('<?xml version="1.0" ?>' + self.newl)
+
+    def start(self, name, attributes):
+        '''attributes is a dict mapping qualified name to value.'''
+        self._flush_text()
+        self._close_start_tag()
+        self.file.write(self._indent() + "<" + name)
+        for a, v in attributes.items():
+            self.file.write(" %s=\"%s\"" % (a, escape_xml(v)))
+        self.unclosed = True
+        self.depth += 1
+
+    def end(self, name):
+        self.depth -= 1
+        if self.unclosed:
+            if self.pending_text is None:
+                self.file.write("/>" + self.newl)
+            else:
+                # Text is the only content.  Write it inline.
+                self.file.write(">" + escape_xml(self.pending_text) +
+                                "</%s>%s" % (name, self.newl))
+                self.pending_text = None
+            self.unclosed = False
+            return
+        self._flush_text()
+        self.file.write(self._indent() + "</%s>%s" % (name, self.newl))
+
+    def text(self, data):
+        if not data.strip():
+            return
+        self._flush_text()
+        self.pending_text = data
+
+    def comment(self, data):
+        self._flush_text()
+        self._close_start_tag()
+        self.file.write("%s<!--%s-->%s" % (self._indent(), data, self.newl))
 
+    def nodes(self, nodes):
+        '''Write the xml.dom nodes at the current level.'''
+        self._flush_text()
+        self._close_start_tag()
+        for node in nodes:
+            node.writexml(self.file, self._indent(), self.addindent, self.newl)
@@ -5,9 +5,12 @@
 # and lists the things.
 
 # This script is made obsolete by a working version of placement.js.
+# build.py still uses merge to make a merged copy of each facility's
+# floor plan pages.
 
 import json
 import os.path
+import re
 import sys
 import xml.dom
 import xml.dom.minidom
@@ -20,6 +23,7 @@ sys.path.insert(
         os.path.dirname(os.path.abspath(__file__)),
         "lib"))
 
+from atomic_file import *
 from transform import *
 from xml_utils import *
 from stylesheet import *
@@ -44,38 +48,61 @@ THING_STYLES= '''
 }
 '''
 
-def merge_svg(doc):
-  svgdoc = xml.dom.minidom.parse(FLOOR_PLAN)
-  for object in doc.getElementsByTagName("object"):
-    if object.getAttribute("data") == "floor_plan.svg":
-      object.parentNode.insertBefore(svgdoc.documentElement, object)
-      object.parentNode.removeChild(object)
-      break
+# The floor plan pages are HTML rather than XML, so they are merged as
+# text.
+OBJECT_REGEXP = re.compile(
+  r'<object\b[^>]*\bid="floor_plan_svg"[^>]*>.*?</object>', re.DOTALL)
 
+SCRIPT_REGEXP = re.compile(
+  r'<script\b[^>]*\bsrc="[^"]*placement.js"[^>]*>\s*</script>', re.DOTALL)
 
-def merge_javascript(doc):
-  with open(JAVASCRIPT, "r") as f:
+
+XML_DECLARATION_REGEXP = re.compile(r'^\s*<\?xml[^>]*\?>\s*')
+
+
+def merge_svg(html, floor_plan):
+  '''Replace the floor_plan_svg object element in the text html with
+  the SVG file floor_plan.'''
+  with open(floor_plan, "r") as f:
+    svg = XML_DECLARATION_REGEXP.sub("", f.read(), count=1)
+  return OBJECT_REGEXP.sub(lambda m: svg, html, count=1)
+
+
+def merge_javascript(html, javascript, things_files):
+  '''Replace the placement.js script element in the text html with
+  the contents of javascript, preceded by THINGS, the things from each
+  of the JSON files things_files.'''
+  with open(javascript, "r") as f:
     js = f.read()
-  with open(THINGS, "r") as f:
-    things = f.read()
-  for script in doc.getElementsByTagName("script"):
-    if script.getAttribute("src") == "placement.js":
-      script.removeAttribute("src");
-      script.appendChild(doc.createTextNode("//"))
-      script.appendChild(doc.createCDATASection(
-          "\nTHINGS = " + things + ";\n\n" + js + "\n//"))
-      break
+  things = []
+  for things_file in things_files:
+    with open(things_file, "r") as f:
+      things.extend(json.load(f))
+  script = ('<script type="text/javascript">//<![CDATA[\nTHINGS = ' +
+            json.dumps(things, indent=2).replace("</", "<\\/") +
+            ";\n\n" + js + "\n//]]></script>")
+  return SCRIPT_REGEXP.sub(lambda m: script, html, count=1)
+
+
+def merge_styles(html):
+  return html.replace(
+    "</head>",
+    '<style id="thing-styles">' + THING_STYLES + "</style>\n</head>", 1)
+
+
+def merge(html_template, javascript, floor_plan, things_files, output):
+  with open(html_template, "r") as f:
+    html = f.read()
+  html = merge_svg(html, floor_plan)
+  html = merge_javascript(html, javascript, things_files)
+  html = merge_styles(html)
+  with atomic_open(output, "w") as f:
+    f.write(html)
 
 
 def main():
-  doc = xml.dom.minidom.parse(HTML_TEMPLATE)
-  merge_svg(doc)
-  merge_javascript(doc)
-  ensure_stylesheet(doc, "thing-styles").appendChild(doc.createTextNode(THING_STYLES))
-  write_pretty(doc, OUTPUT)
+  merge(HTML_TEMPLATE, JAVASCRIPT, FLOOR_PLAN, [THINGS], OUTPUT)
     
 
 if __name__ == "__main__":
   main()
-
-
@@ -1,12 +1,24 @@
-# This script places the things described in furnashings/things.json
-# onto floor_plan_cleanup/cleaned_up.svg to produce a static
-# floor_plan.svg file.  This is an interim measure until I can get
-# things running as a web service.
+# This script prerenders a floor plan page: it places the things
+# described in the page's JSON files onto its SVG floor plan, drawing
+# each as placement.js's draw_thing would, and writes a copy of the
+# page that shows that SVG file and already has the item list that
+# placement.js's update_items_list would make.  The page is then
+# usable before any JavaScript runs.  Once placement.js has loaded the
+# things it replaces their prerendered drawings with its own, so that
+# they show the things as they are now, and removes the drawings of
+# things that it didn't load.
+#
+# The prerendered pages are only for local use.  They aren't committed,
+# so they aren't part of the published site.
 
-# Now that placement.js is working, this script is no longer needed.
+# build.py runs this for each facility's floor plan pages.  Run on its
+# own, it places the things in furnashings/things.json onto
+# floor_plan_cleanup/cleaned_up.svg to produce floor_plan.svg.
 
+import html
 import json
 import os.path
+import re
 import sys
 import xml.dom
 import xml.dom.minidom
@@ -19,6 +31,7 @@ sys.path.insert(
         os.path.dirname(os.path.abspath(__file__)),
         "lib"))
 
+from atomic_file import *
 from transform import *
 from xml_utils import *
 from stylesheet import *
@@ -38,32 +51,162 @@ THING_STYLES= '''
 '''
 
 
-def main():
-  doc = xml.dom.minidom.parse(INPUT)
+def is_number(x):
+  return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+
+def number(x):
+  '''Format the number x the way JavaScript would.'''
+  if isinstance(x, float) and x.is_integer():
+    x = int(x)
+  return str(x)
+
+
+def rotation(thing):
+  '''Returns the rotation of thing as a fraction of a circle.'''
+  try:
+    return float(thing.get("rotation", 0))
+  except (TypeError, ValueError):
+    return 0
+
+
+def thing_transform(thing):
+  '''The transform attribute that draw_thing in placement.js gives the
+  group of thing.'''
+  x = number(thing["x"])
+  y = number(thing["y"])
+  return ("rotate(" + number(rotation(thing) * 360) + ", " + x + ", " + y +
+          ")" + "translate(" + x + ", " + y + ")")
+
+
+def place_thing(doc, real_world, thing):
+  '''Add the drawing of thing to the real_world group of doc, like
+  draw_thing in placement.js.  Things that placement.js can't draw
+  without more information, or that lack a unique_id to find them by,
+  are left for placement.js.  Returns the group of the thing, or None.'''
+  if not (is_number(thing.get("x")) and is_number(thing.get("y"))):
+    return None
+  if thing.get("unique_id") in (None, ""):
+    return None
+  path_d = thing.get("path_d")
+  if not path_d and not (is_number(thing.get("width")) and
+                         is_number(thing.get("depth"))):
+    return None
+  g = doc.createElement("g")
+  css_class = str(thing.get("cssClass", ""))
+  g.setAttribute("class", css_class)
+  g.setAttribute("id", str(thing["unique_id"]))
+  g.setAttribute("data-prerendered", "true")
+  if path_d:
+    shape = doc.createElement("path")
+    shape.setAttribute("d", path_d)
+    g.appendChild(shape)
+  else:
+    shape = doc.createElement("rect")
+    shape.setAttribute("width", number(thing["width"]))
+    shape.setAttribute("height", number(thing["depth"]))
+    shape.setAttribute("x", number(- thing["width"] / 2))
+    shape.setAttribute("y", number(- thing["depth"] / 2))
+    direction_tick = doc.createElement("path")
+    direction_tick.setAttribute("class", "direction-indicator")
+    direction_tick.setAttribute("d",
+                                "M 0 0 v " + number(- thing["depth"] / 2))
+    g.appendChild(shape)
+    g.appendChild(direction_tick)
+  title = doc.createElement("title")
+  title.appendChild(doc.createTextNode(str(thing.get("name", ""))))
+  shape.appendChild(title)
+  shape.setAttribute("class", css_class)
+  g.setAttribute("transform", thing_transform(thing))
+  real_world.appendChild(g)
+  return g
+
+
+def read_things(things_files):
+  things = []
+  for things_file in things_files:
+    with open(things_file, "r") as f:
+      things.extend([t for t in json.load(f) if isinstance(t, dict)])
+  return things
+
+
+def place_things(input_file, things_files, output_file):
+  '''Write output_file: the SVG floor plan input_file with the things
+  from each of the JSON files things_files placed on it.  Returns the
+  list of things.'''
+  doc = xml.dom.minidom.parse(input_file)
   real_world = getElementById(doc, "real-world")
+  if not real_world:
+    raise Exception("%s has no real-world group" % input_file)
   stylesheet = ensure_stylesheet(doc, "thing-styles")
   stylesheet.appendChild(doc.createTextNode(THING_STYLES))
-  with open(THINGS, "r") as f:
-    things = json.load(f)
+  things = read_things(things_files)
   for thing in things:
-    print(thing["name"])
-    rect = doc.createElement("rect")
-    real_world.appendChild(rect)
-    title = doc.createElement("title")
-    title.appendChild(doc.createTextNode(thing["name"]))
-    rect.appendChild(title)
-    rect.setAttribute("class", thing["cssClass"])
-    rect.setAttribute("width", str(thing["width"]))
-    rect.setAttribute("height", str(thing["depth"]))
-    rect.setAttribute("x", str(- thing["width"] / 2))
-    rect.setAttribute("y", str(- thing["depth"] / 2))
-    rect.setAttribute("transform",
-                      Transform.rotate(thing["rotation"]).toSVG() + " " +
-                      Transform.translate(thing["x"], thing["y"]).toSVG())
-  write_pretty(doc, OUTPUT)
+    place_thing(doc, real_world, thing)
+  with atomic_output(output_file) as temp:
+    write_pretty(doc, temp)
+  return things
+
+
+def item_html(item, top_level):
+  '''The HTML that update_items_list in placement.js makes for item.'''
+  if isinstance(item, str):
+    item = { "name": item }
+  name = html.escape(str(item.get("name", "")), quote=False)
+  if top_level:
+    # Like placement.js, which links things without a unique_id to
+    # "#undefined".
+    unique_id = item.get("unique_id")
+    id = html.escape("undefined" if unique_id is None else str(unique_id))
+    data = "" if unique_id is None else ' data-unique-id="%s"' % id
+    text = ('<div class="item"%s><a href="#%s" '
+            'onclick="select_item(\'%s\')">%s</a>' % (data, id, id, name))
+  else:
+    text = '<div class="item">' + name
+  contents = item.get("contents")
+  if contents:
+    text += ('<div class="container">' +
+             "".join([item_html(c, False) for c in contents]) +
+             "</div>")
+  return text + "</div>"
+
+
+def items_list_html(things):
+  '''The HTML of the item list of things, sorted by name as
+  placement.js does.'''
+  things = sorted(things, key=lambda t: str(t.get("name", "")))
+  return "\n".join([item_html(t, True) for t in things])
+
+
+OBJECT_REGEXP = re.compile(
+  r'(<object\b[^>]*\bid="floor_plan_svg"[^>]*\bdata=")[^"]*(")', re.DOTALL)
+
+ITEMS_REGEXP = re.compile(r'<div id="items">\s*</div>')
+
+
+def prerender(html_template, input_file, things_files, output_svg,
+              output_html):
+  '''Write output_svg, the SVG file input_file with the things of
+  things_files placed on it, and output_html, a copy of the page
+  html_template that shows output_svg and includes the item list.'''
+  things = place_things(input_file, things_files, output_svg)
+  with open(html_template, "r") as f:
+    page = f.read()
+  svg_url = os.path.relpath(output_svg, os.path.dirname(output_html))
+  page = OBJECT_REGEXP.sub(
+    lambda m: m.group(1) + html.escape(svg_url) + m.group(2), page, count=1)
+  items = items_list_html(things)
+  page = ITEMS_REGEXP.sub(
+    lambda m: ('<div id="items" data-prerendered="true">\n' + items +
+               "\n</div>"),
+    page, count=1)
+  with atomic_open(output_html, "w") as f:
+    f.write(page)
+
+
+def main():
+  place_things(INPUT, [THINGS], OUTPUT)
     
 
 if __name__ == "__main__":
   main()
-
-
@@ -2,9 +2,25 @@
 
 // Place things onto the floorplan.
 
-// Called to handle the window.onload event
-function load_and_draw_things(paths) {
-  Promise.all(paths.map(fetch_things)).then(function() {
+// Called to handle the window.onload event.  If bundle_path is
+// specified the things are loaded from that furnishings bundle (see
+// lib/bundle.py) in one request.  If the bundle can't be loaded, they
+// are loaded from the JSON files listed in paths.
+function load_and_draw_things(paths, bundle_path) {
+  let fetch_all = function() {
+    return Promise.all(paths.map(fetch_things));
+  };
+  let loaded;
+  if (bundle_path) {
+    loaded = fetch_bundle(bundle_path).catch(function(error) {
+      console.log(error);
+      return fetch_all();
+    });
+  } else {
+    loaded = fetch_all();
+  }
+  loaded.then(function() {
+    remove_prerendered_things();
     ALL_THINGS.sort(sort_item_item_compare);
     update_items_list(ALL_THINGS);
     if (document.location.hash) {
@@ -12,10 +28,29 @@ function load_and_draw_things(paths) {
     }
     add_download_link();
   }, console.log);
+  let facility = facility_url(paths[0]);
+  if (facility) {
+    load_search_index(facility + "search_index.json");
+  }
   let svgdoc = document.getElementById("floor_plan_svg").contentDocument;
   svgdoc.addEventListener("mousemove", Show_event_location);
 }
 
+// Returns the URL of the directory of the facility that the things
+// file path is in, or null if it isn't in one.  The facility's search
+// index is there, whichever directory the page is in.
+function facility_url(path) {
+  if (!path) {
+    return null;
+  }
+  let url = new URL(path, document.baseURI);
+  let m = url.pathname.match(/^(.*\/Facilities\/[^\/]+\/)/);
+  if (!m) {
+    return null;
+  }
+  return url.origin + m[1];
+}
+
 function sort_item_item_compare(item1, item2) {
   let name1 = item1.name;
   let name2 = item2.name;
@@ -36,10 +71,7 @@ function fetch_things(path) {
           let things = JSON.parse(txt);
           for (let thing of things) {
             thing.from_file = response.url;
-            ALL_THINGS.push(thing);
-            if (!thing.unique_id) {
-              thing["unique_id"] = ALL_THINGS.length;
-            }
+            add_thing(thing);
           }
           draw_things(things, path);
         }
@@ -52,8 +84,52 @@ function fetch_things(path) {
   });
 }
 
+function fetch_bundle(path) {
+  return fetch(path).then(function(response) {
+    if (!response.ok) {
+      throw (path + ": " + response.statusText);
+    }
+    return response.json().then(function(bundle) {
+      let things = decode_bundle(bundle, response.url);
+      for (let thing of things) {
+        add_thing(thing);
+      }
+      draw_things(things, path);
+      return true;
+    });
+  });
+}
+
+// Returns the list of things in the furnishings bundle that was
+// loaded from url.
+function decode_bundle(bundle, url) {
+  let columns = bundle.columns;
+  let dictionaries = bundle.dictionaries;
+  let things = [];
+  for (let i = 0; i < bundle.count; i++) {
+    let thing = Object.assign({}, bundle.other[i]);
+    for (let name in columns) {
+      let value = columns[name][i];
+      if (value === null)
+        continue;
+      if (name in dictionaries)
+        value = dictionaries[name][value];
+      thing[name] = value;
+    }
+    thing.from_file = new URL(thing.from_file, url).href;
+    things.push(thing);
+  }
+  return things;
+}
+
 function update_items_list(items) {
   let list_elt = document.getElementById("items");
+  if (list_elt.hasAttribute("data-prerendered")) {
+    // The list was made by place_things.py.
+    list_elt.removeAttribute("data-prerendered");
+    if (hydrate_items_list(list_elt, items))
+      return;
+  }
   make_empty(list_elt);
   let do_list = function(container, things) {
     // things is a list containing item objects and strings.
@@ -91,14 +167,146 @@ function update_items_list(items) {
   do_list(list_elt, items);
 }
 
+// Connect items to the elements of the prerendered item list list_elt.
+// Returns false, changing nothing, if the list doesn't match items.
+function hydrate_items_list(list_elt, items) {
+  let elements = list_elt.children;
+  if (elements.length != items.length)
+    return false;
+  for (let i = 0; i < items.length; i++) {
+    let id = items[i].unique_id;
+    if (elements[i].getAttribute("data-unique-id") !==
+        (id == null ? null : "" + id))
+      return false;
+  }
+  let hydrate_item = function(item, elt) {
+    item.list_element = elt;
+    if (!(item.contents && item.contents.length > 0))
+      return;
+    let children = elt.lastElementChild.children;
+    for (let i = 0; i < item.contents.length; i++) {
+      if (typeof(item.contents[i]) === "string") {
+        item.contents[i] = {
+          "name": item.contents[i]
+        };
+      }
+      hydrate_item(item.contents[i], children[i]);
+    }
+  };
+  for (let i = 0; i < items.length; i++) {
+    hydrate_item(items[i], elements[i]);
+  }
+  return true;
+}
+
 function filter_items_list(filter_string) {
-  // Initially we just test for mindless substring inclusion.
+  // Things that the search index says match are shown, as are items
+  // whose names contain filter_string, like the drawers of a cabinet.
   filter_string = filter_string.toLowerCase();
+  let matches = SEARCH_INDEX && search_index_matches(SEARCH_INDEX,
+                                                     filter_string);
   filter_items_list_(function(item) {
+    if (matches && matches.has("" + item.unique_id))
+      return true;
     return item.name.toLowerCase().indexOf(filter_string) >= 0;    
   });
 }
 
+// The facility's search index, made by build.py (see
+// lib/search_index.py), once it has been loaded.
+var SEARCH_INDEX = null;
+
+function load_search_index(path) {
+  return fetch(path).then(function(response) {
+    if (!response.ok) {
+      throw (path + ": " + response.statusText);
+    }
+    return response.json().then(function(index) {
+      SEARCH_INDEX = index;
+    });
+  }).catch(console.log);
+}
+
+// Returns the Set of the unique_ids of the things in the search index
+// that match each word of query exactly, as a prefix or approximately.
+// This follows SearchIndex.search in lib/search_index.py.
+function search_index_matches(index, query) {
+  let words = query.toLowerCase().match(/[a-z0-9]+/g);
+  if (!words)
+    return null;
+  let result = null;
+  for (let word of words) {
+    let documents = new Set();
+    for (let t of search_index_terms(index, word)) {
+      for (let posting of index.postings[t]) {
+        documents.add(posting[0]);
+      }
+    }
+    if (result == null) {
+      result = documents;
+    } else {
+      result = new Set([...result].filter(d => documents.has(d)));
+    }
+  }
+  let ids = new Set();
+  for (let d of result) {
+    ids.add("" + index.documents[d].unique_id);
+  }
+  return ids;
+}
+
+// Returns the indices of the terms of the search index that match word.
+function search_index_terms(index, word) {
+  let terms = index.terms;
+  let matches = [];
+  // Terms that word is a prefix of are contiguous.
+  let low = 0;
+  let high = terms.length;
+  while (low < high) {
+    let middle = (low + high) >> 1;
+    if (terms[middle] < word)
+      low = middle + 1;
+    else
+      high = middle;
+  }
+  for (let i = low; i < terms.length && terms[i].startsWith(word); i++) {
+    matches.push(i);
+  }
+  let grams = trigrams(word);
+  let candidates = new Set();
+  for (let g of grams) {
+    for (let i of (index.trigrams[g] || [])) {
+      candidates.add(i);
+    }
+  }
+  for (let i of candidates) {
+    if (!terms[i].startsWith(word) &&
+        trigram_similarity(grams, trigrams(terms[i])) >=
+        index.fuzzy_threshold) {
+      matches.push(i);
+    }
+  }
+  return matches;
+}
+
+function trigrams(word) {
+  let padded = " " + word + " ";
+  let grams = new Set();
+  for (let i = 0; i < padded.length - 2; i++) {
+    grams.add(padded.substring(i, i + 3));
+  }
+  return grams;
+}
+
+function trigram_similarity(grams1, grams2) {
+  let shared = 0;
+  for (let g of grams1) {
+    if (grams2.has(g))
+      shared += 1;
+  }
+  return 2 * shared / (grams1.size + grams2.size);
+}
+
 function filter_items_list_(filter) {
   function show(item) {
     let elt = item.list_element;
@@ -166,14 +374,22 @@ function draw_things(things, from_path) {
 }
 
 function draw_thing(svgdoc, g, thing) {
+  // If place_things.py has drawn it, its drawing is shown until it's
+  // replaced by this one, which is drawn from the thing as it is now.
+  let prerendered = svgdoc.getElementById(thing_svg_id(thing));
+  if (!(prerendered && prerendered.hasAttribute("data-prerendered")))
+    prerendered = null;
+  if (!(isNumber(thing.x) && isNumber(thing.y))) {
+    if (prerendered)
+      prerendered.remove();
+    return;
+  }
   let thing_group = svgdoc.createElementNS(g.namespaceURI, "g");
   thing_group.setAttribute("class", thing.cssClass);
   thing_group.setAttribute("id", thing_svg_id(thing));
   let shape;
   let title = svgdoc.createElementNS(g.namespaceURI, "title");
   title.textContent = thing.name;
-  if (!(isNumber(thing.x) && isNumber(thing.y)))
-    return;
   if (thing.path_d) {
     shape = svgdoc.createElementNS(g.namespaceURI, "path");
     shape.setAttribute("d", thing.path_d);
@@ -196,6 +412,28 @@ function draw_thing(svgdoc, g, thing) {
   shape.appendChild(title);
   // The vector-effect CSS property doesn't cascade.
   shape.setAttribute("class", thing.cssClass);
+  set_thing_onclick(shape, thing);
+  thing_group.setAttribute(
+    "transform",
+    "rotate(" + thing.rotation * 360 + ", " + thing.x + ", " + thing.y + ")" +
+      "translate(" + thing.x + ", " + thing.y + ")")
+  if (prerendered)
+    prerendered.replaceWith(thing_group);
+  else
+    g.appendChild(thing_group);
+  thing.svg_element = thing_group;
+}
+
+// Remove what place_things.py drew for things that weren't loaded,
+// like things that have since been deleted.
+function remove_prerendered_things() {
+  let svgdoc = document.getElementById("floor_plan_svg").contentDocument;
+  for (let elt of svgdoc.querySelectorAll("[data-prerendered]")) {
+    elt.remove();
+  }
+}
+
+function set_thing_onclick(shape, thing) {
   shape.onclick = function(event) {
     if (!event)
       event = window.event;
@@ -203,12 +441,6 @@ function draw_thing(svgdoc, g, thing) {
       return;
     thingRectClicked(thing);
   };
-  thing_group.setAttribute(
-    "transform",
-    "rotate(" + thing.rotation * 360 + ", " + thing.x + ", " + thing.y + ")" +
-      "translate(" + thing.x + ", " + thing.y + ")")
-  g.appendChild(thing_group);
-  thing.svg_element = thing_group;
 }
 
 function thing_svg_id(thing) {
@@ -217,15 +449,24 @@ function thing_svg_id(thing) {
 
 var ALL_THINGS = [];
 
-function getThing(id) {
-  for (let i = 0; i < ALL_THINGS.length; i++) {
-    let thing = ALL_THINGS[i];
-    if (thing.unique_id == id) {
-      return thing;
-    }
+// Maps the unique_id of each thing, as a string, to the thing.
+var THINGS_BY_ID = new Map();
+
+function add_thing(thing) {
+  ALL_THINGS.push(thing);
+  if (!thing.unique_id) {
+    thing["unique_id"] = ALL_THINGS.length;
+  }
+  let id = "" + thing.unique_id;
+  if (!THINGS_BY_ID.has(id)) {
+    THINGS_BY_ID.set(id, thing);
   }
 }
 
+function getThing(id) {
+  return THINGS_BY_ID.get("" + id);
+}
+
 var IFRAME;
 
 HobbyShop_clustermarket_id = 3665;
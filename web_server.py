@@ -1,23 +1,543 @@
 # A simple web server to use as a test pllatform.
 
 import sys
-assert sys.version_info >= (3, 2)
+assert sys.version_info >= (3, 7)
 
+import argparse
+import email.utils
+import hashlib
 import socket
 import http.server
 import html
+import io
+import json
 import logging
+import math
+import os
 import os.path
+import queue
+import re
+import subprocess
+import threading
+import time
 import xml.dom.minidom
+from http import HTTPStatus
 from urllib.parse import urlparse, parse_qs
 
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# What's the right way to load these?
+sys.path.insert(0, os.path.join(ROOT, "lib"))
+
+from search_index import SearchIndex
+from sources import changed_sources, read_sources
+from spatial_index import SpatialIndex
+
 
 def logger():
   return logging.getLogger(__name__)
 
 
-class NoCacheRequestHandler (http.server.SimpleHTTPRequestHandler):
+class FileInfo (object):
+  '''The response headers that depend on a file's contents.'''
+  def __init__(self, path, stat):
+    self.path = path
+    self.key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    self.size = stat.st_size
+    self.mtime = int(stat.st_mtime)
+    self.last_modified = email.utils.formatdate(self.mtime, usegmt=True)
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+      for block in iter(lambda: f.read(1 << 20), b""):
+        h.update(block)
+    self.etag = '"%s"' % h.hexdigest()[:32]
+
+
+class FileInfoCache (object):
+  '''FileInfoCache computes the FileInfo of a file once, and again only
+  when the file changes.'''
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.infos = {}
+
+  def get(self, path, stat):
+    key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with self.lock:
+      info = self.infos.get(path)
+    if info is None or info.key != key:
+      info = FileInfo(path, stat)
+      with self.lock:
+        self.infos[path] = info
+    return info
+
+
+FILE_INFO = FileInfoCache()
+
+
+RANGE_REGEXP = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+  '''Returns the (start, end) byte offsets, end exclusive, selected by
+  the Range header value header of a file of size bytes, None if the
+  whole file should be sent, or "unsatisfiable".  Requests for several
+  ranges are answered with the whole file.'''
+  m = RANGE_REGEXP.match(header.strip())
+  if not m or m.group(1) == m.group(2) == "":
+    return None
+  if m.group(1) == "":
+    # A suffix: the last so many bytes.
+    length = int(m.group(2))
+    if length == 0:
+      return "unsatisfiable"
+    return (max(size - length, 0), size)
+  start = int(m.group(1))
+  end = size if m.group(2) == "" else min(int(m.group(2)) + 1, size)
+  if start >= size or start >= end:
+    return "unsatisfiable"
+  return (start, end)
+
+
+################################################################################
+# Search
+
+FACILITIES_DIRECTORY = os.path.join(ROOT, "Facilities")
+
+SEARCH_INDEX = "search_index.json"
+
+SEARCH_PATH = "/search"
+
+
+class SearchIndexCache (object):
+  '''SearchIndexCache reads each search index file once, and again only
+  when it changes.'''
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.indices = {}
+
+  def get(self, path):
+    '''Returns the SearchIndex in the file path, or None if there isn't
+    one.'''
+    try:
+      stat = os.stat(path)
+    except OSError:
+      return None
+    key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    with self.lock:
+      cached = self.indices.get(path)
+      if cached is not None and cached[0] == key:
+        return cached[1]
+    index = SearchIndex.read(path)
+    with self.lock:
+      self.indices[path] = (key, index)
+    return index
+
+
+SEARCH_INDICES = SearchIndexCache()
+
+
+WHERE_PATH = "/where"
+
+# The page of a facility that WHERE_PATH asks about by default.
+DEFAULT_PAGE = "floor_plan.html"
+
+# The most nearest items that WHERE_PATH can be asked for.
+MAX_NEAREST = 100
+
+
+class SpatialIndexCache (object):
+  '''SpatialIndexCache makes the SpatialIndex of each floor plan page
+  once, and again only when the page, its SVG file or any of its JSON
+  files change.'''
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.indices = {}
+
+  def get(self, directory, html):
+    '''Returns the SpatialIndex of the floor plan page html in the
+    facility directory, or None if there's no such page.'''
+    # Only imported when needed, since it imports all of the tools.
+    from build import Page
+    try:
+      page = Page.read(directory, html)
+    except OSError:
+      return None
+    if page is None:
+      return None
+    key = []
+    for f in [page.html, page.svg] + page.things:
+      try:
+        stat = os.stat(os.path.join(directory, f))
+        key.append((f, stat.st_ino, stat.st_size, stat.st_mtime_ns))
+      except OSError:
+        key.append((f, None))
+    with self.lock:
+      cached = self.indices.get((directory, html))
+      if cached is not None and cached[0] == key:
+        return cached[1]
+    index = SpatialIndex.read(directory, page.svg, page.things)
+    with self.lock:
+      self.indices[(directory, html)] = (key, index)
+    return index
+
+
+SPATIAL_INDICES = SpatialIndexCache()
+
+
+################################################################################
+# Generated files
+
+BUNDLE_SUFFIX = ".bundle.json"
+
+
+def is_generated(path):
+  '''Returns True iff path is a generated JSON file that records the
+  files it was made from, see lib/sources.py.'''
+  return (path.endswith(BUNDLE_SUFFIX) or
+          os.path.basename(path) == SEARCH_INDEX)
+
+
+def stat_key(path):
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return None
+  return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class GeneratedFileCache (object):
+  '''GeneratedFileCache knows whether each generated file, like a
+  furnishings bundle or a search index, is current: made from its
+  sources as they are now.  That's only worked out again when the file
+  or one of its sources changes.'''
+  def __init__(self):
+    self.lock = threading.Lock()
+    # Maps the path of each generated file to (key, sources, current),
+    # where sources are the paths of the files it was made from.
+    self.files = {}
+
+  def is_current(self, path):
+    with self.lock:
+      cached = self.files.get(path)
+    if cached is not None:
+      key, sources, current = cached
+      if key == [stat_key(f) for f in [path] + sources]:
+        return current
+    directory = os.path.dirname(path)
+    try:
+      recorded = read_sources(path)
+    except (OSError, ValueError):
+      return False
+    if recorded is None:
+      # Made before generated files recorded their sources.
+      return False
+    sources = [os.path.join(directory, f) for f in sorted(recorded)]
+    key = [stat_key(f) for f in [path] + sources]
+    current = not changed_sources(recorded, directory)
+    with self.lock:
+      self.files[path] = (key, sources, current)
+    return current
+
+
+GENERATED_FILES = GeneratedFileCache()
+
+
+################################################################################
+# Serving files
+
+class FileRequestHandler (http.server.SimpleHTTPRequestHandler):
+  '''FileRequestHandler serves files with strong ETags and
+  Last-Modified headers, answers conditional requests with 304 Not
+  Modified, supports single byte Range requests and uses os.sendfile
+  to send file contents.  Clients are asked to revalidate every time
+  so they always see the current file.  A generated file that isn't
+  current, like a furnishings bundle, isn't served, so that the page
+  loads its JSON files instead.'''
+
+  # Keep connections open for the several requests of a page.
+  protocol_version = "HTTP/1.1"
+
+  # The Cache-Control header of file responses.  no-cache asks clients
+  # to revalidate, which costs them a 304 response when the file hasn't
+  # changed.
+  cache_control = "no-cache"
+
+  def do_GET(self):
+    url = urlparse(self.path)
+    if url.path == SEARCH_PATH:
+      self.send_search_results(parse_qs(url.query))
+      return
+    if url.path == WHERE_PATH:
+      self.send_where_results(parse_qs(url.query))
+      return
+    events = self.server.events
+    if events is not None and url.path == EVENTS_PATH:
+      events.serve(self)
+      return
+    head = self.send_head()
+    if head is None:
+      return
+    f, start, end = head
+    try:
+      if start is None:
+        self.copyfile(f, self.wfile)
+      else:
+        self.send_file_range(f, start, end)
+    finally:
+      f.close()
+
+  def do_HEAD(self):
+    head = self.send_head()
+    if head is not None:
+      head[0].close()
+
+  def send_head(self):
+    '''Like SimpleHTTPRequestHandler.send_head, except that it returns
+    (file, start, end): the range of file to send.  start and end are
+    None if all of file is to be copied.'''
+    path = self.translate_path(self.path)
+    if os.path.isdir(path) and urlparse(self.path).path.endswith("/"):
+      # A directory is served as its index file if it has one, like
+      # any other file.
+      for index in ("index.html", "index.htm"):
+        if os.path.isfile(os.path.join(path, index)):
+          path = os.path.join(path, index)
+          break
+    if os.path.isdir(path) or path.endswith("/"):
+      # A redirect to add the missing slash, or a directory listing.
+      f = super().send_head()
+      return None if f is None else (f, None, None)
+    try:
+      f = open(path, "rb")
+    except OSError:
+      self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+      return None
+    if self.server.events is not None and path.endswith(".html"):
+      return self.send_live_reload_head(f)
+    if is_generated(path) and not GENERATED_FILES.is_current(path):
+      f.close()
+      self.send_error(HTTPStatus.NOT_FOUND, "File is out of date")
+      return None
+    try:
+      stat = os.fstat(f.fileno())
+      info = FILE_INFO.get(path, stat)
+      if self.not_modified(info):
+        f.close()
+        self.send_response(HTTPStatus.NOT_MODIFIED)
+        self.send_validators(info)
+        self.end_headers()
+        return None
+      byte_range = None
+      if "Range" in self.headers and self.if_range(info):
+        byte_range = parse_range(self.headers["Range"], info.size)
+      if byte_range == "unsatisfiable":
+        f.close()
+        self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.send_header("Content-Range", "bytes */%d" % info.size)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return None
+      if byte_range is None:
+        start, end = 0, info.size
+        self.send_response(HTTPStatus.OK)
+      else:
+        start, end = byte_range
+        self.send_response(HTTPStatus.PARTIAL_CONTENT)
+        self.send_header("Content-Range",
+                         "bytes %d-%d/%d" % (start, end - 1, info.size))
+      self.send_header("Content-Type", self.guess_type(path))
+      self.send_header("Content-Length", str(end - start))
+      self.send_header("Accept-Ranges", "bytes")
+      self.send_validators(info)
+      self.end_headers()
+      return (f, start, end)
+    except:
+      f.close()
+      raise
+
+  def send_live_reload_head(self, f):
+    '''Send the headers for the HTML file f with LIVE_RELOAD_SCRIPT
+    added to it.  Returns a file of the modified HTML.'''
+    with f:
+      text = f.read()
+    i = text.rfind(b"</body>")
+    if i < 0:
+      i = len(text)
+    text = text[:i] + LIVE_RELOAD_SCRIPT.encode() + text[i:]
+    self.send_response(HTTPStatus.OK)
+    self.send_header("Content-Type", "text/html")
+    self.send_header("Content-Length", str(len(text)))
+    if self.cache_control:
+      self.send_header("Cache-Control", "no-store")
+    self.end_headers()
+    return (io.BytesIO(text), None, None)
+
+  def facility_directory(self, facility):
+    '''Returns the directory of the named facility, or of all of them
+    if facility is None.  Sends an error and returns None if there's no
+    such facility.'''
+    directory = FACILITIES_DIRECTORY
+    if facility:
+      directory = os.path.join(FACILITIES_DIRECTORY, facility)
+      if (os.path.dirname(os.path.normpath(directory)) !=
+          FACILITIES_DIRECTORY):
+        self.send_error(HTTPStatus.NOT_FOUND, "No such facility")
+        return None
+    return directory
+
+  def send_json(self, result):
+    # Infinity and NaN aren't JSON, so they're an error rather than a
+    # response that clients can't parse.
+    body = json.dumps(result, allow_nan=False).encode()
+    self.send_response(HTTPStatus.OK)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.send_header("Cache-Control", "no-store")
+    self.end_headers()
+    self.wfile.write(body)
+
+  def send_search_results(self, query):
+    '''Answer a SEARCH_PATH request.  query is the parsed query
+    string.'''
+    q = query.get("q", [""])[0]
+    facility = query.get("facility", [None])[0]
+    try:
+      limit = int(query.get("limit", ["50"])[0])
+    except ValueError:
+      self.send_error(HTTPStatus.BAD_REQUEST, "limit must be a number")
+      return
+    directory = self.facility_directory(facility)
+    if directory is None:
+      return
+    index = SEARCH_INDICES.get(os.path.join(directory, SEARCH_INDEX))
+    if index is None:
+      self.send_error(HTTPStatus.NOT_FOUND,
+                      "No search index.  Run build.py to make one.")
+      return
+    base = "/" + os.path.relpath(directory, self.directory).replace(
+      os.path.sep, "/") + "/"
+    results = []
+    for score, document in index.search(q, limit):
+      result = dict(document)
+      result["score"] = round(score, 3)
+      result["url"] = base + document["url"]
+      results.append(result)
+    self.send_json({ "query": q, "results": results })
+
+  def send_where_results(self, query):
+    '''Answer a WHERE_PATH request: which items and which shapes of
+    the floor plan contain the point x, y, in real world coordinates,
+    and which k items are nearest to it.  query is the parsed query
+    string.'''
+    facility = query.get("facility", [None])[0]
+    page = query.get("page", [DEFAULT_PAGE])[0]
+    try:
+      x = float(query["x"][0])
+      y = float(query["y"][0])
+      k = int(query.get("k", ["5"])[0])
+    except (KeyError, ValueError):
+      self.send_error(HTTPStatus.BAD_REQUEST,
+                      "x and y, and k if given, must be numbers")
+      return
+    if not (math.isfinite(x) and math.isfinite(y)):
+      self.send_error(HTTPStatus.BAD_REQUEST, "x and y must be finite")
+      return
+    if k > MAX_NEAREST:
+      self.send_error(HTTPStatus.BAD_REQUEST,
+                      "k can be at most %d" % MAX_NEAREST)
+      return
+    if not facility:
+      self.send_error(HTTPStatus.BAD_REQUEST, "No facility")
+      return
+    directory = self.facility_directory(facility)
+    if directory is None:
+      return
+    if os.path.basename(page) != page:
+      self.send_error(HTTPStatus.NOT_FOUND, "No such page")
+      return
+    index = SPATIAL_INDICES.get(directory, page)
+    if index is None:
+      self.send_error(HTTPStatus.NOT_FOUND, "No such floor plan page")
+      return
+    if not index.covers(x, y):
+      self.send_error(HTTPStatus.BAD_REQUEST,
+                      "x and y are too far from the floor plan")
+      return
+    self.send_json({
+      "x": x,
+      "y": y,
+      "items": index.items_at(x, y),
+      "shapes": [shape.summary() for shape in index.shapes_at(x, y)],
+      "nearest": [dict(item, distance=round(d, 3))
+                  for d, item in index.nearest(x, y, k)]
+    })
+
+  def send_validators(self, info):
+    self.send_header("ETag", info.etag)
+    self.send_header("Last-Modified", info.last_modified)
+    if self.cache_control:
+      self.send_header("Cache-Control", self.cache_control)
+
+  def not_modified(self, info):
+    '''Returns True if the request's conditional headers show that the
+    client already has the current version of the file.'''
+    if_none_match = self.headers.get("If-None-Match")
+    if if_none_match is not None:
+      tags = [t.strip() for t in if_none_match.split(",")]
+      # Weak comparison, as RFC 7232 specifies for If-None-Match.
+      return ("*" in tags or info.etag in tags or
+              ("W/" + info.etag) in tags)
+    if_modified_since = self.headers.get("If-Modified-Since")
+    if if_modified_since is not None:
+      try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+      except (TypeError, ValueError, IndexError):
+        return False
+      if since is None:
+        return False
+      return info.mtime <= since.timestamp()
+    return False
+
+  def if_range(self, info):
+    '''Returns True unless an If-Range header says that the client's
+    copy is out of date, in which case the whole file should be sent.'''
+    if_range = self.headers.get("If-Range")
+    if if_range is None:
+      return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+      return if_range == info.etag
+    return if_range == info.last_modified
+
+  def send_file_range(self, f, start, end):
+    self.wfile.flush()
+    offset = start
+    if hasattr(os, "sendfile"):
+      try:
+        while offset < end:
+          sent = os.sendfile(self.connection.fileno(), f.fileno(),
+                             offset, end - offset)
+          if sent == 0:
+            break
+          offset += sent
+        return
+      except OSError:
+        if offset > start:
+          raise
+    f.seek(offset)
+    remaining = end - offset
+    while remaining > 0:
+      block = f.read(min(remaining, 1 << 16))
+      if not block:
+        break
+      self.wfile.write(block)
+      remaining -= len(block)
+
+
+class NoCacheRequestHandler (FileRequestHandler):
   # Cribbed from https://gist.github.com/aallan/9416763d42534ae99f6f0228f54160c9
+  cache_control = None
+
   def end_headers(self):
     self.send_header("Cache-Control", "no-cache, no-store, must-revalidate")
     self.send_header("Pragma", "no-cache")
@@ -25,11 +545,276 @@ class NoCacheRequestHandler (http.server.SimpleHTTPRequestHandler):
     super().end_headers()
 
 
-def run(port):
+################################################################################
+# Live reload
+
+# With -watch, the server watches the facilities and the tools that
+# build them.  When a file changes, build.py is run for the affected
+# facilities.  Since build.py only redoes the steps whose inputs have
+# changed, this is quick.  Then a reload event is sent to the open
+# pages of those facilities.  Pages are told about events by
+# LIVE_RELOAD_SCRIPT, which the server adds to each HTML page that it
+# serves.
+
+EVENTS_PATH = "/events"
+
+LIVE_RELOAD_SCRIPT = '''<script type="text/javascript">
+// Added by web_server.py -watch
+new EventSource("%s").addEventListener("reload", function(event) {
+  if (event.data == "*" ||
+      document.location.pathname.startsWith(event.data)) {
+    document.location.reload();
+  }
+});
+</script>
+''' % EVENTS_PATH
+
+# Changes to these, relative to ROOT, affect every facility.
+WATCHED_TOOLS = [
+  "lib",
+  "floor_plan_cleanup",
+  "build.py",
+  "place_things.py",
+  "merge_static.py",
+  "placement.js",
+  "shared-styles.css"
+]
+
+
+class EventBroadcaster (object):
+  '''EventBroadcaster sends Server-Sent Events to each client that is
+  connected to EVENTS_PATH.'''
+
+  # How often to send a comment to keep idle connections open.
+  KEEPALIVE_SECONDS = 15
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.clients = set()
+
+  def broadcast(self, event, data):
+    with self.lock:
+      for q in self.clients:
+        q.put((event, data))
+
+  def serve(self, handler):
+    '''Stream events to the client of the request handler handler
+    until it disconnects.'''
+    handler.close_connection = True
+    handler.send_response(HTTPStatus.OK)
+    handler.send_header("Content-Type", "text/event-stream")
+    handler.send_header("Cache-Control", "no-store")
+    handler.end_headers()
+    q = queue.Queue()
+    with self.lock:
+      self.clients.add(q)
+    try:
+      while True:
+        try:
+          event, data = q.get(timeout=self.KEEPALIVE_SECONDS)
+          message = "event: %s\ndata: %s\n\n" % (event, data)
+        except queue.Empty:
+          message = ": keepalive\n\n"
+        handler.wfile.write(message.encode())
+        handler.wfile.flush()
+    except (BrokenPipeError, ConnectionResetError):
+      pass
+    finally:
+      with self.lock:
+        self.clients.discard(q)
+
+
+def file_states(paths, ignore):
+  '''Returns a dict mapping each file in or under paths, except those
+  in the set ignore, to its size and modification time.'''
+  states = {}
+  def note(path):
+    if path in ignore or os.path.basename(path).startswith("."):
+      return
+    try:
+      stat = os.stat(path)
+    except OSError:
+      return
+    states[path] = (stat.st_size, stat.st_mtime_ns)
+  for path in paths:
+    if os.path.isdir(path):
+      for directory, subdirectories, files in os.walk(path):
+        subdirectories[:] = [d for d in subdirectories
+                             if not d.startswith(".") and d != "__pycache__"]
+        for f in files:
+          note(os.path.join(directory, f))
+    else:
+      note(path)
+  return states
+
+
+class Watcher (threading.Thread):
+  '''Watcher polls the facilities and tools for changes, rebuilds the
+  affected facilities and tells events about them.  The standard library
+  has no portable file change notification, but a poll of a few hundred
+  files only takes a millisecond or two.  Facilities are rebuilt in
+  this process to save starting another, except when the tools have
+  changed.'''
+
+  def __init__(self, events, interval=0.1, directory=None):
+    super().__init__(daemon=True)
+    self.events = events
+    self.interval = interval
+    # The directory being served, which the URLs of pages are relative
+    # to.
+    self.directory = directory or os.getcwd()
+    sys.path.insert(0, ROOT)
+    import build
+    self.build = build
+    self.tools = [os.path.join(ROOT, t) for t in WATCHED_TOOLS]
+    # The files that building writes, and the states of the files that
+    # say what those are when they were found.
+    self.ignore = None
+    self.ignore_key = None
+
+  def is_build_description(self, path):
+    '''Returns True iff path is a file of a facility that says what
+    building it writes: a page or its cleanup script.'''
+    name = os.path.basename(path)
+    if name == self.build.CLEANUP_SCRIPT:
+      return True
+    return (name.endswith(".html") and not name.startswith("merged_") and
+            not name.startswith("placed_"))
+
+  def ignored(self, states):
+    '''The files that building writes, whose changes we ignore.  Finding
+    them reads every page, so they're only found again when states, the
+    states of the files, show that a page or cleanup script has changed,
+    or after a rebuild.'''
+    key = dict([(p, state) for p, state in states.items()
+                if self.is_build_description(p)])
+    if self.ignore is None or key != self.ignore_key:
+      ignore = set([os.path.join(self.build.FACILITIES_DIRECTORY,
+                                 self.build.SEARCH_INDEX)])
+      for facility in self.build.discover_facilities(
+          self.build.FACILITIES_DIRECTORY):
+        ignore.update(facility.outputs())
+      self.ignore = ignore
+      self.ignore_key = key
+    return self.ignore
+
+  def snapshot(self):
+    states = file_states([self.build.FACILITIES_DIRECTORY] + self.tools,
+                         set())
+    ignore = self.ignored(states)
+    return dict([(p, state) for p, state in states.items()
+                 if p not in ignore])
+
+  def changes(self, before, after):
+    return set([p for p in set(before) | set(after)
+                if before.get(p) != after.get(p)])
+
+  def affected(self, changed):
+    '''Returns the names of the facilities affected by the changed
+    files, or None if all of them are.'''
+    facilities = set()
+    for path in changed:
+      relative = os.path.relpath(path, self.build.FACILITIES_DIRECTORY)
+      if relative.startswith(".."):
+        return None
+      facilities.add(relative.split(os.path.sep)[0])
+    return facilities
+
+  def rebuild(self, facilities):
+    if facilities is None:
+      # The tools have changed, so run the new ones.
+      p = subprocess.run([sys.executable, os.path.join(ROOT, "build.py")],
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                         universal_newlines=True)
+      print(p.stdout, end="")
+      return
+    for facility in self.build.discover_facilities(
+        self.build.FACILITIES_DIRECTORY):
+      if facility.name in facilities:
+        self.build.report(self.build.build_facility(facility))
+    self.build.write_combined_search_index(self.build.FACILITIES_DIRECTORY)
+
+  def url_path(self, facility):
+    return "/" + os.path.relpath(
+      os.path.join(self.build.FACILITIES_DIRECTORY, facility),
+      self.directory).replace(os.path.sep, "/") + "/"
+
+  def run(self):
+    before = None
+    while True:
+      try:
+        before = self.poll(before)
+      except Exception:
+        # Keep watching, so that fixing the problem is noticed.
+        logger().exception("Rebuilding failed")
+        before = None
+      time.sleep(self.interval)
+
+  def poll(self, before):
+    '''Rebuild if anything has changed since before, the snapshot of
+    the last poll, or take a snapshot if before is None.  Returns the new
+    snapshot.'''
+    if before is None:
+      return self.snapshot()
+    after = self.snapshot()
+    changed = self.changes(before, after)
+    if not changed:
+      return after
+    # Wait for the editor to finish writing.
+    while True:
+      time.sleep(self.interval)
+      settled = self.snapshot()
+      more = self.changes(after, settled)
+      after = settled
+      if not more:
+        break
+      changed |= more
+    facilities = self.affected(changed)
+    start = time.perf_counter()
+    try:
+      self.rebuild(facilities)
+    finally:
+      # The rebuild may have written new files, like tiles.
+      self.ignore = None
+    logger().info("Rebuilt in %.2fs after changes to %s" % (
+      time.perf_counter() - start, sorted(changed)))
+    if facilities is None:
+      self.events.broadcast("reload", "*")
+    else:
+      for f in facilities:
+        self.events.broadcast("reload", self.url_path(f))
+    return after
+
+
+class Server (http.server.ThreadingHTTPServer):
+  daemon_threads = True
+
+  # An EventBroadcaster if pages should be live reloaded.
+  events = None
+
+
+parser = argparse.ArgumentParser(
+  description='''Serve the floor plans over HTTP.''')
+
+parser.add_argument("-port", type=int, action="store", default=8000,
+                    help="The port to serve on.")
+
+parser.add_argument("-no_store", action="store_true",
+                    help="Tell browsers not to store anything that is served.")
+
+parser.add_argument("-watch", action="store_true",
+                    help="""Rebuild facilities when their files change and reload the pages that show them.
+Serve from the top level directory of the repository.""")
+
+
+def run(port, handler=FileRequestHandler, watch=False):
   server_address = ('', port)
   logger().info("http://%s:%d/" % (socket.gethostname(), port))
-  httpd = http.server.HTTPServer(server_address, NoCacheRequestHandler)
-  try: 
+  httpd = Server(server_address, handler)
+  if watch:
+    httpd.events = EventBroadcaster()
+    Watcher(httpd.events).start()
+  try:
     logger().info("Starting Webserver on port %d." %  port)
     httpd.serve_forever()
   finally:
@@ -37,7 +822,9 @@ def run(port):
 
 
 if __name__ == '__main__':
+  args = parser.parse_args()
   logging.basicConfig(filename='webserver.log', level=logging.INFO)
-  run(8000)
+  run(args.port,
+      NoCacheRequestHandler if args.no_store else FileRequestHandler,
+      args.watch)
   logging.shutdown()
-